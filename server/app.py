@@ -2,9 +2,24 @@ import os
 from flask import Flask
 from flask_cors import CORS
 from flask_migrate import Migrate
-from flask_session import Session
 from models import db, bcrypt  # assuming you defined db = SQLAlchemy() and bcrypt = Bcrypt() in models.py
 from config import config      # if you use a config.py for different environments
+from cache import response_cache
+from middleware import init_middleware
+from auth_utils import init_auth
+from sessions import init_sessions
+from passwords import password_hasher
+from realtime import init_realtime
+from fanout import notification_fanout
+
+# Browser origins allowed to call the API (and connect to push_server.py)
+FRONTEND_ORIGINS = [
+    "http://localhost:5173",
+    "http://localhost:3000",
+    "http://127.0.0.1:5173",
+    "http://127.0.0.1:3000",
+    "https://your-frontend.netlify.app"  # 🔸 Replace with your Netlify domain
+]
 
 def create_app(config_name=None):
     """Factory function to create and configure the Flask app."""
@@ -18,27 +33,28 @@ def create_app(config_name=None):
         app.config.from_object(config[config_name])
 
     # Database configuration
-    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL")
+    app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL") or app.config.get("SQLALCHEMY_DATABASE_URI")
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
 
     # Initialize extensions
     db.init_app(app)
     bcrypt.init_app(app)
+    password_hasher.init_app(app)
     Migrate(app, db)
-    Session(app)
+    init_sessions(app)
+    response_cache.init_app(app)
+    init_middleware(app)
+    init_auth(app)
+    init_realtime(app)
+    notification_fanout.init_app(app)
 
     # Enable CORS (allow frontend connection)
     CORS(
         app,
         supports_credentials=True,
-        origins=[
-            "http://localhost:5173",
-            "http://localhost:3000",
-            "http://127.0.0.1:5173",
-            "http://127.0.0.1:3000",
-            "https://your-frontend.netlify.app"  # 🔸 Replace with your Netlify domain
-        ],
+        origins=FRONTEND_ORIGINS,
         allow_headers=["Content-Type", "Authorization"],
+        expose_headers=["X-Next-Cursor", "X-Total-Count", "X-Has-More"],
         methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"]
     )
 
@@ -71,10 +87,60 @@ def create_app(config_name=None):
     app.register_blueprint(notifications_bp, url_prefix="/notifications")
     app.register_blueprint(users_bp, url_prefix="/users")
 
+    @app.cli.command("upgrade-schema")
+    def upgrade_schema_command():
+        """Create new tables and columns on an existing database, then backfill them."""
+        from models import upgrade_schema
+        added = upgrade_schema()
+        print(f"Added column(s): {', '.join(added)}" if added else "Schema already up to date")
+
+    @app.cli.command("reconcile-ratings")
+    def reconcile_ratings_command():
+        """Backfill product rating aggregates from the reviews table."""
+        from models import reconcile_rating_aggregates
+        updated = reconcile_rating_aggregates()
+        print(f"Reconciled rating aggregates for {updated} product(s)")
+
+    @app.cli.command("rebuild-search-index")
+    def rebuild_search_index_command():
+        """Create the product full-text index on an existing database and reindex."""
+        from search import rebuild_search_index
+        dialect = rebuild_search_index()
+        print(f"Rebuilt product search index ({dialect})")
+
+    @app.cli.command("rebuild-conversations")
+    def rebuild_conversations_command():
+        """Recompute the conversations inbox table from messages."""
+        from conversations import rebuild_conversations
+        rebuilt = rebuild_conversations()
+        print(f"Rebuilt {rebuilt} conversation(s)")
+
+    @app.cli.command("cleanup-sessions")
+    def cleanup_sessions_command():
+        """Delete expired server-side sessions."""
+        store = getattr(app.session_interface, 'store', None)
+        removed = store.cleanup() if store else 0
+        print(f"Removed {removed} expired session(s)")
+
+    @app.cli.command("sweep-reservations")
+    def sweep_reservations_command():
+        """Release expired stock reservations in batches."""
+        from inventory import sweep_expired
+        released = sweep_expired()
+        print(f"Released {released} expired reservation(s)")
+
+    @app.cli.command("prune-revoked-tokens")
+    def prune_revoked_tokens_command():
+        """Delete token revocations whose tokens have expired."""
+        from tokens import prune_revocations
+        removed = prune_revocations()
+        print(f"Pruned {removed} expired token revocation(s)")
+
     # Simple health check endpoint
     @app.route("/health")
     def health_check():
-        return {"status": "healthy", "message": "SokoDigital API is running"}, 200
+        return {"status": "healthy", "message": "SokoDigital API is running", "cache": response_cache.stats(),
+                "fanout": notification_fanout.stats()}, 200
 
     return app
 
@@ -1,44 +1,167 @@
-from flask import session, jsonify
+from flask import session, jsonify, g, current_app, request
 from functools import wraps
-from models import User
+from models import db, User
+from cache import MemoryCache
+from tokens import init_tokens, verify_access_token, TokenError
+
+# AUTH_MODE selects how requests authenticate:
+#   'session'  the session cookie set at login (default)
+#   'jwt'      an "Authorization: Bearer <access token>" header (see tokens.py)
+#   'both'     a bearer token when one is sent, the session cookie otherwise
+# A valid access token answers login_required and require_role from its
+# claims alone, with no database or session-store lookup.
+#
+# For sessions, the logged-in user is resolved at most once per request and
+# kept on flask.g, so login_required, require_role and the view share one
+# lookup. With IDENTITY_CACHE_TTL > 0, the (id, role) identity is also cached
+# across requests for that many seconds: login_required and require_role
+# then need no query at all, and views that only check the role can use
+# get_current_user_role(). Role changes and deletions call forget_identity().
+
+_MISSING = object()
+
+
+def init_auth(app):
+    init_tokens(app)
+
+    # g normally dies with the request, but an app context pushed around
+    # several requests (CLI commands, tests) would carry the user over
+    @app.before_request
+    def reset_current_user():
+        g.pop('current_user', None)
+        g.pop('current_identity', None)
+        g.pop('token_claims', None)
+
+
+def auth_mode():
+    return current_app.config.get('AUTH_MODE', 'session')
+
+
+def get_bearer_token():
+    scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+    return token.strip() if scheme.lower() == 'bearer' and token.strip() else None
+
+
+def get_token_claims():
+    """Verified access-token claims of this request, or None"""
+    claims = g.get('token_claims', _MISSING)
+    if claims is not _MISSING:
+        return claims
+
+    claims = None
+    if auth_mode() != 'session':
+        token = get_bearer_token()
+        if token:
+            try:
+                claims = verify_access_token(token)
+            except TokenError:
+                claims = None
+    g.token_claims = claims
+    return claims
+
+
+def _identity_cache():
+    ttl = current_app.config.get('IDENTITY_CACHE_TTL', 0)
+    if not ttl:
+        return None, 0
+    cache = current_app.extensions.get('identity_cache')
+    if cache is None:
+        cache = current_app.extensions['identity_cache'] = MemoryCache(
+            max_entries=current_app.config.get('IDENTITY_CACHE_MAX_ENTRIES', 10000))
+    return cache, ttl
+
+
+def _remember_identity(user):
+    cache, ttl = _identity_cache()
+    if cache is not None:
+        cache.set(user.id, (user.id, user.role), ttl)
+
+
+def forget_identity(user_id):
+    """Drop a user's cached identity after their role changes or they are deleted"""
+    cache, _ = _identity_cache()
+    if cache is not None:
+        cache.delete(user_id)
+    identity = g.get('current_identity')
+    if identity and identity[0] == user_id:
+        g.pop('current_user', None)
+        g.pop('current_identity', None)
+
+
+def get_current_identity():
+    """(user_id, role) of the logged-in user, or None"""
+    identity = g.get('current_identity', _MISSING)
+    if identity is not _MISSING:
+        return identity
+
+    claims = get_token_claims()
+    if claims:
+        identity = (int(claims['sub']), claims.get('role'))
+    else:
+        user_id = get_current_user_id()
+        identity = None
+        if user_id:
+            cache, _ = _identity_cache()
+            identity = cache.get(user_id) if cache is not None else None
+            if identity is None:
+                user = get_current_user()
+                identity = (user.id, user.role) if user else None
+    g.current_identity = identity
+    return identity
+
 
 def login_required(f):
     """Decorator to ensure user is logged in"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        user_id = session.get('user_id')
+        user_id = get_current_user_id()
         if not user_id:
             return jsonify({'error': 'Authentication required', 'authenticated': False}), 401
-        
+
         # Verify user still exists
-        user = User.query.get(user_id)
-        if not user:
+        if not get_current_identity():
             session.clear()
             return jsonify({'error': 'User not found', 'authenticated': False}), 401
-        
+
         return f(*args, **kwargs)
     return decorated_function
 
 def get_current_user():
-    """Get the currently logged-in user"""
-    user_id = session.get('user_id')
-    if user_id:
-        return User.query.get(user_id)
-    return None
+    """Get the currently logged-in user (loaded once per request)"""
+    user = g.get('current_user', _MISSING)
+    if user is not _MISSING:
+        return user
+
+    user_id = get_current_user_id()
+    user = db.session.get(User, user_id) if user_id else None
+    g.current_user = user
+    if user:
+        _remember_identity(user)
+    return user
 
 def get_current_user_id():
-    """Get the current user's ID from session"""
+    """Get the current user's ID from the access token or the session"""
+    claims = get_token_claims()
+    if claims:
+        return int(claims['sub'])
+    if auth_mode() == 'jwt':
+        return None
     return session.get('user_id')
 
+def get_current_user_role():
+    """Get the current user's role without loading the user when it is cached"""
+    identity = get_current_identity()
+    return identity[1] if identity else None
+
 def require_role(role):
     """Decorator to ensure user has specific role"""
     def decorator(f):
         @wraps(f)
         def decorated_function(*args, **kwargs):
-            user = get_current_user()
-            if not user:
+            user_role = get_current_user_role()
+            if not user_role:
                 return jsonify({'error': 'Authentication required'}), 401
-            if user.role.lower() != role.lower():
+            if user_role.lower() != role.lower():
                 return jsonify({'error': f'Access denied. {role.capitalize()} role required.'}), 403
             return f(*args, **kwargs)
         return decorated_function
@@ -50,7 +173,12 @@ def set_user_session(user):
     session['user_email'] = user.email
     session['user_role'] = user.role
     session.permanent = True
+    g.current_user = user
+    g.current_identity = (user.id, user.role)
+    _remember_identity(user)
 
 def clear_user_session():
     """Clear user session data"""
     session.clear()
+    g.pop('current_user', None)
+    g.pop('current_identity', None)
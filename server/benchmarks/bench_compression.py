@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""
+Bytes-on-the-wire benchmark: product listing payload size with and without
+Accept-Encoding negotiation, and the cost of a conditional (304) refetch.
+Run with: python benchmarks/bench_compression.py [products]
+"""
+import os
+import sys
+import timeit
+
+# Add the server directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from app import create_app
+from models import db, User, Product
+from middleware import brotli
+
+PRODUCTS = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+REPEAT = 5
+URL = '/products/?per_page=100'
+
+
+def seed():
+    artisan = User(full_name='Bench Artisan', email='bench-artisan@test.com', role='artisan',
+                   location='Nairobi', password_hash='x')
+    db.session.add(artisan)
+    db.session.flush()
+    db.session.bulk_insert_mappings(Product, [
+        {'title': f'Product {i}', 'description': f'Handmade sisal basket number {i}, woven in Machakos',
+         'price': 100 + i, 'stock': i % 7 + 1, 'artisan_id': artisan.id, 'status': 'active'}
+        for i in range(PRODUCTS)
+    ])
+    db.session.commit()
+
+
+def measure(label, client, headers):
+    best = min(timeit.repeat(lambda: client.get(URL, headers=headers), number=1, repeat=REPEAT))
+    response = client.get(URL, headers=headers)
+    encoding = response.headers.get('Content-Encoding', 'identity')
+    print(f"{label:<28} {response.status_code:>4} {encoding:<9} {len(response.data):>8} bytes "
+          f"{best * 1000:8.1f} ms")
+    return response
+
+
+def main():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        seed()
+        client = app.test_client()
+
+        print(f"GET {URL} (best of {REPEAT}, brotli {'available' if brotli else 'not installed'})")
+        plain = measure('no Accept-Encoding', client, {})
+        gzipped = measure('Accept-Encoding: gzip', client, {'Accept-Encoding': 'gzip'})
+        if brotli:
+            measure('Accept-Encoding: br, gzip', client, {'Accept-Encoding': 'br, gzip'})
+        measure('If-None-Match (304)', client, {'If-None-Match': plain.headers['ETag']})
+        print(f"{'gzip ratio':<28} {len(plain.data) / len(gzipped.data):8.1f} x")
+
+
+if __name__ == '__main__':
+    main()
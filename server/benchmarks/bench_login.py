@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+"""
+Login throughput against the number of gunicorn workers: the app is served
+by gunicorn.conf.py (gthread workers, GUNICORN_THREADS each, a bcrypt pool
+of BCRYPT_POOL_SIZE processes per worker) and a burst of concurrent
+clients hits POST /auth/login over HTTP.
+Run with: python benchmarks/bench_login.py [logins] [rounds]
+"""
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+
+SERVER_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+# Add the server directory to Python path
+sys.path.insert(0, SERVER_DIR)
+
+CLIENTS = 16
+WORKER_COUNTS = [1, 2, 4]
+PORT = 5099
+
+
+def bench_app():
+    """The gunicorn entry point: the testing app on DATABASE_URL at the benchmark's bcrypt settings"""
+    from app import create_app
+    from passwords import password_hasher
+    app = create_app('testing')
+    # Passed through the environment, which the gunicorn workers inherit
+    app.config.update(BCRYPT_LOG_ROUNDS=int(os.environ['BCRYPT_LOG_ROUNDS']),
+                      BCRYPT_POOL_SIZE=int(os.environ.get('BCRYPT_POOL_SIZE', 2)),
+                      WORKER_THREADS=int(os.environ.get('GUNICORN_THREADS', 4)))
+    password_hasher.init_app(app)
+    return app
+
+
+def seed():
+    from models import db, User
+    app = bench_app()
+    with app.app_context():
+        db.create_all()
+        user = User(full_name='Bench User', email='bench@test.com', role='buyer')
+        user.set_password('password123')
+        db.session.add(user)
+        db.session.commit()
+
+
+def request(path, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(f'http://127.0.0.1:{PORT}{path}', data=data,
+                                 headers={'Content-Type': 'application/json'})
+    try:
+        with urllib.request.urlopen(req, timeout=120) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+
+
+def serve(workers):
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', os.path.join(SERVER_DIR, 'gunicorn.conf.py'),
+         '--workers', str(workers), '--bind', f'127.0.0.1:{PORT}', '--pythonpath', SERVER_DIR,
+         '--chdir', os.path.dirname(os.path.abspath(__file__)), 'bench_login:bench_app()'],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if request('/health') == 200:
+                return server
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def run(workers, logins):
+    server = serve(workers)
+    statuses = []
+    per_client = logins // CLIENTS
+
+    def login_burst():
+        for _ in range(per_client):
+            statuses.append(request('/auth/login', {'email': 'bench@test.com', 'password': 'password123'}))
+
+    threads = [threading.Thread(target=login_burst) for _ in range(CLIENTS)]
+    try:
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+
+    ok = statuses.count(200)
+    print(f"{workers:>8} {ok / elapsed:10.1f} {ok:6d} {statuses.count(429):6d} {elapsed:8.2f}s")
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 64
+    os.environ['BCRYPT_LOG_ROUNDS'] = sys.argv[2] if len(sys.argv) > 2 else '12'
+    os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='soko-bench-'), 'login.db')
+    seed()
+    print(f"{logins} logins from {CLIENTS} concurrent clients, bcrypt cost {os.environ['BCRYPT_LOG_ROUNDS']}, "
+          f"{os.environ.get('GUNICORN_THREADS', 4)} threads and {os.environ.get('BCRYPT_POOL_SIZE', 2)} "
+          f"hashing processes per worker, {os.cpu_count()} CPU(s)")
+    print(f"{'workers':>8} {'logins/s':>10} {'200':>6} {'429':>6} {'elapsed':>9}")
+    for workers in WORKER_COUNTS:
+        run(workers, logins)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Follower notification fan-out: notifications per second when an artisan
+with many followers lists a product, one add-and-commit per follower (what
+create_notification does) versus the chunked bulk-insert job of fanout.py
+run on its worker pool. The per-row path is timed on a sample.
+Set DATABASE_URL to a PostgreSQL database to measure the COPY path.
+Run with: python benchmarks/bench_notification_fanout.py [followers]
+"""
+import os
+import sys
+import time
+
+# Add the server directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import insert
+from app import create_app
+from models import db, User, Follow, Notification
+from fanout import notification_fanout, notify_followers
+
+FOLLOWERS = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+PER_ROW_SAMPLE = min(FOLLOWERS, 2000)
+
+
+def seed():
+    artisan = User(full_name='Bench Artisan', email='bench-artisan@test.com', role='artisan')
+    artisan.set_password('password123')
+    db.session.add(artisan)
+    db.session.flush()
+    db.session.execute(insert(User), [
+        {'full_name': f'Follower {index}', 'email': f'follower-{index}@test.com', 'password_hash': 'x',
+         'role': 'buyer'}
+        for index in range(FOLLOWERS)])
+    follower_ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.role == 'buyer')]
+    db.session.execute(insert(Follow), [{'follower_id': follower_id, 'artisan_id': artisan.id}
+                                        for follower_id in follower_ids])
+    db.session.commit()
+    return artisan.id, follower_ids
+
+
+def report(label, rows, elapsed):
+    print(f"{label:<10} {rows:>8} rows {elapsed:8.2f} s {rows / elapsed:10.0f} rows/s "
+          f"{FOLLOWERS / (rows / elapsed):8.2f} s for all followers")
+
+
+def main():
+    app = create_app('testing')
+    with app.app_context():
+        db.create_all()
+        artisan_id, follower_ids = seed()
+        print(f"{FOLLOWERS} followers, chunks of {app.config['NOTIFY_FANOUT_CHUNK_SIZE']}, "
+              f"{db.engine.dialect.name}")
+
+        start = time.perf_counter()
+        for follower_id in follower_ids[:PER_ROW_SAMPLE]:
+            db.session.add(Notification(user_id=follower_id, message='Per row', type='new_product'))
+            db.session.commit()
+        report('per-row', PER_ROW_SAMPLE, time.perf_counter() - start)
+
+        notification_fanout.configure(1)
+        start = time.perf_counter()
+        notification_fanout.submit(notify_followers, artisan_id, 'Fan-out', 'new_product')
+        notification_fanout.drain()
+        elapsed = time.perf_counter() - start
+        report('fan-out', Notification.query.filter_by(message='Fan-out').count(), elapsed)
+        print(notification_fanout.stats())
+        notification_fanout.configure(0)
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Order export memory: peak Python heap while an artisan's orders are
+exported, building the whole body at once (.all()) versus streaming
+/orders/export in yield_per batches.
+Run with: python benchmarks/bench_order_export.py [orders]
+"""
+import csv
+import io
+import os
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+# Add the server directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import insert
+from app import create_app
+from models import db, User, Product, Order, OrderItem
+from serializers import order_export_query, stream_order_export, ORDER_EXPORT_FIELDS, _export_values
+
+ORDERS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+
+def seed():
+    artisan = User(full_name='Bench Artisan', email='bench-artisan@test.com', role='artisan')
+    buyer = User(full_name='Bench Buyer', email='bench-buyer@test.com', role='buyer')
+    for user in (artisan, buyer):
+        user.set_password('password123')
+    db.session.add_all([artisan, buyer])
+    db.session.flush()
+    product = Product(title='Bench Basket', description='d', price=20, stock=0, artisan_id=artisan.id)
+    db.session.add(product)
+    db.session.flush()
+
+    start = datetime(2024, 1, 1)
+    db.session.execute(insert(Order), [
+        {'id': index, 'user_id': buyer.id, 'total_amount': 20, 'status': 'delivered',
+         'created_at': start + timedelta(minutes=index), 'updated_at': start}
+        for index in range(1, ORDERS + 1)])
+    db.session.execute(insert(OrderItem), [
+        {'order_id': index, 'product_id': product.id, 'quantity': 1, 'unit_price': 20, 'total_price': 20,
+         'artisan_id': artisan.id}
+        for index in range(1, ORDERS + 1)])
+    db.session.commit()
+    return artisan.id
+
+
+def measure(label, export):
+    db.session.expunge_all()
+    tracemalloc.start()
+    start = time.perf_counter()
+    size = export()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:<10} {elapsed:8.2f} s {peak / 2**20:10.1f} MiB peak {size / 2**20:8.1f} MiB body")
+
+
+def main():
+    app = create_app('testing')
+    with app.test_request_context():
+        db.create_all()
+        artisan_id = seed()
+        query = lambda: order_export_query(OrderItem.artisan_id == artisan_id)
+
+        def buffered():
+            # What the endpoint would hold if it read every row before answering
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(ORDER_EXPORT_FIELDS)
+            writer.writerows(_export_values(row) for row in query().all())
+            return len(buffer.getvalue())
+
+        def streamed():
+            return sum(len(chunk) for chunk in stream_order_export(query(), 'csv', batch_size=1000))
+
+        print(f"{ORDERS} orders, CSV export")
+        measure('buffered', buffered)
+        measure('streamed', streamed)
+        db.drop_all()
+
+
+if __name__ == '__main__':
+    main()
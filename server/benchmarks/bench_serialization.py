@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark: ORM to_dict() + jsonify versus column projection + fast JSON
+for the product listing and cart payloads.
+Run with: python benchmarks/bench_serialization.py [products]
+"""
+import os
+import sys
+import timeit
+
+# Add the server directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import jsonify
+from app import create_app
+from models import db, User, Product, Cart
+from serializers import project_products, serialize_products, cart_query, serialize_cart, dumps, orjson
+
+PRODUCTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+REPEAT = 5
+
+
+def seed():
+    artisan = User(full_name='Bench Artisan', email='bench-artisan@test.com', role='artisan',
+                   location='Nairobi', password_hash='x')
+    buyer = User(full_name='Bench Buyer', email='bench-buyer@test.com', role='buyer', password_hash='x')
+    db.session.add_all([artisan, buyer])
+    db.session.flush()
+    db.session.bulk_insert_mappings(Product, [
+        {'title': f'Product {i}', 'description': 'Handmade ' * 40, 'price': 100 + i, 'stock': i % 7,
+         'artisan_id': artisan.id, 'status': 'active', 'rating_sum': 9, 'rating_count': 2}
+        for i in range(PRODUCTS)
+    ])
+    db.session.flush()
+    db.session.bulk_insert_mappings(Cart, [
+        {'user_id': buyer.id, 'product_id': product_id, 'quantity': 1}
+        for (product_id,) in db.session.query(Product.id).limit(50)
+    ])
+    db.session.commit()
+    return buyer.id
+
+
+def measure(label, fn):
+    db.session.expunge_all()
+    best = min(timeit.repeat(fn, number=1, repeat=REPEAT))
+    print(f"{label:<40} {best * 1000:8.1f} ms")
+    return best
+
+
+def main():
+    app = create_app('testing')
+    with app.app_context(), app.test_request_context():
+        db.create_all()
+        buyer_id = seed()
+
+        print(f"Serializing {PRODUCTS} products (best of {REPEAT}, encoder: {'orjson' if orjson else 'json'})")
+        orm = measure('products: ORM to_dict + jsonify', lambda: jsonify(
+            [p.to_dict() for p in Product.query.filter_by(status='active').all()]).get_data())
+        projected = measure('products: projection + dumps', lambda: dumps(
+            serialize_products(project_products(Product.query.filter_by(status='active')))))
+        print(f"{'speedup':<40} {orm / projected:8.1f} x\n")
+
+        orm = measure('cart: ORM to_dict + jsonify', lambda: jsonify(
+            [c.to_dict() for c in Cart.query.filter_by(user_id=buyer_id).all()]).get_data())
+        projected = measure('cart: projection + dumps', lambda: dumps(serialize_cart(cart_query(buyer_id))))
+        print(f"{'speedup':<40} {orm / projected:8.1f} x")
+
+
+if __name__ == '__main__':
+    main()
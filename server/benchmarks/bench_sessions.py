@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Session store latency: one request that only reads the session and one that
+modifies it, per SESSION_TYPE.
+Run with: python benchmarks/bench_sessions.py [requests]
+"""
+import os
+import sys
+import tempfile
+import time
+
+# Add the server directory to Python path
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import session
+from app import create_app
+from models import db
+from sessions import init_sessions
+
+REQUESTS = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+BACKENDS = ['cookie', 'fakeredis', 'sqlalchemy', 'filesystem']
+
+
+def session_read():
+    return {'user_id': session.get('user_id')}
+
+
+def session_write():
+    session['visits'] = session.get('visits', 0) + 1
+    return {'visits': session['visits']}
+
+
+def measure(client, url):
+    start = time.perf_counter()
+    for _ in range(REQUESTS):
+        client.get(url)
+    return (time.perf_counter() - start) / REQUESTS * 1e6
+
+
+def run(backend, database):
+    app = create_app('testing')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    app.config['SESSION_TYPE'] = backend
+    app.config['SESSION_FILE_DIR'] = tempfile.mkdtemp(prefix='soko-sessions-')
+    init_sessions(app)
+    app.add_url_rule('/bench/read', 'bench_read', session_read)
+    app.add_url_rule('/bench/write', 'bench_write', session_write)
+
+    with app.app_context():
+        db.create_all()
+        client = app.test_client()
+        client.get('/bench/write')
+        read = measure(client, '/bench/read')
+        write = measure(client, '/bench/write')
+        db.drop_all()
+    print(f"{backend:<12} {read:10.0f} µs {write:10.0f} µs")
+
+
+def main():
+    # A file database, so the SQL store pays for real commits
+    database = 'sqlite:///' + os.path.join(tempfile.mkdtemp(prefix='soko-bench-'), 'sessions.db')
+    print(f"Per-request latency over {REQUESTS} requests")
+    print(f"{'backend':<12} {'read':>13} {'write':>13}")
+    for backend in BACKENDS:
+        run(backend, database)
+
+
+if __name__ == '__main__':
+    main()
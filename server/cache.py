@@ -0,0 +1,326 @@
+import base64
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import current_app, request, session, make_response, Response
+
+# Response cache for public GET endpoints.
+#
+#   @products_bp.route('/<int:product_id>')
+#   @cached(ttl=60, tags=['products', 'product:{product_id}'])
+#   def get_product(product_id): ...
+#
+# Keys are derived from the request path, sorted query args and the caller's
+# role. Tags are formatted with the view's arguments; write routes call
+# invalidate('product:7') to drop every cached response carrying that tag.
+#
+# Backends (CACHE_TYPE): 'memory' (per-process TTL + LRU), 'redis' (shared,
+# CACHE_REDIS_URL) and 'null' (disabled). FakeRedis is an in-process
+# stand-in for the redis client, for tests and local development.
+# invalidate() only reaches the calling worker's memory backend; other
+# workers keep their entries until the TTL runs out.
+
+CACHED_HEADERS = ('Content-Type', 'X-Next-Cursor', 'X-Total-Count')
+
+
+class NullCache:
+    def get(self, key):
+        return None
+
+    def set(self, key, value, ttl, tags=()):
+        pass
+
+    def invalidate_tags(self, *tags):
+        pass
+
+    def clear(self):
+        pass
+
+
+class MemoryCache:
+    """Per-process cache with per-entry TTL and least-recently-used eviction"""
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (expires_at, value, tags)
+        self._tags = {}  # tag -> set of keys
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def set(self, key, value, ttl, tags=()):
+        with self._lock:
+            self._discard(key)
+            self._entries[key] = (time.monotonic() + ttl, value, tuple(tags))
+            for tag in tags:
+                self._tags.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._discard(next(iter(self._entries)))
+
+    def delete(self, key):
+        with self._lock:
+            self._discard(key)
+
+    def invalidate_tags(self, *tags):
+        with self._lock:
+            for tag in tags:
+                for key in list(self._tags.pop(tag, ())):
+                    self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tags.clear()
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for tag in entry[2]:
+            keys = self._tags.get(tag)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._tags[tag]
+
+
+class RedisCache:
+    """Cache shared by all workers, stored in Redis (or anything speaking its API)"""
+
+    def __init__(self, client, prefix='soko:cache:'):
+        self.client = client
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.client.get(self.prefix + key)
+
+    def set(self, key, value, ttl, tags=()):
+        self.client.set(self.prefix + key, value, ex=ttl)
+        for tag in tags:
+            tag_key = self.prefix + 'tag:' + tag
+            self.client.sadd(tag_key, key)
+            # Tag sets outlive their newest entry by one TTL at most
+            self.client.expire(tag_key, ttl)
+
+    def invalidate_tags(self, *tags):
+        for tag in tags:
+            tag_key = self.prefix + 'tag:' + tag
+            keys = [self.prefix + member.decode('utf-8') if isinstance(member, bytes) else self.prefix + member
+                    for member in self.client.smembers(tag_key)]
+            self.client.delete(tag_key, *keys)
+
+    def clear(self):
+        keys = list(self.client.scan_iter(match=self.prefix + '*'))
+        if keys:
+            self.client.delete(*keys)
+
+
+class FakeRedis:
+    """Thread-safe in-process stand-in for the subset of redis-py the app uses"""
+
+    def __init__(self):
+        self._data = {}
+        self._expiry = {}
+        self._lock = threading.RLock()
+
+    def _expired(self, key):
+        expires_at = self._expiry.get(key)
+        if expires_at is not None and expires_at <= time.monotonic():
+            self._data.pop(key, None)
+            self._expiry.pop(key, None)
+            return True
+        return False
+
+    def _encode(self, value):
+        if isinstance(value, bytes):
+            return value
+        return str(value).encode('utf-8')
+
+    def get(self, key):
+        with self._lock:
+            if self._expired(key):
+                return None
+            value = self._data.get(key)
+            return value if isinstance(value, bytes) else None
+
+    def set(self, key, value, ex=None, nx=False):
+        with self._lock:
+            if nx and not self._expired(key) and key in self._data:
+                return None
+            self._data[key] = self._encode(value)
+            if ex is not None:
+                self._expiry[key] = time.monotonic() + ex
+            else:
+                self._expiry.pop(key, None)
+            return True
+
+    def delete(self, *keys):
+        with self._lock:
+            removed = 0
+            for key in keys:
+                if self._data.pop(key, None) is not None:
+                    removed += 1
+                self._expiry.pop(key, None)
+            return removed
+
+    def exists(self, key):
+        with self._lock:
+            return int(not self._expired(key) and key in self._data)
+
+    def expire(self, key, seconds):
+        with self._lock:
+            if key not in self._data:
+                return False
+            self._expiry[key] = time.monotonic() + seconds
+            return True
+
+    def incr(self, key, amount=1):
+        with self._lock:
+            value = 0 if self._expired(key) else int(self._data.get(key, b'0'))
+            value += amount
+            self._data[key] = self._encode(value)
+            return value
+
+    def sadd(self, key, *members):
+        with self._lock:
+            self._expired(key)
+            current = self._data.setdefault(key, set())
+            before = len(current)
+            current.update(self._encode(member) for member in members)
+            return len(current) - before
+
+    def srem(self, key, *members):
+        with self._lock:
+            current = self._data.get(key, set())
+            before = len(current)
+            current.difference_update(self._encode(member) for member in members)
+            return before - len(current)
+
+    def smembers(self, key):
+        with self._lock:
+            if self._expired(key):
+                return set()
+            return set(self._data.get(key, set()))
+
+    def scan_iter(self, match='*'):
+        prefix = match[:-1] if match.endswith('*') else match
+        with self._lock:
+            keys = [key for key in self._data if key.startswith(prefix) and not self._expired(key)]
+        return iter(keys)
+
+    def flushall(self):
+        with self._lock:
+            self._data.clear()
+            self._expiry.clear()
+
+
+def create_backend(config):
+    cache_type = config.get('CACHE_TYPE', 'memory')
+    if cache_type == 'memory':
+        return MemoryCache(max_entries=config.get('CACHE_MAX_ENTRIES', 1024))
+    if cache_type == 'redis':
+        import redis
+        return RedisCache(redis.Redis.from_url(config['CACHE_REDIS_URL']))
+    if cache_type == 'fakeredis':
+        return RedisCache(FakeRedis())
+    return NullCache()
+
+
+class ResponseCache:
+    def init_app(self, app, backend=None):
+        app.extensions['response_cache'] = {
+            'backend': backend or create_backend(app.config),
+            'default_ttl': app.config.get('CACHE_DEFAULT_TTL', 60),
+            'hits': 0,
+            'misses': 0
+        }
+
+    @property
+    def _state(self):
+        return current_app.extensions['response_cache']
+
+    @property
+    def backend(self):
+        return self._state['backend']
+
+    def make_key(self):
+        role = session.get('user_role') or 'anonymous'
+        args = sorted(request.args.items(multi=True))
+        raw = json.dumps([request.path, args, role])
+        return hashlib.sha1(raw.encode('utf-8')).hexdigest()
+
+    def invalidate(self, *tags):
+        """Drop every cached response carrying any of tags"""
+        self.backend.invalidate_tags(*tags)
+
+    def stats(self):
+        state = self._state
+        lookups = state['hits'] + state['misses']
+        return {
+            'backend': type(state['backend']).__name__,
+            'hits': state['hits'],
+            'misses': state['misses'],
+            'hit_ratio': round(state['hits'] / lookups, 3) if lookups else 0.0
+        }
+
+    def cached(self, ttl=None, tags=()):
+        """Cache successful GET responses of a view"""
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                if request.method != 'GET':
+                    return f(*args, **kwargs)
+
+                state = self._state
+                key = self.make_key()
+                stored = state['backend'].get(key)
+                if stored is not None:
+                    state['hits'] += 1
+                    response = deserialize_response(stored)
+                    response.headers['X-Cache'] = 'HIT'
+                    return response
+
+                state['misses'] += 1
+                response = make_response(f(*args, **kwargs))
+                if response.status_code == 200:
+                    entry_tags = [tag.format(**kwargs) for tag in tags]
+                    state['backend'].set(key, serialize_response(response),
+                                         ttl or state['default_ttl'], entry_tags)
+                response.headers['X-Cache'] = 'MISS'
+                return response
+            return decorated_function
+        return decorator
+
+
+def serialize_response(response):
+    headers = {name: response.headers[name] for name in CACHED_HEADERS if name in response.headers}
+    return json.dumps({
+        'status': response.status_code,
+        'headers': headers,
+        'body': base64.b64encode(response.get_data()).decode('ascii')
+    }).encode('utf-8')
+
+
+def deserialize_response(stored):
+    data = json.loads(stored)
+    response = Response(base64.b64decode(data['body']), status=data['status'])
+    for name, value in data['headers'].items():
+        response.headers[name] = value
+    return response
+
+
+response_cache = ResponseCache()
+cached = response_cache.cached
+invalidate = response_cache.invalidate
@@ -0,0 +1,155 @@
+import json
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import and_, func
+from models import db, Cart, Product, Reservation, upsert_rows
+from inventory import reclaim_expired, reserve_many
+from cache import response_cache, invalidate, RedisCache
+
+# Bulk cart writes: PUT /cart/bulk and merging a guest cart at login.
+#
+#   1. one SELECT of the requested products, LEFT JOINed to the user's cart
+#      lines and holds on them, validates every line at once
+#   2. inventory.reserve_many moves the holds in a few bulk statements
+#   3. one INSERT ... ON CONFLICT (user_id, product_id) DO UPDATE writes
+#      every remaining line, and one DELETE drops the lines set to 0
+#
+# Nothing is committed here; the caller commits once, so a failed line
+# leaves the whole cart as it was.
+#
+# GET /cart/summary (item count, subtotal, currency) is one aggregate query,
+# cached per user in the response cache backend under the tag cart:<user id>.
+# Every write to a user's cart calls invalidate_cart(user_id) once it has
+# committed; price or currency changes and deletions of a product call
+# invalidate_carts_holding(product_id) while the cart lines still exist.
+# Only Redis is shared by the workers: with the per-process memory backend
+# an invalidation misses the other workers, so summaries are kept for
+# CART_SUMMARY_LOCAL_TTL seconds there instead of CART_SUMMARY_TTL.
+
+
+class CartError(Exception):
+    """A bulk cart request that can't be applied as sent"""
+
+    def __init__(self, message, status=400, product_ids=None):
+        super().__init__(message)
+        self.status = status
+        self.product_ids = product_ids or []
+
+    def to_dict(self):
+        body = {'error': str(self)}
+        if self.product_ids:
+            body['product_ids'] = self.product_ids
+        return body
+
+
+def parse_cart_lines(items, merge=False):
+    """{product_id: quantity} from [{product_id, quantity}]; quantity 0 removes a line unless merging"""
+    if not isinstance(items, list) or not items:
+        raise CartError('items must be a non-empty list of {product_id, quantity}')
+
+    quantities = {}
+    for item in items:
+        try:
+            product_id = int(item['product_id'])
+            quantity = int(item.get('quantity', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise CartError('Each item needs an integer product_id and quantity')
+        if quantity < 0 or (merge and quantity == 0):
+            raise CartError('Invalid quantity', product_ids=[product_id])
+        if product_id in quantities:
+            if not merge:
+                raise CartError('Duplicate product_id', product_ids=[product_id])
+            quantities[product_id] += quantity
+        else:
+            quantities[product_id] = quantity
+    return quantities
+
+
+def apply_cart_lines(user_id, items, merge=False):
+    """Set (or with merge, add to) the quantities of several cart lines; the caller commits"""
+    quantities = parse_cart_lines(items, merge)
+
+    rows = db.session.query(
+        Product.id, Product.title, Product.stock, Product.reserved,
+        Cart.quantity.label('in_cart'), Reservation.quantity.label('held')
+    ).outerjoin(Cart, and_(Cart.product_id == Product.id, Cart.user_id == user_id)).outerjoin(
+        Reservation, and_(Reservation.product_id == Product.id, Reservation.user_id == user_id)
+    ).filter(Product.id.in_(quantities)).all()
+    found = {row.id: row for row in rows}
+
+    missing = [product_id for product_id in quantities if product_id not in found]
+    if missing:
+        raise CartError('Product not found', 404, missing)
+    if merge:
+        quantities = {product_id: quantity + (found[product_id].in_cart or 0)
+                      for product_id, quantity in quantities.items()}
+
+    def available(row, freed=0):
+        return (row.stock or 0) - (row.reserved or 0) + (row.held or 0) + freed
+
+    short = [product_id for product_id, quantity in quantities.items()
+             if quantity > available(found[product_id])]
+    if short:
+        # Expired holds still count until swept; free them before giving up
+        freed = reclaim_expired(user_id, short)
+        short = [product_id for product_id in short
+                 if quantities[product_id] > available(found[product_id], freed[product_id])]
+    if short:
+        titles = ', '.join(found[product_id].title for product_id in short)
+        raise CartError(f'Insufficient stock for {titles}', 400, short)
+
+    reserve_many(user_id, quantities)
+
+    dropped = [product_id for product_id, quantity in quantities.items() if not quantity]
+    if dropped:
+        Cart.query.filter(Cart.user_id == user_id, Cart.product_id.in_(dropped)).delete(
+            synchronize_session=False)
+    now = datetime.utcnow()
+    kept = [{'user_id': user_id, 'product_id': product_id, 'quantity': quantity,
+             'created_at': now, 'updated_at': now}
+            for product_id, quantity in quantities.items() if quantity]
+    if kept:
+        upsert_rows(Cart, kept, ['user_id', 'product_id'], ['quantity', 'updated_at'])
+
+
+def invalidate_cart(user_id):
+    invalidate(f'cart:{user_id}')
+
+
+def invalidate_carts_holding(product_id):
+    """Drop the cached summaries of every cart with a line for product_id"""
+    user_ids = [user_id for (user_id,) in db.session.query(Cart.user_id).filter(Cart.product_id == product_id)]
+    if user_ids:
+        invalidate(*[f'cart:{user_id}' for user_id in user_ids])
+
+
+def cart_summary(user_id):
+    """{'item_count', 'line_count', 'subtotal', 'currency'} of user_id's cart, cached until it changes"""
+    backend = response_cache.backend
+    key = f'cart-summary:{user_id}'
+    stored = backend.get(key)
+    if stored is not None:
+        return json.loads(stored)
+
+    groups = db.session.query(
+        Product.currency, func.count(Cart.id), func.sum(Cart.quantity), func.sum(Cart.quantity * Product.price)
+    ).select_from(Cart).join(Product, Product.id == Cart.product_id).filter(
+        Cart.user_id == user_id
+    ).group_by(Product.currency).all()
+
+    subtotals = {currency: float(subtotal or 0) for currency, _, _, subtotal in groups}
+    summary = {
+        'item_count': sum(int(items or 0) for _, _, items, _ in groups),
+        'line_count': sum(lines for _, lines, _, _ in groups),
+        'subtotal': sum(subtotals.values()),
+        'currency': groups[0][0] if groups else None
+    }
+    if len(groups) > 1:
+        # Products priced in different currencies can't be added up
+        summary.update(subtotal=None, currency=None, subtotals=subtotals)
+
+    ttl = current_app.config.get('CART_SUMMARY_TTL', 300)
+    if not isinstance(backend, RedisCache):
+        ttl = min(ttl, current_app.config.get('CART_SUMMARY_LOCAL_TTL', 5))
+    backend.set(key, json.dumps(summary).encode('utf-8'), ttl, [f'cart:{user_id}'])
+    return summary
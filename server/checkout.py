@@ -0,0 +1,101 @@
+from sqlalchemy import case, insert
+from models import db, Cart, Product, Order, OrderItem
+from inventory import held_quantities, consume, reclaim_expired
+
+# Checkout: turn a user's cart into an order in one transaction.
+#
+#   1. one SELECT of the cart lines joined to their products, locking the
+#      product rows (FOR UPDATE OF products) in id order so concurrent
+#      checkouts of overlapping carts always lock in the same order
+#      (if that comes up short, other buyers' expired holds on the cart's
+#      products are released and the check runs once more, as reserve does)
+#   2. one UPDATE decrementing every product's stock, guarded by
+#      stock - reserved + own hold >= quantity, which also turns the
+#      buyer's reservations (inventory.py) into sold stock; if fewer rows
+#      match than products were bought, another buyer got there first and
+#      the whole order rolls back
+#   3. one bulk INSERT of the order items, then the cart is emptied
+#
+# The guarded UPDATE alone prevents overselling on databases without row
+# locks (SQLite); the locks make the stock check in step 1 authoritative
+# on PostgreSQL, so losers fail fast with a precise message.
+
+
+class CheckoutError(Exception):
+    """The cart can't be ordered as it stands (empty, or short on stock)"""
+
+
+def _shortage_message(lines, held):
+    titles = {line.product_id: line.title for line in lines}
+    available = dict(db.session.query(Product.id, Product.stock - Product.reserved).filter(
+        Product.id.in_(titles)))
+    for line in lines:
+        if (available.get(line.product_id) or 0) + held.get(line.product_id, 0) < line.quantity:
+            return f'Insufficient stock for {titles[line.product_id]}'
+    return 'Insufficient stock'
+
+
+def place_order(user_id):
+    """Create an order from user_id's cart and return it; commits, or rolls back and raises CheckoutError"""
+    lines = db.session.query(
+        Cart.product_id, Cart.quantity, Product.title, Product.price, Product.stock, Product.reserved,
+        Product.artisan_id
+    ).select_from(Cart).join(Product, Product.id == Cart.product_id).filter(
+        Cart.user_id == user_id
+    ).order_by(Product.id).with_for_update(of=Product).all()
+
+    if not lines:
+        db.session.rollback()
+        raise CheckoutError('Cart is empty')
+
+    quantities = {line.product_id: line.quantity for line in lines}
+    held = held_quantities(user_id, quantities)
+    freed = {}
+
+    def short_line():
+        for line in lines:
+            available = (line.stock or 0) - (line.reserved or 0) + freed.get(line.product_id, 0)
+            if available + held.get(line.product_id, 0) < line.quantity:
+                return line
+        return None
+
+    # Expired holds still count until swept; free the cart's and check again
+    if short_line():
+        freed = reclaim_expired(user_id, quantities)
+    short = short_line()
+    if short:
+        db.session.rollback()
+        raise CheckoutError(f'Insufficient stock for {short.title}')
+
+    quantity = case(quantities, value=Product.id)
+    own_hold = case(held, value=Product.id, else_=0) if held else 0
+    updated = db.session.execute(
+        Product.__table__.update().where(
+            Product.id.in_(quantities), Product.stock - Product.reserved + own_hold >= quantity
+        ).values(stock=Product.stock - quantity, reserved=Product.reserved - own_hold)
+    ).rowcount
+    if updated != len(quantities):
+        db.session.rollback()
+        raise CheckoutError(_shortage_message(lines, held))
+    consume(user_id, held)
+
+    order = Order(
+        user_id=user_id,
+        total_amount=sum(line.price * line.quantity for line in lines),
+        status='pending'
+    )
+    db.session.add(order)
+    db.session.flush()  # Get order ID
+
+    db.session.execute(insert(OrderItem), [{
+        'order_id': order.id,
+        'product_id': line.product_id,
+        'quantity': line.quantity,
+        'unit_price': line.price,
+        'total_price': line.price * line.quantity,
+        'artisan_id': line.artisan_id
+    } for line in lines])
+
+    Cart.query.filter_by(user_id=user_id).delete()
+    db.session.commit()
+    return order
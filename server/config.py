@@ -12,7 +12,11 @@ class Config:
     }
     
     # Session Configuration (for frontend credentials: 'include')
-    SESSION_TYPE = 'filesystem'
+    # 'sqlalchemy', 'redis', 'fakeredis', 'cookie' or 'filesystem' (see sessions.py)
+    SESSION_TYPE = os.environ.get('SESSION_TYPE') or ('redis' if os.environ.get('REDIS_URL') else 'sqlalchemy')
+    SESSION_REDIS_URL = os.environ.get('REDIS_URL')
+    SESSION_KEY_PREFIX = 'soko:session:'
+    SESSION_CLEANUP_BATCH_SIZE = 1000
     SESSION_PERMANENT = True
     PERMANENT_SESSION_LIFETIME = timedelta(days=7)
     SESSION_COOKIE_SECURE = True
@@ -20,6 +24,68 @@ class Config:
     SESSION_COOKIE_SAMESITE = 'None'  # Required for cross-origin requests
     SESSION_COOKIE_NAME = 'soko_session'
     
+    # Response cache for public GET endpoints ('memory', 'redis' or 'null').
+    # 'memory' is per worker: invalidation only reaches the worker that wrote,
+    # so with several workers the others can serve stale responses for up to
+    # CACHE_DEFAULT_TTL. Use 'redis' when that matters.
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'memory')
+    CACHE_REDIS_URL = os.environ.get('REDIS_URL')
+    CACHE_DEFAULT_TTL = 60
+    CACHE_MAX_ENTRIES = 1024
+    CART_SUMMARY_TTL = 300  # seconds; cart writes invalidate it sooner
+    CART_SUMMARY_LOCAL_TTL = 5  # seconds, with a per-worker (memory) cache other workers can't invalidate
+    ORDER_EXPORT_BATCH_SIZE = 1000  # rows fetched and flushed per chunk of /orders/export
+    
+    # Realtime push bus: 'local' (in-process), 'redis' (shared with push_server.py) or 'none'
+    REALTIME_BUS = os.environ.get('REALTIME_BUS') or ('redis' if os.environ.get('REDIS_URL') else 'local')
+    REALTIME_REDIS_URL = os.environ.get('REALTIME_REDIS_URL') or os.environ.get('REDIS_URL')
+    REALTIME_CHANNEL = 'soko:realtime'
+    MESSAGE_POLL_TIMEOUT = 25  # seconds GET /messages/poll may wait
+    MESSAGE_POLL_MAX_WAITERS = 32  # concurrent long-polls per worker; more answer at once
+    MESSAGE_POLL_RECHECK_INTERVAL = 1.5  # seconds between database checks when the bus isn't shared
+    MESSAGE_POLL_SHARED_RECHECK_INTERVAL = 5  # seconds between database checks on a shared bus, for lost events
+    
+    # Follower notifications: fan-out threads per worker (0 = inline) and follows per bulk insert
+    NOTIFY_FANOUT_WORKERS = int(os.environ.get('NOTIFY_FANOUT_WORKERS', 2))
+    NOTIFY_FANOUT_CHUNK_SIZE = 1000
+    
+    # Authentication: 'session', 'jwt' (bearer tokens) or 'both' (see auth_utils.py)
+    AUTH_MODE = os.environ.get('AUTH_MODE', 'session')
+    JWT_SECRET_KEY = os.environ.get('JWT_SECRET_KEY')  # falls back to SECRET_KEY
+    JWT_KEY_ID = os.environ.get('JWT_KEY_ID', 'primary')
+    JWT_RETIRED_KEYS = {}  # kid -> secret, still accepted for verification
+    JWT_ACCESS_TTL = 15 * 60  # seconds
+    JWT_REFRESH_TTL = 30 * 24 * 3600  # seconds
+    JWT_REVOCATION_SYNC_INTERVAL = 30  # seconds
+    
+    # Cross-request cache of (user id, role) for auth checks; 0 disables it
+    IDENTITY_CACHE_TTL = int(os.environ.get('IDENTITY_CACHE_TTL', 0))  # seconds
+    IDENTITY_CACHE_MAX_ENTRIES = 10000
+    
+    # HTTP middleware: compression threshold and Cache-Control by endpoint or blueprint
+    COMPRESS_MIN_SIZE = 500  # bytes
+    COMPRESS_LEVEL = 6
+    CACHE_CONTROL_POLICIES = {
+        'products': 'public, max-age=60',
+        'categories': 'public, max-age=300',
+        'reviews': 'public, max-age=60',
+        'artisan.get_artisan_profile': 'public, max-age=60',
+        'artisan.get_artisan_products': 'public, max-age=60',
+        'default': 'private, no-cache'
+    }
+    
+    # Stock reservations: hold lifetimes (seconds) and expiry sweep batch size
+    RESERVATION_TTL = 15 * 60
+    RESERVATION_CHECKOUT_TTL = 30 * 60
+    RESERVATION_SWEEP_BATCH_SIZE = 500
+    
+    # Password hashing: bcrypt cost, hashing processes per worker (0 = inline)
+    # and concurrent hashing requests per worker before answering 429
+    BCRYPT_LOG_ROUNDS = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+    BCRYPT_POOL_SIZE = int(os.environ.get('BCRYPT_POOL_SIZE', 2))
+    WORKER_THREADS = int(os.environ.get('GUNICORN_THREADS', 4))  # request threads per worker (gunicorn.conf.py)
+    LOGIN_MAX_CONCURRENCY = None  # derived from the two above unless set; see passwords.login_concurrency
+    
     # Security
     WTF_CSRF_ENABLED = False  # Disable CSRF for API
     
@@ -58,6 +124,12 @@ class TestingConfig(Config):
     WTF_CSRF_ENABLED = False
     SESSION_COOKIE_SECURE = False
     SQLALCHEMY_ENGINE_OPTIONS = {}  # Remove pool options for SQLite
+    CACHE_TYPE = 'null'
+    SESSION_TYPE = 'cookie'
+    REALTIME_BUS = 'local'
+    BCRYPT_LOG_ROUNDS = 4
+    BCRYPT_POOL_SIZE = 0
+    NOTIFY_FANOUT_WORKERS = 0
 
 config = {
     'development': DevelopmentConfig,
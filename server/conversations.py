@@ -0,0 +1,144 @@
+from sqlalchemy import and_, case, func, insert, or_, select
+from models import db, Conversation, Message, User, dialect_insert
+
+# Inbox summaries, materialized in the conversations table.
+#
+# Each pair of users who have exchanged messages has one row holding the
+# latest message and both sides' unread counters. send_message and
+# update_message_status keep it current in their own transaction
+# (record_message, record_status_change), so the inbox is an indexed read
+# of one row per partner however long the history is.
+#
+# rebuild_conversations() (`flask rebuild-conversations`) recomputes every
+# row from messages with one windowed INSERT ... SELECT, for the backfill
+# and to repair drift; run it while messages aren't being sent.
+
+
+def _pair(user_id, other_id):
+    user_id, other_id = int(user_id), int(other_id)
+    return (user_id, other_id) if user_id < other_id else (other_id, user_id)
+
+
+def _unread_column(message):
+    """Counter of the side that received message"""
+    low, _ = _pair(message.sender_id, message.receiver_id)
+    return Conversation.low_unread if int(message.receiver_id) == low else Conversation.high_unread
+
+
+def record_message(message):
+    """Make a flushed message the latest of its conversation, unread by its receiver; the caller commits"""
+    low, high = _pair(message.sender_id, message.receiver_id)
+    unread = _unread_column(message)
+    statement = dialect_insert(Conversation).values(
+        user_low_id=low, user_high_id=high, last_message_id=message.id, last_message_at=message.created_at,
+        low_unread=int(unread.key == 'low_unread'), high_unread=int(unread.key == 'high_unread'))
+
+    # Concurrent sends may commit out of order; the newest message wins
+    newer = statement.excluded.last_message_at >= Conversation.last_message_at
+    db.session.execute(statement.on_conflict_do_update(
+        index_elements=['user_low_id', 'user_high_id'],
+        set_={
+            'last_message_id': case((newer, statement.excluded.last_message_id),
+                                    else_=Conversation.last_message_id),
+            'last_message_at': case((newer, statement.excluded.last_message_at),
+                                    else_=Conversation.last_message_at),
+            unread.key: unread + 1,
+        }
+    ))
+
+
+def record_status_change(message, previous_status):
+    """Move the receiver's unread counter when a message is read (or unread again); the caller commits"""
+    was_unread = (previous_status or 'sent') != 'read'
+    is_unread = (message.status or 'sent') != 'read'
+    if was_unread == is_unread:
+        return
+
+    low, high = _pair(message.sender_id, message.receiver_id)
+    unread = _unread_column(message)
+    counted = unread + (1 if is_unread else -1)
+    db.session.execute(Conversation.__table__.update().where(
+        Conversation.user_low_id == low, Conversation.user_high_id == high
+    ).values({unread.key: case((counted < 0, 0), else_=counted)}))
+
+
+def record_read(reader_id, partner_id, count):
+    """Take count messages from partner_id off reader_id's unread counter; the caller commits"""
+    if not count:
+        return
+    low, high = _pair(reader_id, partner_id)
+    unread = Conversation.low_unread if int(reader_id) == low else Conversation.high_unread
+    db.session.execute(Conversation.__table__.update().where(
+        Conversation.user_low_id == low, Conversation.user_high_id == high
+    ).values({unread.key: case((unread < count, 0), else_=unread - count)}))
+
+
+def unread_counts(user_id, partner_id):
+    """(unread from partner_id, unread in total) for user_id, from the conversations rows"""
+    is_low = Conversation.user_low_id == user_id
+    unread = case((is_low, Conversation.low_unread), else_=Conversation.high_unread)
+    partner = case((is_low, Conversation.user_high_id), else_=Conversation.user_low_id)
+    row = db.session.query(
+        func.coalesce(func.sum(case((partner == partner_id, unread), else_=0)), 0),
+        func.coalesce(func.sum(unread), 0)
+    ).filter(or_(is_low, Conversation.user_high_id == user_id)).one()
+    return int(row[0]), int(row[1])
+
+
+def conversation_query(user_id):
+    """One row per partner of user_id, latest conversation first"""
+    is_low = Conversation.user_low_id == user_id
+    partner_id = case((is_low, Conversation.user_high_id), else_=Conversation.user_low_id)
+    return db.session.query(
+        Conversation.last_message_id.label('id'), partner_id.label('partner_id'), Message.message,
+        Conversation.last_message_at.label('created_at'),
+        case((is_low, Conversation.low_unread), else_=Conversation.high_unread).label('unread'),
+        User.full_name, User.profile_picture_url
+    ).join(Message, Message.id == Conversation.last_message_id).join(User, User.id == partner_id).filter(
+        or_(is_low, Conversation.user_high_id == user_id)
+    ).order_by(Conversation.last_message_at.desc(), Conversation.id.desc())
+
+
+def serialize_conversations(rows):
+    return [{
+        'id': row.partner_id,
+        'artisan': {
+            'id': row.partner_id,
+            'name': row.full_name,
+            'avatar': row.profile_picture_url or '/images/placeholder.svg',
+            'online': True  # Could be enhanced with actual online status
+        },
+        'lastMessage': row.message,
+        'lastMessageId': row.id,
+        'lastMessageTime': row.created_at.strftime('%H:%M'),
+        'lastMessageAt': row.created_at.isoformat(),
+        'unread': int(row.unread or 0)
+    } for row in rows]
+
+
+def rebuild_conversations():
+    """Recompute every conversation row from messages; commits and returns how many there are"""
+    low = case((Message.sender_id < Message.receiver_id, Message.sender_id), else_=Message.receiver_id)
+    high = case((Message.sender_id < Message.receiver_id, Message.receiver_id), else_=Message.sender_id)
+    unread = func.coalesce(Message.status, 'sent') != 'read'
+    pair = (low, high)
+
+    ranked = select(
+        Message.id, Message.created_at, low.label('low'), high.label('high'),
+        func.row_number().over(
+            partition_by=pair, order_by=(Message.created_at.desc(), Message.id.desc())
+        ).label('position'),
+        func.sum(case((and_(unread, Message.receiver_id == low), 1), else_=0)).over(
+            partition_by=pair).label('low_unread'),
+        func.sum(case((and_(unread, Message.receiver_id == high), 1), else_=0)).over(
+            partition_by=pair).label('high_unread'),
+    ).subquery()
+
+    Conversation.query.delete()
+    db.session.execute(insert(Conversation).from_select(
+        ['user_low_id', 'user_high_id', 'last_message_id', 'last_message_at', 'low_unread', 'high_unread'],
+        select(ranked.c.low, ranked.c.high, ranked.c.id, ranked.c.created_at, ranked.c.low_unread,
+               ranked.c.high_unread).where(ranked.c.position == 1)
+    ))
+    db.session.commit()
+    return Conversation.query.count()
@@ -0,0 +1,182 @@
+import csv
+import io
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert
+from models import db, Follow, Notification
+from realtime import push
+
+# Notifying an artisan's followers, off the request path.
+#
+# create_product commits, then calls notify_followers_of_product, which
+# queues a job on a per-worker thread pool of NOTIFY_FANOUT_WORKERS threads
+# (0 runs it inline). The job walks the artisan's Follow rows by id,
+# NOTIFY_FANOUT_CHUNK_SIZE at a time, and for each chunk bulk-inserts the
+# notifications (COPY on PostgreSQL, one executemany elsewhere), commits and
+# pushes one realtime event to the whole chunk.
+#
+# Jobs live in the worker's memory: a deploy waits for queued jobs, a crash
+# loses them, and a job failing midway keeps the chunks it committed.
+# Throughput counters are reported under "fanout" by GET /health.
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATION_COLUMNS = ('user_id', 'message', 'type', 'is_read', 'created_at')
+
+
+def insert_notifications(rows):
+    """INSERT notification rows (dicts of NOTIFICATION_COLUMNS) in bulk; the caller commits"""
+    if not rows:
+        return
+    if db.session.get_bind().dialect.name == 'postgresql':
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows([row[column] for column in NOTIFICATION_COLUMNS] for row in rows)
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY notifications ({', '.join(NOTIFICATION_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+    else:
+        db.session.execute(insert(Notification), rows)
+
+
+def follower_chunks(artisan_id, chunk_size):
+    """Lists of up to chunk_size follower ids of artisan_id, in follow order"""
+    last_id = 0
+    while True:
+        rows = db.session.query(Follow.id, Follow.follower_id).filter(
+            Follow.artisan_id == artisan_id, Follow.id > last_id
+        ).order_by(Follow.id).limit(chunk_size).all()
+        if rows:
+            yield [row.follower_id for row in rows]
+        if len(rows) < chunk_size:
+            return
+        last_id = rows[-1].id
+
+
+def notify_followers(artisan_id, message, notification_type):
+    """Give every follower of artisan_id a notification, committing per chunk; returns how many were created"""
+    chunk_size = current_app.config.get('NOTIFY_FANOUT_CHUNK_SIZE', 1000)
+    created = 0
+    for follower_ids in follower_chunks(artisan_id, chunk_size):
+        now = datetime.utcnow()
+        insert_notifications([
+            {'user_id': follower_id, 'message': message, 'type': notification_type, 'is_read': False,
+             'created_at': now}
+            for follower_id in follower_ids])
+        db.session.commit()
+        push(follower_ids, 'notification',
+             {'message': message, 'type': notification_type, 'is_read': False, 'created_at': now.isoformat()})
+        created += len(follower_ids)
+    return created
+
+
+class NotificationFanout:
+    """Per-worker pool running fan-out jobs, with their throughput counters"""
+
+    def __init__(self, workers=0):
+        self.workers = workers
+        self._pool = None
+        self._pool_pid = None
+        self._pending = set()
+        self._counters = {'enqueued': 0, 'completed': 0, 'failed': 0, 'notifications': 0, 'seconds': 0.0}
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.configure(app.config.get('NOTIFY_FANOUT_WORKERS', 0))
+
+    def configure(self, workers):
+        if workers != self.workers:
+            self.shutdown()
+        self.workers = workers
+
+    def _executor(self):
+        if not self.workers:
+            return None
+        with self._lock:
+            # Threads don't survive fork (gunicorn preload_app), so each worker starts its own
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='fanout')
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def submit(self, job, *args):
+        """Run job(*args), which returns how many notifications it created, in a fresh app context"""
+        app = current_app._get_current_object()
+        with self._lock:
+            self._counters['enqueued'] += 1
+        pool = self._executor()
+        if pool is None:
+            self._run(app, job, args)
+            return None
+        future = pool.submit(self._run, app, job, args)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._finished)
+        return future
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending.discard(future)
+
+    def _run(self, app, job, args):
+        start = time.perf_counter()
+        created, failed = 0, 0
+        try:
+            with app.app_context():
+                created = job(*args)
+        except Exception:
+            failed = 1
+            logger.exception(f'Notification fan-out {job.__name__}{args} failed')
+        with self._lock:
+            self._counters['completed'] += 1 - failed
+            self._counters['failed'] += failed
+            self._counters['notifications'] += created or 0
+            self._counters['seconds'] += time.perf_counter() - start
+
+    def drain(self, timeout=None):
+        """Wait for the queued jobs; False if some are still running after timeout seconds"""
+        with self._lock:
+            pending = list(self._pending)
+        return not wait(pending, timeout).not_done
+
+    def stats(self):
+        with self._lock:
+            counters = dict(self._counters)
+            pending = len(self._pending)
+        seconds = counters.pop('seconds')
+        return {
+            **counters,
+            'pending': pending,
+            'workers': self.workers,
+            'busy_seconds': round(seconds, 3),
+            'notifications_per_second': round(counters['notifications'] / seconds) if seconds else None
+        }
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
+            self._pool_pid = None
+
+
+notification_fanout = NotificationFanout()
+
+
+def notify_followers_of_product(product):
+    """Queue the new product notification for its artisan's followers; call after commit"""
+    if product.status != 'active':
+        return None
+    name = product.artisan.full_name if product.artisan else 'An artisan you follow'
+    message = f'{name} listed a new product: {product.title}'
+    if len(message) > 255:
+        message = message[:252] + '...'
+    return notification_fanout.submit(notify_followers, product.artisan_id, message, 'new_product')
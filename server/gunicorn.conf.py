@@ -6,7 +6,10 @@ backlog = 2048
 
 # Worker processes
 workers = int(os.environ.get('WEB_CONCURRENCY', 4))
-worker_class = "sync"
+# Threads keep a worker serving while its logins wait on the bcrypt pool;
+# config.WORKER_THREADS reads the same variable to size the login limit
+worker_class = "gthread"
+threads = int(os.environ.get('GUNICORN_THREADS', 4))
 worker_connections = 1000
 timeout = 120
 keepalive = 2
@@ -32,6 +35,13 @@ user = None
 group = None
 tmp_upload_dir = None
 
+# Server hooks
+def post_worker_init(worker):
+    """Build the per-worker autocomplete index before serving requests"""
+    from suggest import suggestion_index
+    with worker.wsgi.app_context():
+        suggestion_index.rebuild()
+
 # SSL (if needed)
 # keyfile = '/path/to/keyfile'
 # certfile = '/path/to/certfile'
\ No newline at end of file
@@ -0,0 +1,209 @@
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import case, event
+from cache import invalidate
+from models import db, Product, Reservation, upsert_rows
+
+# Stock reservations.
+#
+# Adding to the cart (RESERVATION_TTL) and starting checkout
+# (RESERVATION_CHECKOUT_TTL) hold units for the buyer in
+# inventory_reservations, one row per (user, product). Product.reserved is
+# the sum of the holds still on record, kept up to date by each change
+# rather than re-summed, so available = stock - reserved is a column read.
+#
+# Every change is a single guarded UPDATE on the product row
+# (reserved + n, only while stock - reserved >= n), so concurrent buyers
+# take the row lock for one statement rather than a whole request.
+# Changes lock the product rows first and the holds second, in product id
+# order, the same order checkout takes them in, so the two can't deadlock.
+# Expired holds keep counting until swept: in batches by
+# `flask sweep-reservations`, or for one product when a new hold on it
+# would otherwise fail. Functions here don't commit unless they say so.
+#
+# Cached product responses show available stock, so a transaction that
+# changes Product.reserved drops the 'products' cache tag once it commits.
+# With the per-worker memory cache that only clears the committing worker;
+# the others serve their copy until CACHE_DEFAULT_TTL runs out.
+
+
+class InsufficientStock(Exception):
+    def __init__(self, product_id, message='Insufficient stock'):
+        super().__init__(message)
+        self.product_id = product_id
+
+
+def _stock_changed():
+    db.session.info['products_stale'] = True
+
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_products(session):
+    if session.info.pop('products_stale', False):
+        invalidate('products')
+
+
+@event.listens_for(db.session, 'after_rollback')
+def _forget_stock_change(session):
+    session.info.pop('products_stale', None)
+
+
+def _adjust_reserved(deltas):
+    """Apply {product_id: delta} to Product.reserved in one UPDATE"""
+    deltas = {product_id: delta for product_id, delta in deltas.items() if delta}
+    if deltas:
+        _stock_changed()
+        db.session.execute(Product.__table__.update().where(Product.id.in_(deltas)).values(
+            reserved=Product.reserved + case(deltas, value=Product.id)))
+
+
+def _lock_products(product_ids):
+    """SELECT ... FOR UPDATE the product rows, in id order, before touching their holds"""
+    db.session.query(Product.id).filter(Product.id.in_(product_ids)).order_by(Product.id).with_for_update().all()
+
+
+def _release_rows(rows):
+    released = Counter()
+    for row in rows:
+        released[row.product_id] += row.quantity
+    _adjust_reserved({product_id: -quantity for product_id, quantity in released.items()})
+    db.session.query(Reservation).filter(Reservation.id.in_([row.id for row in rows])).delete(
+        synchronize_session=False)
+
+
+def _expired_rows(limit=None, product_ids=None, other_than_user=None):
+    query = db.session.query(Reservation.id, Reservation.product_id, Reservation.quantity).filter(
+        Reservation.expires_at <= datetime.utcnow())
+    if product_ids is not None:
+        query = query.filter(Reservation.product_id.in_(product_ids))
+    if other_than_user is not None:
+        query = query.filter(Reservation.user_id != other_than_user)
+    # Holds another transaction is converting or sweeping are left to it
+    return query.order_by(Reservation.id).limit(limit).with_for_update(skip_locked=True).all()
+
+
+def sweep_expired(batch_size=None):
+    """Release every expired hold, committing after each batch; returns how many were released"""
+    batch_size = batch_size or current_app.config.get('RESERVATION_SWEEP_BATCH_SIZE', 500)
+    released = 0
+    while True:
+        rows = _expired_rows(limit=batch_size)
+        if rows:
+            _release_rows(rows)
+        db.session.commit()
+        released += len(rows)
+        if len(rows) < batch_size:
+            return released
+
+
+def _try_hold(product_id, delta):
+    if delta <= 0:
+        _adjust_reserved({product_id: delta})
+        return True
+    _stock_changed()
+    return db.session.execute(Product.__table__.update().where(
+        Product.id == product_id, Product.stock - Product.reserved >= delta
+    ).values(reserved=Product.reserved + delta)).rowcount == 1
+
+
+def reserve(user_id, product_id, quantity, ttl=None):
+    """Make user_id's hold on product_id exactly quantity units, expiring after ttl seconds"""
+    ttl = ttl or current_app.config.get('RESERVATION_TTL', 15 * 60)
+    _lock_products([product_id])
+    hold = Reservation.query.filter_by(user_id=user_id, product_id=product_id).with_for_update().first()
+    delta = quantity - (hold.quantity if hold else 0)
+
+    if not _try_hold(product_id, delta):
+        # Expired holds still count until swept; free this product's and retry
+        if not reclaim_expired(user_id, [product_id]) or not _try_hold(product_id, delta):
+            raise InsufficientStock(product_id)
+
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+    if hold:
+        hold.quantity = quantity
+        hold.expires_at = expires_at
+    else:
+        db.session.add(Reservation(user_id=user_id, product_id=product_id, quantity=quantity,
+                                   expires_at=expires_at))
+
+
+def reclaim_expired(user_id, product_ids):
+    """Release other users' expired holds on product_ids; returns {product_id: units freed}"""
+    rows = _expired_rows(product_ids=product_ids, other_than_user=user_id)
+    if rows:
+        _release_rows(rows)
+    freed = Counter()
+    for row in rows:
+        freed[row.product_id] += row.quantity
+    return freed
+
+
+def reserve_many(user_id, quantities, ttl=None):
+    """Set user_id's holds to {product_id: quantity} in a few bulk statements (0 drops a hold).
+
+    Callers check availability first; if another buyer takes the stock in
+    between, InsufficientStock is raised and the caller must roll back.
+    """
+    ttl = ttl or current_app.config.get('RESERVATION_TTL', 15 * 60)
+    _lock_products(quantities)
+    held = held_quantities(user_id, quantities)
+    deltas = {product_id: quantity - held.get(product_id, 0) for product_id, quantity in quantities.items()}
+
+    growing = {product_id: delta for product_id, delta in deltas.items() if delta > 0}
+    if growing:
+        delta = case(growing, value=Product.id)
+        _stock_changed()
+        updated = db.session.execute(Product.__table__.update().where(
+            Product.id.in_(growing), Product.stock - Product.reserved >= delta
+        ).values(reserved=Product.reserved + delta)).rowcount
+        if updated != len(growing):
+            raise InsufficientStock(None)
+    _adjust_reserved({product_id: delta for product_id, delta in deltas.items() if delta < 0})
+
+    dropped = [product_id for product_id, quantity in quantities.items() if not quantity]
+    if dropped:
+        consume(user_id, dropped)
+    expires_at = datetime.utcnow() + timedelta(seconds=ttl)
+    kept = [{'user_id': user_id, 'product_id': product_id, 'quantity': quantity, 'expires_at': expires_at,
+             'created_at': datetime.utcnow()}
+            for product_id, quantity in quantities.items() if quantity]
+    if kept:
+        upsert_rows(Reservation, kept, ['user_id', 'product_id'], ['quantity', 'expires_at'])
+
+
+def release(user_id, product_id=None):
+    """Drop user_id's hold on product_id, or all of their holds"""
+    query = db.session.query(Reservation.id, Reservation.product_id, Reservation.quantity).filter(
+        Reservation.user_id == user_id)
+    if product_id is not None:
+        query = query.filter(Reservation.product_id == product_id)
+    _lock_products(query.with_entities(Reservation.product_id).scalar_subquery())
+    rows = query.with_for_update().all()
+    if rows:
+        _release_rows(rows)
+
+
+def reserve_cart(user_id, lines, ttl=None):
+    """Hold every (product_id, quantity) line; returns the product ids that couldn't be held"""
+    short = []
+    for product_id, quantity in sorted(lines):
+        try:
+            reserve(user_id, product_id, quantity, ttl)
+        except InsufficientStock:
+            short.append(product_id)
+    return short
+
+
+def held_quantities(user_id, product_ids):
+    """{product_id: units} user_id holds among product_ids, locking the holds"""
+    return dict(db.session.query(Reservation.product_id, Reservation.quantity).filter(
+        Reservation.user_id == user_id, Reservation.product_id.in_(product_ids)
+    ).with_for_update().all())
+
+
+def consume(user_id, product_ids):
+    """Delete user_id's holds on product_ids once their stock has been taken by an order"""
+    db.session.query(Reservation).filter(
+        Reservation.user_id == user_id, Reservation.product_id.in_(product_ids)
+    ).delete(synchronize_session=False)
@@ -0,0 +1,72 @@
+import gzip
+from flask import request
+
+# HTTP response middleware registered by create_app:
+#   * weak ETags computed over the response body, answering a matching
+#     If-None-Match with 304 Not Modified
+#   * Cache-Control policies per endpoint or blueprint (CACHE_CONTROL_POLICIES)
+#   * gzip/brotli compression negotiated via Accept-Encoding for bodies
+#     of at least COMPRESS_MIN_SIZE bytes
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/plain', 'text/csv', 'application/x-ndjson'}
+
+
+def choose_encoding(accept_encodings):
+    """Pick the best supported content coding the client accepts"""
+    supported = ['br', 'gzip'] if brotli is not None else ['gzip']
+    best, best_quality = None, 0
+    for encoding in supported:
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def compress(data, encoding, level):
+    if encoding == 'br':
+        return brotli.compress(data, quality=min(level, 11))
+    return gzip.compress(data, compresslevel=level)
+
+
+def init_middleware(app):
+    min_size = app.config.get('COMPRESS_MIN_SIZE', 500)
+    level = app.config.get('COMPRESS_LEVEL', 6)
+    policies = app.config.get('CACHE_CONTROL_POLICIES', {})
+
+    @app.after_request
+    def conditional_and_compressed(response):
+        if response.direct_passthrough or response.is_streamed:
+            return response
+
+        if request.method in ('GET', 'HEAD') and response.status_code == 200:
+            if 'Cache-Control' not in response.headers:
+                policy = policies.get(request.endpoint) or policies.get(request.blueprint) or policies.get('default')
+                if policy:
+                    response.headers['Cache-Control'] = policy
+
+            # Views that set their own (strong) ETag keep it
+            response.add_etag(weak=True)
+            response.make_conditional(request)
+            if response.status_code == 304:
+                return response
+
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+            return response
+
+        response.vary.add('Accept-Encoding')
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+
+        encoding = choose_encoding(request.accept_encodings)
+        if encoding:
+            response.set_data(compress(data, encoding, level))
+            response.headers['Content-Encoding'] = encoding
+        return response
@@ -0,0 +1,145 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import wraps
+import bcrypt
+from flask import current_app, jsonify
+
+# Password hashing off the request threads.
+#
+# bcrypt runs in a per-worker process pool of BCRYPT_POOL_SIZE processes
+# (0 hashes inline), at BCRYPT_LOG_ROUNDS cost. Routes that hash are wrapped
+# in limit_hashing, which answers 429 once login_concurrency() hashes are
+# already in flight instead of letting a login burst queue up behind them.
+# Hashes made at another cost are upgraded the next time their owner logs in.
+#
+# Pool processes are started by a forkserver (spawn where there is none), not
+# forked from a worker that is running request threads. A pool broken by a
+# dead process is replaced and the hash retried once.
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ROUNDS = 12
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+def _pool_context():
+    method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+    return multiprocessing.get_context(method)
+
+
+def hash_cost(hashed):
+    """Work factor of a '$2b$12$...' hash, or None if it isn't one"""
+    try:
+        return int(hashed.split('$')[2])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+
+def login_concurrency(config):
+    """Hashing requests a worker admits at once.
+
+    As many as the pool hashes in parallel (every thread when hashing
+    inline), but below WORKER_THREADS so a login burst always leaves a
+    thread for other requests; a limit at or above the thread count could
+    never be reached.
+    """
+    threads = max(1, config.get('WORKER_THREADS', 4))
+    limit = config.get('LOGIN_MAX_CONCURRENCY') or config.get('BCRYPT_POOL_SIZE') or threads
+    return max(1, min(limit, threads - 1))
+
+
+class PasswordHasher:
+    def __init__(self, rounds=DEFAULT_ROUNDS, pool_size=0, timeout=30):
+        self.rounds = rounds
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        self.configure(app.config.get('BCRYPT_LOG_ROUNDS', DEFAULT_ROUNDS),
+                       app.config.get('BCRYPT_POOL_SIZE', 0))
+        app.extensions['login_slots'] = threading.BoundedSemaphore(login_concurrency(app.config))
+
+    def configure(self, rounds, pool_size):
+        if pool_size != self.pool_size:
+            self.shutdown()
+        self.rounds = rounds
+        self.pool_size = pool_size
+
+    def _executor(self):
+        if not self.pool_size:
+            return None
+        with self._lock:
+            # A pool doesn't survive fork (gunicorn preload_app), so each worker starts its own
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(max_workers=self.pool_size, mp_context=_pool_context())
+                self._pool_pid = os.getpid()
+            return self._pool
+
+    def _discard(self, pool):
+        with self._lock:
+            if self._pool is pool:
+                pool.shutdown(wait=False)
+                self._pool = None
+                self._pool_pid = None
+
+    def _run(self, fn, *args):
+        pool = self._executor()
+        if pool is None:
+            return fn(*args)
+        try:
+            return pool.submit(fn, *args).result(timeout=self.timeout)
+        except BrokenProcessPool:
+            logger.warning('Password hashing pool broke, starting a new one')
+            self._discard(pool)
+            return self._executor().submit(fn, *args).result(timeout=self.timeout)
+
+    def hash(self, password):
+        return self._run(_hash, password.encode('utf-8'), self.rounds).decode('utf-8')
+
+    def verify(self, hashed, password):
+        if not hashed:
+            return False
+        return self._run(_check, password.encode('utf-8'), hashed.encode('utf-8'))
+
+    def needs_rehash(self, hashed):
+        return hash_cost(hashed) != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None and self._pool_pid == os.getpid():
+                self._pool.shutdown(wait=False)
+            self._pool = None
+            self._pool_pid = None
+
+
+def limit_hashing(f):
+    """Shed requests that would hash a password once the worker is saturated"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        slots = current_app.extensions['login_slots']
+        if not slots.acquire(blocking=False):
+            response = jsonify({'error': 'Too many sign-in attempts right now, please retry shortly'})
+            response.headers['Retry-After'] = '1'
+            return response, 429
+        try:
+            return f(*args, **kwargs)
+        finally:
+            slots.release()
+    return decorated_function
+
+
+password_hasher = PasswordHasher()
@@ -0,0 +1,82 @@
+import asyncio
+import os
+from app import create_app, FRONTEND_ORIGINS
+from auth_utils import get_current_identity
+
+# Socket.IO push server for client/src/services/socket.js.
+#
+# An asyncio (ASGI) process next to the gunicorn workers:
+#
+#   REALTIME_BUS=redis uvicorn --factory push_server:create_asgi_app --port 5001
+#
+# Sockets authenticate with the session cookie the browser already holds
+# (withCredentials), or an access token sent as auth.token in jwt mode; the
+# auth.userId the client sends must match. Each socket subscribes to its
+# user on the app's realtime Hub, which the web workers feed through the
+# bus (see realtime.py): new_message, notification, payment_status and
+# order_status events.
+#
+# Requires python-socketio and an ASGI server (uvicorn); the web app
+# itself runs without them.
+
+try:
+    import socketio
+except ImportError:  # pragma: no cover - exercised when python-socketio isn't installed
+    socketio = None
+
+
+def authenticate(flask_app, cookie=None, token=None):
+    """User id behind a session cookie header or bearer token, or None"""
+    headers = {}
+    if cookie:
+        headers['Cookie'] = cookie
+    if token:
+        headers['Authorization'] = f'Bearer {token}'
+    # A fresh app context keeps flask.g per handshake; opening the request
+    # context loads the session through the app's session interface
+    with flask_app.app_context(), flask_app.test_request_context('/socket.io/', headers=headers):
+        identity = get_current_identity()
+        return identity[0] if identity else None
+
+
+def create_push_server(flask_app):
+    """Socket.IO ASGI application delivering flask_app's realtime events"""
+    if socketio is None:
+        raise RuntimeError('The push server needs python-socketio: pip install python-socketio uvicorn')
+
+    hub = flask_app.extensions.get('realtime')
+    if hub is None:
+        raise RuntimeError('Realtime push is disabled (REALTIME_BUS=none)')
+
+    sio = socketio.AsyncServer(async_mode='asgi', cors_allowed_origins=FRONTEND_ORIGINS, cors_credentials=True)
+    subscriptions = {}  # sid -> unsubscribe
+
+    @sio.event
+    async def connect(sid, environ, auth=None):
+        auth = auth if isinstance(auth, dict) else {}
+        loop = asyncio.get_running_loop()
+        # Session stores and the user lookup block, so they run off the event loop
+        user_id = await loop.run_in_executor(
+            None, authenticate, flask_app, environ.get('HTTP_COOKIE'), auth.get('token'))
+        if user_id is None:
+            raise socketio.exceptions.ConnectionRefusedError('Authentication required')
+        if auth.get('userId') is not None and str(auth['userId']) != str(user_id):
+            raise socketio.exceptions.ConnectionRefusedError('userId does not match the session')
+
+        def deliver(event, data):
+            # Called on the bus thread (or a request thread with the local bus)
+            asyncio.run_coroutine_threadsafe(sio.emit(event, data, to=sid), loop)
+
+        subscriptions[sid] = hub.subscribe(user_id, deliver)
+
+    @sio.event
+    async def disconnect(sid, *args):
+        unsubscribe = subscriptions.pop(sid, None)
+        if unsubscribe:
+            unsubscribe()
+
+    return socketio.ASGIApp(sio, socketio_path='socket.io')
+
+
+def create_asgi_app():
+    return create_push_server(create_app(os.environ.get('FLASK_ENV', 'production')))
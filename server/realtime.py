@@ -0,0 +1,206 @@
+import json
+import logging
+import threading
+import time
+from flask import current_app
+
+# Realtime push to connected clients.
+#
+# Routes call push(user_ids, event, data) once their transaction has
+# committed. The event is published on the bus chosen by REALTIME_BUS:
+#   'local'  delivered inside this process (development, tests, or a push
+#            server running in the same process as the app)
+#   'redis'  published on REALTIME_CHANNEL of REALTIME_REDIS_URL, so the
+#            push server (push_server.py) hears every web worker
+#   'none'   push is disabled
+# On the receiving side a Hub, the in-process pub/sub, fans each event out
+# to the callbacks subscribed for its users: one per connected socket, or
+# an EventWaiter blocking a long-poll request (GET /messages/poll). With the
+# local bus a long-poll only hears its own worker, so it also re-checks the
+# database every MESSAGE_POLL_RECHECK_INTERVAL seconds; on a shared bus it
+# re-checks every MESSAGE_POLL_SHARED_RECHECK_INTERVAL, in case an event is
+# lost while the listener reconnects.
+# Push is best effort; a failing bus is logged and never fails the request.
+# A Redis listener that loses its connection logs it and keeps retrying
+# every RECONNECT_DELAY seconds; redis-py subscribes again on reconnect.
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBus:
+    """In-process stand-in for a message bus: publish calls every listener directly"""
+
+    # Other worker processes publish on their own LocalBus, unheard here
+    shared = False
+
+    def __init__(self):
+        self._listeners = []
+        self._lock = threading.Lock()
+
+    def publish(self, message):
+        with self._lock:
+            listeners = list(self._listeners)
+        for listener in listeners:
+            listener(message)
+
+    def listen(self, listener):
+        """Call listener with every published message; returns a function that stops listening"""
+        with self._lock:
+            self._listeners.append(listener)
+
+        def stop():
+            with self._lock:
+                if listener in self._listeners:
+                    self._listeners.remove(listener)
+        return stop
+
+
+class RedisBus:
+    """Bus shared by every process, over Redis pub/sub"""
+
+    shared = True
+    RECONNECT_DELAY = 1  # seconds
+
+    def __init__(self, client, channel='soko:realtime'):
+        self.client = client
+        self.channel = channel
+
+    def publish(self, message):
+        self.client.publish(self.channel, json.dumps(message, separators=(',', ':')))
+
+    def listen(self, listener):
+        pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+        pubsub.subscribe(**{self.channel: lambda raw: listener(json.loads(raw['data']))})
+        thread = pubsub.run_in_thread(sleep_time=1, daemon=True, exception_handler=self._connection_lost)
+        return thread.stop
+
+    def _connection_lost(self, error, pubsub, thread):
+        # Without a handler the listening thread dies and the Hub never hears the bus again;
+        # the next get_message reconnects
+        logger.warning(f'Realtime bus listener lost Redis ({error}), reconnecting')
+        time.sleep(self.RECONNECT_DELAY)
+
+
+def create_bus(config):
+    bus_type = config.get('REALTIME_BUS', 'local')
+    if bus_type == 'redis':
+        import redis
+        return RedisBus(redis.Redis.from_url(config['REALTIME_REDIS_URL']),
+                        config.get('REALTIME_CHANNEL', 'soko:realtime'))
+    if bus_type == 'local':
+        return LocalBus()
+    return None
+
+
+class Hub:
+    """In-process pub/sub from bus messages to per-user subscriber callbacks"""
+
+    def __init__(self, bus):
+        self.bus = bus
+        self._subscribers = {}  # user id -> list of callback(event, data)
+        self._lock = threading.Lock()
+        self._stop_listening = None
+
+    def subscribe(self, user_id, callback):
+        """Call callback(event, data) for every event pushed to user_id; returns the unsubscribe function"""
+        with self._lock:
+            # Listen to the bus only once something in this process subscribes
+            if self._stop_listening is None:
+                self._stop_listening = self.bus.listen(self.dispatch)
+            self._subscribers.setdefault(user_id, []).append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._subscribers.get(user_id, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+                if not callbacks:
+                    self._subscribers.pop(user_id, None)
+        return unsubscribe
+
+    def subscriber_count(self, user_id=None):
+        with self._lock:
+            if user_id is not None:
+                return len(self._subscribers.get(user_id, ()))
+            return sum(len(callbacks) for callbacks in self._subscribers.values())
+
+    def dispatch(self, message):
+        for user_id in message['user_ids']:
+            with self._lock:
+                callbacks = list(self._subscribers.get(user_id, ()))
+            for callback in callbacks:
+                try:
+                    callback(message['event'], message['data'])
+                except Exception:
+                    logger.exception('Realtime subscriber failed')
+
+    def close(self):
+        with self._lock:
+            if self._stop_listening is not None:
+                self._stop_listening()
+                self._stop_listening = None
+            self._subscribers.clear()
+
+
+class EventWaiter:
+    """Lets a request thread block until one of events is pushed to user_id.
+
+    Subscribe before checking the database for what the caller is waiting
+    for, then wait(): an event arriving in between is not missed.
+    """
+
+    def __init__(self, hub, user_id, events):
+        self.events = set(events)
+        self._arrived = threading.Event()
+        self._unsubscribe = hub.subscribe(user_id, self._on_event)
+
+    def _on_event(self, event, data):
+        if event in self.events:
+            self._arrived.set()
+
+    def wait(self, timeout):
+        """True once a matching event has arrived, False if timeout seconds passed first"""
+        arrived = self._arrived.wait(timeout)
+        self._arrived.clear()
+        return arrived
+
+    def close(self):
+        self._unsubscribe()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def init_realtime(app):
+    bus = create_bus(app.config)
+    app.extensions['realtime'] = Hub(bus) if bus is not None else None
+    # Each long-poll holds a worker thread while it waits
+    app.extensions['poll_slots'] = threading.BoundedSemaphore(app.config.get('MESSAGE_POLL_MAX_WAITERS', 32))
+
+
+def waiter(user_id, events):
+    """EventWaiter for user_id, or None when push is disabled or the bus can't be reached"""
+    hub = current_app.extensions.get('realtime')
+    if hub is None:
+        return None
+    try:
+        return EventWaiter(hub, int(user_id), events)
+    except Exception:
+        logger.exception('Realtime bus unavailable')
+        return None
+
+
+def push(user_ids, event, data):
+    """Send event with JSON-serializable data to the connected clients of user_ids; call after commit"""
+    hub = current_app.extensions.get('realtime')
+    if hub is None:
+        return
+    if isinstance(user_ids, (int, str)):
+        user_ids = [user_ids]
+    try:
+        hub.bus.publish({'user_ids': sorted({int(user_id) for user_id in user_ids}), 'event': event, 'data': data})
+    except Exception:
+        current_app.logger.exception(f'Realtime push of {event} failed')
@@ -2,10 +2,15 @@ from flask import Blueprint, request, jsonify
 from models import db, User, Product, Order, OrderItem
 from auth_utils import login_required, get_current_user_id, require_role
 from sqlalchemy import func
+from serializers import project_products, serialize_products, project_orders, serialize_orders, json_response, \
+    PRODUCT_FIELDS
+from utils import parse_fields, InvalidFields, keyset_paginate, set_pagination_headers, InvalidCursor
+from cache import cached
 
 artisan_bp = Blueprint('artisan', __name__)
 
 @artisan_bp.route('/<int:artisan_id>', methods=['GET'])
+@cached(tags=['user:{artisan_id}'])
 def get_artisan_profile(artisan_id):
     """Get artisan profile"""
     try:
@@ -18,15 +23,19 @@ def get_artisan_profile(artisan_id):
         return jsonify({'error': str(e)}), 500
 
 @artisan_bp.route('/<int:artisan_id>/products', methods=['GET'])
+@cached(tags=['products', 'user:{artisan_id}'])
 def get_artisan_products(artisan_id):
     """Get products by artisan"""
     try:
+        fields = parse_fields(PRODUCT_FIELDS)
         artisan = User.query.filter_by(id=artisan_id, role='artisan').first()
         if not artisan:
             return jsonify({'error': 'Artisan not found'}), 404
 
-        products = Product.query.filter_by(artisan_id=artisan_id, status='active').all()
-        return jsonify([product.to_dict() for product in products]), 200
+        query = Product.query.filter_by(artisan_id=artisan_id, status='active')
+        return json_response(serialize_products(project_products(query, fields), fields))
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -72,8 +81,14 @@ def get_artisan_orders():
     try:
         user_id = get_current_user_id()
 
-        orders = Order.query.join(OrderItem).filter(OrderItem.artisan_id == user_id).distinct().all()
-        return jsonify([order.to_dict() for order in orders]), 200
+        # EXISTS rather than a join, so orders with several of the artisan's items appear once
+        sold = OrderItem.query.filter(OrderItem.order_id == Order.id, OrderItem.artisan_id == user_id).exists()
+        page = keyset_paginate(project_orders(Order.query.filter(sold)), Order,
+                               total_key=f'artisan-orders:{user_id}')
+        response = json_response(serialize_orders(page['items']))
+        return set_pagination_headers(response, page['pagination'])
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -1,11 +1,45 @@
 from flask import Blueprint, request, jsonify, session
 from models import db, User
-from auth_utils import login_required, get_current_user, set_user_session, clear_user_session
+from auth_utils import (login_required, get_current_user, set_user_session, clear_user_session, auth_mode,
+                        get_bearer_token)
 from validators import validate_email, validate_password, validate_required_fields
+from cache import invalidate
+from passwords import password_hasher, limit_hashing
+from tokens import issue_tokens, rotate_refresh_token, revoke_token, TokenError
+from cart import apply_cart_lines, invalidate_cart, CartError
+from inventory import InsufficientStock
+from serializers import cart_query, serialize_cart
 
 auth_bp = Blueprint('auth', __name__)
 
+def sign_in(user):
+    """Start a session and/or issue bearer tokens for user, as AUTH_MODE says"""
+    mode = auth_mode()
+    if mode != 'jwt':
+        set_user_session(user)
+    if mode != 'session':
+        return issue_tokens(user)
+    return {}
+
+def merge_guest_cart(user, items):
+    """Add the lines of a cart built before signing in to user's cart.
+
+    Returns the fields to add to the response: the merged cart, or why the
+    merge failed (signing in succeeds either way).
+    """
+    if not items:
+        return {}
+    try:
+        apply_cart_lines(user.id, items, merge=True)
+        db.session.commit()
+    except (CartError, InsufficientStock) as e:
+        db.session.rollback()
+        return {'cart_merge_error': str(e)}
+    invalidate_cart(user.id)
+    return {'cart': serialize_cart(cart_query(user.id))}
+
 @auth_bp.route('/register', methods=['POST'])
+@limit_hashing
 def register():
     """Register a new user"""
     try:
@@ -44,19 +78,23 @@ def register():
         db.session.commit()
         
         # Set session
-        set_user_session(user)
+        tokens = sign_in(user)
+        cart = merge_guest_cart(user, data.get('cart'))
         
         return jsonify({
             'success': True,
             'message': 'Registration successful',
             'user': user.to_dict(),
-            'authenticated': True
+            'authenticated': True,
+            **tokens,
+            **cart
         }), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/login', methods=['POST'])
+@limit_hashing
 def login():
     """Login user"""
     try:
@@ -72,28 +110,61 @@ def login():
         if not user or not user.check_password(data['password']):
             return jsonify({'error': 'Invalid email or password'}), 401
         
+        # Upgrade hashes made at an older work factor while the password is at hand
+        if password_hasher.needs_rehash(user.password_hash):
+            user.set_password(data['password'])
+            db.session.commit()
+        
         # Set session
-        set_user_session(user)
+        tokens = sign_in(user)
+        cart = merge_guest_cart(user, data.get('cart'))
         
         return jsonify({
             'success': True,
             'message': 'Login successful',
             'user': user.to_dict(),
-            'authenticated': True
+            'authenticated': True,
+            **tokens,
+            **cart
         }), 200
     except Exception as e:
+        db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
 @auth_bp.route('/logout', methods=['POST'])
 def logout():
     """Logout user"""
     clear_user_session()
+    if auth_mode() != 'session':
+        access_token = get_bearer_token()
+        refresh_token = (request.get_json(silent=True) or {}).get('refresh_token')
+        if access_token:
+            revoke_token(access_token, 'access')
+        if refresh_token:
+            revoke_token(refresh_token, 'refresh')
+        db.session.commit()
     return jsonify({
         'success': True,
         'message': 'Logout successful',
         'authenticated': False
     }), 200
 
+@auth_bp.route('/refresh', methods=['POST'])
+def refresh():
+    """Exchange a refresh token for a new access/refresh token pair"""
+    try:
+        data = request.get_json(silent=True) or {}
+        tokens = rotate_refresh_token(data.get('refresh_token') or '')
+        return jsonify({
+            'success': True,
+            **tokens
+        }), 200
+    except TokenError as e:
+        return jsonify({'error': str(e), 'authenticated': False}), 401
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @auth_bp.route('/session', methods=['GET'])
 def get_session():
     """Get current session"""
@@ -132,6 +203,7 @@ def update_profile():
                 setattr(user, field, data[field])
         
         db.session.commit()
+        invalidate(f'user:{user.id}', 'products')
         
         return jsonify({
             'success': True,
@@ -2,6 +2,9 @@ from flask import Blueprint, request, jsonify
 from models import db, Cart, Product
 from auth_utils import login_required, get_current_user_id
 from validators import validate_required_fields, validate_quantity
+from serializers import cart_query, serialize_cart, json_response
+from inventory import reserve, release, InsufficientStock
+from cart import apply_cart_lines, cart_summary, invalidate_cart, CartError
 
 cart_bp = Blueprint('cart', __name__)
 
@@ -11,8 +14,16 @@ def get_cart():
     """Get user's cart items"""
     try:
         user_id = get_current_user_id()
-        cart_items = Cart.query.filter_by(user_id=user_id).all()
-        return jsonify([item.to_dict() for item in cart_items]), 200
+        return json_response(serialize_cart(cart_query(user_id)))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@cart_bp.route('/summary', methods=['GET'])
+@login_required
+def get_cart_summary():
+    """Item count, subtotal and currency of the user's cart"""
+    try:
+        return jsonify(cart_summary(get_current_user_id())), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -36,19 +47,19 @@ def add_to_cart():
         # Validate quantity
         if not validate_quantity(quantity):
             return jsonify({'error': 'Invalid quantity'}), 400
+        quantity = int(quantity)
 
         # Check if product exists
         product = Product.query.get(product_id)
         if not product:
             return jsonify({'error': 'Product not found'}), 404
 
-        # Check stock
-        if product.stock < quantity:
-            return jsonify({'error': 'Insufficient stock'}), 400
-
         # Check if item already in cart
         existing_item = Cart.query.filter_by(user_id=user_id, product_id=product_id).first()
 
+        # Hold the stock for the whole cart line
+        reserve(user_id, product_id, quantity + (existing_item.quantity if existing_item else 0))
+
         if existing_item:
             existing_item.quantity += quantity
         else:
@@ -60,7 +71,35 @@ def add_to_cart():
             db.session.add(cart_item)
 
         db.session.commit()
+        invalidate_cart(user_id)
         return jsonify({'success': True, 'message': 'Item added to cart'}), 201
+    except InsufficientStock:
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient stock'}), 400
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@cart_bp.route('/bulk', methods=['PUT'])
+@login_required
+def bulk_update_cart():
+    """Set the quantity of several cart lines at once (0 removes a line)"""
+    try:
+        user_id = get_current_user_id()
+        data = request.get_json(silent=True)
+        items = data.get('items') if isinstance(data, dict) else data
+
+        apply_cart_lines(user_id, items)
+        db.session.commit()
+        invalidate_cart(user_id)
+
+        return json_response(serialize_cart(cart_query(user_id)))
+    except CartError as e:
+        db.session.rollback()
+        return jsonify(e.to_dict()), e.status
+    except InsufficientStock:
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient stock'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -84,19 +123,23 @@ def update_cart_item(item_id):
 
         if not validate_quantity(quantity):
             return jsonify({'error': 'Invalid quantity'}), 400
+        quantity = int(quantity)
 
-        # Check stock
-        if cart_item.product.stock < quantity:
-            return jsonify({'error': 'Insufficient stock'}), 400
+        # Hold the new quantity
+        reserve(user_id, cart_item.product_id, quantity)
 
         cart_item.quantity = quantity
         db.session.commit()
+        invalidate_cart(user_id)
 
         return jsonify({
             'success': True,
             'message': 'Cart item updated',
             'item': cart_item.to_dict()
         }), 200
+    except InsufficientStock:
+        db.session.rollback()
+        return jsonify({'error': 'Insufficient stock'}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -112,8 +155,10 @@ def remove_cart_item(item_id):
         if not cart_item:
             return jsonify({'error': 'Cart item not found'}), 404
 
+        release(user_id, cart_item.product_id)
         db.session.delete(cart_item)
         db.session.commit()
+        invalidate_cart(user_id)
 
         return jsonify({'success': True, 'message': 'Item removed from cart'}), 200
     except Exception as e:
@@ -126,8 +171,10 @@ def clear_cart():
     """Clear all items from cart"""
     try:
         user_id = get_current_user_id()
+        release(user_id)
         Cart.query.filter_by(user_id=user_id).delete()
         db.session.commit()
+        invalidate_cart(user_id)
 
         return jsonify({'success': True, 'message': 'Cart cleared'}), 200
     except Exception as e:
@@ -1,10 +1,78 @@
-from flask import Blueprint, request, jsonify
-from models import db, Category, Subcategory
+import hashlib
+import json
+import time
+from flask import Blueprint, request, jsonify, Response
+from sqlalchemy import func
+from sqlalchemy.orm import selectinload
+from models import db, Category, Subcategory, Product
 from auth_utils import login_required, require_role
 from validators import validate_required_fields
 
 categories_bp = Blueprint('categories', __name__)
 
+# Per-process cache of the serialized category tree. Writes bump the version;
+# the TTL bounds staleness from writes handled by other workers.
+CATEGORY_TREE_TTL = 300  # seconds
+_category_tree = {'version': 0, 'built_version': None, 'expires_at': 0, 'body': None, 'etag': None}
+
+def invalidate_category_tree():
+    """Mark the cached category tree stale (call after category or product writes)"""
+    _category_tree['version'] += 1
+
+def build_category_tree():
+    """Serialize categories, subcategories and active product counts"""
+    categories = Category.query.options(selectinload(Category.subcategories)).order_by(Category.name).all()
+    counts = db.session.query(
+        Product.category, Product.subcategory, func.count(Product.id)
+    ).filter_by(status='active').group_by(Product.category, Product.subcategory).all()
+
+    category_counts, subcategory_counts = {}, {}
+    for category_name, subcategory_name, count in counts:
+        category_counts[category_name] = category_counts.get(category_name, 0) + count
+        subcategory_counts[(category_name, subcategory_name)] = count
+
+    tree = []
+    for category in categories:
+        node = category.to_dict()
+        node['product_count'] = category_counts.get(category.name, 0)
+        node['subcategories'] = []
+        for subcategory in sorted(category.subcategories, key=lambda sub: sub.name):
+            child = subcategory.to_dict()
+            child['product_count'] = subcategory_counts.get((category.name, subcategory.name), 0)
+            node['subcategories'].append(child)
+        tree.append(node)
+    return tree
+
+def get_cached_category_tree():
+    """Return (body, etag), rebuilding only when invalidated or expired"""
+    cache = _category_tree
+    now = time.monotonic()
+    if cache['built_version'] != cache['version'] or now >= cache['expires_at']:
+        version = cache['version']
+        body = json.dumps(build_category_tree(), sort_keys=True, separators=(',', ':'))
+        cache.update(
+            built_version=version,
+            expires_at=now + CATEGORY_TREE_TTL,
+            body=body,
+            etag=hashlib.sha256(body.encode('utf-8')).hexdigest()
+        )
+    return cache['body'], cache['etag']
+
+@categories_bp.route('/tree', methods=['GET'])
+def get_category_tree():
+    """Get the nested category hierarchy with product counts"""
+    try:
+        body, etag = get_cached_category_tree()
+        if request.if_none_match.contains(etag):
+            response = Response(status=304)
+        else:
+            response = Response(body, mimetype='application/json')
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'public, max-age=0, must-revalidate'
+        return response
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @categories_bp.route('/', methods=['GET'])
 def get_categories():
     """Get all categories"""
@@ -48,6 +116,7 @@ def create_category():
 
         db.session.add(category)
         db.session.commit()
+        invalidate_category_tree()
 
         return jsonify({
             'success': True,
@@ -74,6 +143,7 @@ def update_category(category_id):
                 setattr(category, field, data[field])
 
         db.session.commit()
+        invalidate_category_tree()
 
         return jsonify({
             'success': True,
@@ -98,6 +168,7 @@ def delete_category(category_id):
 
         db.session.delete(category)
         db.session.commit()
+        invalidate_category_tree()
 
         return jsonify({
             'success': True,
@@ -153,6 +224,7 @@ def create_subcategory():
 
         db.session.add(subcategory)
         db.session.commit()
+        invalidate_category_tree()
 
         return jsonify({
             'success': True,
@@ -184,6 +256,7 @@ def update_subcategory(subcategory_id):
                 setattr(subcategory, field, data[field])
 
         db.session.commit()
+        invalidate_category_tree()
 
         return jsonify({
             'success': True,
@@ -204,6 +277,7 @@ def delete_subcategory(subcategory_id):
 
         db.session.delete(subcategory)
         db.session.commit()
+        invalidate_category_tree()
 
         return jsonify({
             'success': True,
@@ -2,17 +2,21 @@ from flask import Blueprint, request, jsonify
 from models import db, Favorite, Product
 from auth_utils import login_required, get_current_user_id
 from validators import validate_required_fields
+from serializers import favorites_query, serialize_favorites, json_response, PRODUCT_FIELDS
+from utils import parse_fields, InvalidFields
 
 favorites_bp = Blueprint('favorites', __name__)
 
 @favorites_bp.route('/', methods=['GET'])
 @login_required
 def get_favorites():
-    """Get user's favorite products"""
+    """Get user's favorite products (?fields= narrows each nested product)"""
     try:
         user_id = get_current_user_id()
-        favorites = Favorite.query.filter_by(user_id=user_id).all()
-        return jsonify([fav.to_dict() for fav in favorites]), 200
+        fields = parse_fields(PRODUCT_FIELDS)
+        return json_response(serialize_favorites(favorites_query(user_id, fields), fields))
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
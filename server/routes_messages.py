@@ -1,8 +1,13 @@
-from flask import Blueprint, request, jsonify
+import time
+from flask import Blueprint, request, jsonify, current_app
 from models import db, Message, User
 from auth_utils import login_required, get_current_user_id
 from validators import validate_required_fields
 from sqlalchemy import or_, and_
+from utils import keyset_paginate, set_pagination_headers, InvalidCursor, parse_per_page
+from realtime import push, waiter
+from conversations import (conversation_query, serialize_conversations, record_message, record_status_change,
+                           record_read, unread_counts)
 
 messages_bp = Blueprint('messages', __name__)
 
@@ -12,32 +17,7 @@ def get_conversations():
     """Get user's message conversations"""
     try:
         user_id = get_current_user_id()
-
-        # Get all messages involving the user
-        messages = Message.query.filter(
-            or_(Message.sender_id == user_id, Message.receiver_id == user_id)
-        ).order_by(Message.created_at.desc()).all()
-
-        # Group by conversation partner
-        conversations = {}
-        for msg in messages:
-            partner_id = msg.receiver_id if msg.sender_id == user_id else msg.sender_id
-            if partner_id not in conversations:
-                partner = User.query.get(partner_id)
-                conversations[partner_id] = {
-                    'id': partner_id,
-                    'artisan': {
-                        'id': partner.id,
-                        'name': partner.full_name,
-                        'avatar': partner.profile_picture_url or '/images/placeholder.svg',
-                        'online': True  # Could be enhanced with actual online status
-                    },
-                    'lastMessage': msg.message,
-                    'lastMessageTime': msg.created_at.strftime('%H:%M'),
-                    'unread': 0  # Could be enhanced with actual unread count
-                }
-
-        return jsonify(list(conversations.values())), 200
+        return jsonify(serialize_conversations(conversation_query(user_id))), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -57,13 +37,91 @@ def get_messages():
         if not other_user:
             return jsonify({'error': 'User not found'}), 404
 
-        # Get messages between users
-        messages = Message.query.filter(
+        query = Message.query.filter(
             or_(
                 and_(Message.sender_id == user_id, Message.receiver_id == other_user_id),
                 and_(Message.sender_id == other_user_id, Message.receiver_id == user_id)
             )
-        ).order_by(Message.created_at).all()
+        )
+
+        # ?after_id= fetches what arrived since the newest message shown,
+        # ?before_id= the page of history above the oldest one
+        after_id = request.args.get('after_id', type=int)
+        before_id = request.args.get('before_id', type=int)
+        if after_id is not None or before_id is not None:
+            per_page = parse_per_page()
+            if after_id is not None:
+                window = query.filter(Message.id > after_id).order_by(Message.id)
+            else:
+                window = query.filter(Message.id < before_id).order_by(Message.id.desc())
+            messages = window.limit(per_page + 1).all()
+            has_more = len(messages) > per_page
+            messages = messages[:per_page]
+            if after_id is None:
+                messages.reverse()
+
+            response = jsonify([msg.to_dict() for msg in messages])
+            response.headers['X-Has-More'] = 'true' if has_more else 'false'
+            return response, 200
+
+        # Otherwise the newest page first; next_cursor walks back in history
+        page = keyset_paginate(query, Message)
+
+        # Each page is returned in chronological order for display
+        response = jsonify([msg.to_dict() for msg in reversed(page['items'])])
+        return set_pagination_headers(response, page['pagination']), 200
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@messages_bp.route('/poll', methods=['GET'])
+@login_required
+def poll_messages():
+    """Long-poll: messages to the user after ?after_id=, waiting up to ?timeout= seconds for one to arrive"""
+    try:
+        user_id = get_current_user_id()
+        after_id = request.args.get('after_id', type=int)
+        max_timeout = current_app.config.get('MESSAGE_POLL_TIMEOUT', 25)
+        timeout = max(0.0, min(request.args.get('timeout', max_timeout, type=float), max_timeout))
+        received = Message.query.filter(Message.receiver_id == user_id)
+        if after_id is None:
+            # Without a cursor, wait for whatever arrives from now on
+            after_id = db.session.query(db.func.max(Message.id)).filter(Message.receiver_id == user_id).scalar() or 0
+
+        def fetch():
+            return received.filter(Message.id > after_id).order_by(Message.id).limit(parse_per_page()).all()
+
+        slots = current_app.extensions['poll_slots']
+        new_message = waiter(user_id, ['new_message'])
+        if new_message is None or not slots.acquire(blocking=False):
+            # No push (or no bus), or too many waiting already: answer now rather than tie up another thread
+            if new_message is not None:
+                new_message.close()
+            response = jsonify([msg.to_dict() for msg in fetch()])
+            response.headers['Retry-After'] = '1'
+            return response, 200
+
+        # Wait in slices and look in the database after each one: a bus that isn't shared never
+        # hears sends handled by other workers, and a shared one can drop events while reconnecting
+        if current_app.extensions['realtime'].bus.shared:
+            recheck = current_app.config.get('MESSAGE_POLL_SHARED_RECHECK_INTERVAL', 5)
+        else:
+            recheck = current_app.config.get('MESSAGE_POLL_RECHECK_INTERVAL', 1.5)
+
+        try:
+            deadline = time.monotonic() + timeout
+            messages = fetch()
+            while not messages and time.monotonic() < deadline:
+                # Don't hold a pooled connection while waiting
+                db.session.close()
+                remaining = deadline - time.monotonic()
+                # Messages the user sent elsewhere wake it too, then fetch() comes back empty
+                if new_message.wait(min(remaining, recheck) if recheck else remaining) or recheck:
+                    messages = fetch()
+        finally:
+            new_message.close()
+            slots.release()
 
         return jsonify([msg.to_dict() for msg in messages]), 200
     except Exception as e:
@@ -105,24 +163,68 @@ def send_message():
         )
 
         db.session.add(message)
+        db.session.flush()
+        record_message(message)
         db.session.commit()
 
+        message_data = message.to_dict()
+        # The sender's other devices get it too
+        push([receiver_id, user_id], 'new_message', message_data)
+
         return jsonify({
             'success': True,
             'message': 'Message sent successfully',
-            'message_data': message.to_dict()
+            'message_data': message_data
         }), 201
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
 
+@messages_bp.route('/read', methods=['PUT'])
+@login_required
+def mark_thread_read():
+    """Mark every message from partner_id (optionally up to up_to_id) as read"""
+    try:
+        user_id = get_current_user_id()
+        data = request.get_json(silent=True) or {}
+        try:
+            partner_id = int(data['partner_id'])
+            up_to_id = int(data['up_to_id']) if data.get('up_to_id') is not None else None
+        except (KeyError, TypeError, ValueError):
+            return jsonify({'error': 'partner_id is required and ids must be integers'}), 400
+
+        criteria = [Message.receiver_id == user_id, Message.sender_id == partner_id,
+                    db.func.coalesce(Message.status, 'sent') != 'read']
+        if up_to_id is not None:
+            criteria.append(Message.id <= up_to_id)
+        updated = db.session.execute(
+            Message.__table__.update().where(*criteria).values(status='read')
+        ).rowcount
+        record_read(user_id, partner_id, updated)
+        db.session.commit()
+
+        if updated:
+            # Read receipts for the partner's open chat windows
+            push(partner_id, 'messages_read', {'reader_id': user_id, 'up_to_id': up_to_id})
+        unread, total_unread = unread_counts(user_id, partner_id)
+        return jsonify({
+            'success': True,
+            'updated': updated,
+            'unread': unread,
+            'total_unread': total_unread
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
 @messages_bp.route('/<int:message_id>/status', methods=['PUT'])
 @login_required
 def update_message_status(message_id):
     """Update message status (e.g., mark as read/delivered)"""
     try:
         user_id = get_current_user_id()
-        message = Message.query.get_or_404(message_id)
+        # Locked so a concurrent PUT /messages/read can't count the same message off the unread counter
+        message = Message.query.filter_by(id=message_id).with_for_update().first_or_404()
 
         # Only receiver can update status
         if message.receiver_id != user_id:
@@ -134,7 +236,9 @@ def update_message_status(message_id):
         if status not in ['sent', 'delivered', 'read']:
             return jsonify({'error': 'Invalid status'}), 400
 
+        previous_status = message.status
         message.status = status
+        record_status_change(message, previous_status)
         db.session.commit()
 
         return jsonify({
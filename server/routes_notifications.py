@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify
 from models import db, Notification
 from auth_utils import login_required, get_current_user_id
+from utils import keyset_paginate, set_pagination_headers, InvalidCursor
+from realtime import push
 
 notifications_bp = Blueprint('notifications', __name__)
 
@@ -10,8 +12,12 @@ def get_notifications():
     """Get user's notifications"""
     try:
         user_id = get_current_user_id()
-        notifications = Notification.query.filter_by(user_id=user_id).order_by(Notification.created_at.desc()).all()
-        return jsonify([notif.to_dict() for notif in notifications]), 200
+        page = keyset_paginate(Notification.query.filter_by(user_id=user_id), Notification,
+                               total_key=f'notifications:{user_id}')
+        response = jsonify([notif.to_dict() for notif in page['items']])
+        return set_pagination_headers(response, page['pagination']), 200
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -66,6 +72,7 @@ def create_notification(user_id, message, notification_type):
         )
         db.session.add(notification)
         db.session.commit()
+        push(user_id, 'notification', notification.to_dict())
         return notification
     except Exception as e:
         db.session.rollback()
@@ -1,8 +1,16 @@
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, request, jsonify, current_app, Response, stream_with_context
 from models import db, Order, OrderItem, Cart, Product
-from auth_utils import login_required, get_current_user_id, require_role
+from auth_utils import login_required, get_current_user_id, get_current_user_role, require_role
 from validators import validate_required_fields
-from datetime import datetime
+from utils import keyset_paginate, set_pagination_headers, InvalidCursor
+from cache import invalidate
+from checkout import place_order, CheckoutError
+from cart import invalidate_cart
+from realtime import push
+from inventory import reserve_cart
+from serializers import (project_orders, serialize_orders, json_response, order_export_query, stream_order_export,
+                         EXPORT_MIMETYPES)
+from datetime import datetime, timedelta
 
 orders_bp = Blueprint('orders', __name__)
 
@@ -12,8 +20,12 @@ def get_orders():
     """Get user's orders"""
     try:
         user_id = get_current_user_id()
-        orders = Order.query.filter_by(user_id=user_id).all()
-        return jsonify([order.to_dict() for order in orders]), 200
+        page = keyset_paginate(project_orders(Order.query.filter_by(user_id=user_id)), Order,
+                               total_key=f'orders:{user_id}')
+        response = json_response(serialize_orders(page['items']))
+        return set_pagination_headers(response, page['pagination'])
+    except InvalidCursor as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -23,78 +35,88 @@ def get_order(order_id):
     """Get specific order details"""
     try:
         user_id = get_current_user_id()
-        order = Order.query.filter_by(id=order_id, user_id=user_id).first()
+        rows = project_orders(Order.query.filter_by(id=order_id, user_id=user_id)).all()
 
-        if not order:
+        if not rows:
             return jsonify({'error': 'Order not found'}), 404
 
-        return jsonify(order.to_dict()), 200
+        return json_response(serialize_orders(rows)[0])
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-@orders_bp.route('/', methods=['POST'])
+@orders_bp.route('/export', methods=['GET'])
 @login_required
-def create_order():
-    """Create new order from cart"""
+def export_orders():
+    """Stream order lines as ?format=csv|ndjson: the user's purchases, or with ?as=artisan their sales"""
+    user_id = get_current_user_id()
+    export_format = request.args.get('format', 'csv')
+    if export_format not in EXPORT_MIMETYPES:
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+    scope = request.args.get('as', 'artisan' if get_current_user_role() == 'artisan' else 'buyer')
+    if scope == 'artisan':
+        if get_current_user_role() != 'artisan':
+            return jsonify({'error': 'Access denied. Artisan role required.'}), 403
+        criterion = OrderItem.artisan_id == user_id
+    elif scope == 'buyer':
+        criterion = Order.user_id == user_id
+    else:
+        return jsonify({'error': 'as must be buyer or artisan'}), 400
+
+    stream = stream_order_export(order_export_query(criterion), export_format,
+                                 current_app.config.get('ORDER_EXPORT_BATCH_SIZE', 1000))
+    response = Response(stream_with_context(stream), mimetype=EXPORT_MIMETYPES[export_format])
+    response.headers['Content-Disposition'] = f'attachment; filename=orders.{export_format}'
+    response.headers['Cache-Control'] = 'private, no-store'
+    return response
+
+@orders_bp.route('/checkout', methods=['POST'])
+@login_required
+def start_checkout():
+    """Hold stock for every cart line while the buyer pays"""
     try:
         user_id = get_current_user_id()
-        data = request.get_json()
-
-        # Get cart items
-        cart_items = Cart.query.filter_by(user_id=user_id).all()
-        if not cart_items:
+        lines = Cart.query.with_entities(Cart.product_id, Cart.quantity).filter_by(user_id=user_id).all()
+        if not lines:
             return jsonify({'error': 'Cart is empty'}), 400
 
-        # Calculate total amount
-        total_amount = 0
-        order_items = []
-
-        for cart_item in cart_items:
-            if cart_item.product.stock < cart_item.quantity:
-                return jsonify({'error': f'Insufficient stock for {cart_item.product.title}'}), 400
-
-            item_total = cart_item.product.price * cart_item.quantity
-            total_amount += item_total
-
-            order_items.append({
-                'product_id': cart_item.product_id,
-                'quantity': cart_item.quantity,
-                'unit_price': cart_item.product.price,
-                'total_price': item_total,
-                'artisan_id': cart_item.product.artisan_id
-            })
-
-        # Create order
-        order = Order(
-            user_id=user_id,
-            total_amount=total_amount,
-            status='pending'
-        )
-        db.session.add(order)
-        db.session.flush()  # Get order ID
-
-        # Create order items
-        for item_data in order_items:
-            order_item = OrderItem(
-                order_id=order.id,
-                **item_data
-            )
-            db.session.add(order_item)
-
-            # Update product stock
-            product = Product.query.get(item_data['product_id'])
-            product.stock -= item_data['quantity']
-
-        # Clear cart
-        Cart.query.filter_by(user_id=user_id).delete()
-
+        ttl = current_app.config.get('RESERVATION_CHECKOUT_TTL', 30 * 60)
+        short = reserve_cart(user_id, lines, ttl)
         db.session.commit()
 
+        if short:
+            titles = [title for (title,) in Product.query.with_entities(Product.title).filter(Product.id.in_(short))]
+            return jsonify({
+                'error': f"Insufficient stock for {', '.join(titles)}",
+                'unavailable_product_ids': short
+            }), 409
+
+        return jsonify({
+            'success': True,
+            'message': 'Stock reserved',
+            'expires_at': (datetime.utcnow() + timedelta(seconds=ttl)).isoformat()
+        }), 200
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({'error': str(e)}), 500
+
+@orders_bp.route('/', methods=['POST'])
+@login_required
+def create_order():
+    """Create new order from cart"""
+    try:
+        user_id = get_current_user_id()
+        order = place_order(user_id)
+        invalidate('products')
+        invalidate_cart(user_id)
+
         return jsonify({
             'success': True,
             'message': 'Order created successfully',
             'order': order.to_dict()
         }), 201
+    except CheckoutError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         db.session.rollback()
         return jsonify({'error': str(e)}), 500
@@ -116,9 +138,7 @@ def update_order_status(order_id):
         is_authorized = False
 
         # Check if user is admin
-        from models import User
-        user = User.query.get(user_id)
-        if user.role == 'admin':
+        if get_current_user_role() == 'admin':
             is_authorized = True
         else:
             # Check if user is artisan for any product in the order
@@ -132,6 +152,7 @@ def update_order_status(order_id):
 
         order.status = data['status']
         db.session.commit()
+        push(order.user_id, 'order_status', {'order_id': order.id, 'status': order.status})
 
         return jsonify({
             'success': True,
@@ -3,6 +3,7 @@ from models import db, Payment, Order
 from auth_utils import login_required, get_current_user_id
 from validators import validate_required_fields
 from mpesa_utils import mpesa_api
+from realtime import push
 import requests
 import os
 
@@ -241,6 +242,7 @@ def mpesa_callback():
                 if order:
                     order.status = 'processing'  # Or 'paid' if you have that status
                     db.session.commit()
+                    push(order.user_id, 'order_status', {'order_id': order.id, 'status': order.status})
 
         else:
             # Payment failed
@@ -249,6 +251,13 @@ def mpesa_callback():
 
             current_app.logger.error(f"Payment {payment.id} failed: {result_desc}")
 
+        # Same shape as GET /payments/status/<id>, which clients no longer need to poll
+        push(payment.user_id, 'payment_status', {
+            'payment_id': payment.id,
+            'status': payment.status,
+            'transaction_id': payment.transaction_id
+        })
+
         return jsonify({'ResultCode': 0, 'ResultDesc': 'Callback processed successfully'}), 200
 
     except Exception as e:
@@ -1,11 +1,21 @@
 from flask import Blueprint, request, jsonify
+from sqlalchemy.orm import joinedload
 from models import db, Product
 from auth_utils import login_required, get_current_user_id, require_role
 from validators import validate_required_fields, validate_price, validate_quantity
+from utils import keyset_paginate, set_pagination_headers, InvalidCursor, parse_fields, InvalidFields
+from search import search_filter, search_products
+from suggest import suggestion_index
+from routes_categories import invalidate_category_tree
+from cache import cached, invalidate
+from cart import invalidate_carts_holding
+from fanout import notify_followers_of_product
+from serializers import project_products, serialize_products, json_response, PRODUCT_FIELDS
 
 products_bp = Blueprint('products', __name__)
 
 @products_bp.route('/', methods=['GET'])
+@cached(tags=['products'])
 def get_products():
     """Get all products with optional filtering"""
     try:
@@ -13,6 +23,7 @@ def get_products():
         category = request.args.get('category')
         subcategory = request.args.get('subcategory')
         search = request.args.get('search')
+        fields = parse_fields(PRODUCT_FIELDS)
         
         query = Product.query.filter_by(status='active')
         
@@ -21,17 +32,77 @@ def get_products():
         if subcategory:
             query = query.filter_by(subcategory=subcategory)
         if search:
-            query = query.filter(
-                (Product.title.ilike(f'%{search}%')) | 
-                (Product.description.ilike(f'%{search}%'))
-            )
+            query = query.filter(search_filter(search))
         
-        products = query.all()
-        return jsonify([product.to_dict() for product in products]), 200
+        page = keyset_paginate(
+            project_products(query, fields), Product,
+            total_key=f'products:{category}:{subcategory}:{search}'
+        )
+        response = json_response(serialize_products(page['items'], fields))
+        return set_pagination_headers(response, page['pagination'])
+    except (InvalidCursor, InvalidFields) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@products_bp.route('/search', methods=['GET'])
+def search_catalog():
+    """Full-text product search ranked by relevance, with highlighted snippets"""
+    try:
+        search_text = request.args.get('q', '').strip()
+        if not search_text:
+            return jsonify({'error': 'q parameter required'}), 400
+
+        try:
+            page = max(int(request.args.get('page', 1)), 1)
+            per_page = max(1, min(int(request.args.get('per_page', 20)), 100))
+        except (ValueError, TypeError):
+            page, per_page = 1, 20
+
+        # Fetch one extra hit to know whether another page exists
+        hits = search_products(search_text, limit=per_page + 1, offset=(page - 1) * per_page)
+        has_next = len(hits) > per_page
+        hits = hits[:per_page]
+
+        products = Product.query.options(joinedload(Product.artisan)).filter(
+            Product.id.in_([product_id for product_id, _, _ in hits])
+        ).all()
+        products_by_id = {product.id: product for product in products}
+
+        items = []
+        for product_id, score, snippet in hits:
+            product = products_by_id.get(product_id)
+            if product:
+                items.append({**product.to_dict(), 'score': float(score), 'snippet': snippet})
+
+        return jsonify({
+            'items': items,
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'has_next': has_next,
+                'has_prev': page > 1
+            }
+        }), 200
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@products_bp.route('/suggest', methods=['GET'])
+def suggest():
+    """Autocomplete product titles and category names from the in-memory index"""
+    try:
+        try:
+            limit = max(1, min(int(request.args.get('limit', 10)), 25))
+        except (ValueError, TypeError):
+            limit = 10
+
+        suggestion_index.ensure_fresh()
+        return jsonify(suggestion_index.suggest(request.args.get('q', ''), limit=limit)), 200
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @products_bp.route('/<int:product_id>', methods=['GET'])
+@cached(tags=['products', 'product:{product_id}'])
 def get_product(product_id):
     """Get a single product by ID"""
     try:
@@ -79,6 +150,10 @@ def create_product():
         
         db.session.add(product)
         db.session.commit()
+        invalidate('products')
+        suggestion_index.add_product(product)
+        invalidate_category_tree()
+        notify_followers_of_product(product)
         
         return jsonify({
             'success': True,
@@ -111,6 +186,11 @@ def update_product(product_id):
                 setattr(product, field, data[field])
         
         db.session.commit()
+        if 'price' in data or 'currency' in data:
+            invalidate_carts_holding(product_id)
+        invalidate('products')
+        suggestion_index.add_product(product)
+        invalidate_category_tree()
         
         return jsonify({
             'success': True,
@@ -133,8 +213,12 @@ def delete_product(product_id):
         if product.artisan_id != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
         
+        invalidate_carts_holding(product_id)
         db.session.delete(product)
         db.session.commit()
+        invalidate('products')
+        suggestion_index.remove_product(product_id)
+        invalidate_category_tree()
         
         return jsonify({
             'success': True,
@@ -2,10 +2,23 @@ from flask import Blueprint, request, jsonify
 from models import db, Review, Product
 from auth_utils import login_required, get_current_user_id
 from validators import validate_required_fields
+from cache import cached, invalidate
 
 reviews_bp = Blueprint('reviews', __name__)
 
+def adjust_product_rating(product_id, rating_delta, count_delta):
+    """Apply a review change to the product's stored rating aggregates.
+
+    Runs as a single UPDATE in the caller's transaction so concurrent
+    reviews can't lose each other's increments.
+    """
+    Product.query.filter_by(id=product_id).update({
+        Product.rating_sum: Product.rating_sum + rating_delta,
+        Product.rating_count: Product.rating_count + count_delta
+    }, synchronize_session=False)
+
 @reviews_bp.route('/product/<int:product_id>', methods=['GET'])
+@cached(tags=['reviews:{product_id}'])
 def get_product_reviews(product_id):
     """Get all reviews for a product"""
     try:
@@ -58,7 +71,9 @@ def create_review():
         )
 
         db.session.add(review)
+        adjust_product_rating(product_id, rating, 1)
         db.session.commit()
+        invalidate('products', f'reviews:{product_id}')
 
         return jsonify({
             'success': True,
@@ -88,6 +103,8 @@ def update_review(review_id):
             rating = data['rating']
             if not isinstance(rating, int) or rating < 1 or rating > 5:
                 return jsonify({'error': 'Rating must be between 1 and 5'}), 400
+            if rating != review.rating:
+                adjust_product_rating(review.product_id, rating - review.rating, 0)
             review.rating = rating
 
         # Update comment if provided
@@ -95,6 +112,7 @@ def update_review(review_id):
             review.comment = data['comment']
 
         db.session.commit()
+        invalidate('products', f'reviews:{review.product_id}')
 
         return jsonify({
             'success': True,
@@ -117,8 +135,11 @@ def delete_review(review_id):
         if review.user_id != user_id:
             return jsonify({'error': 'Unauthorized'}), 403
 
+        product_id = review.product_id
         db.session.delete(review)
+        adjust_product_rating(product_id, -review.rating, -1)
         db.session.commit()
+        invalidate('products', f'reviews:{product_id}')
 
         return jsonify({
             'success': True,
@@ -1,6 +1,12 @@
 from flask import Blueprint, request, jsonify
 from models import db, User
-from auth_utils import login_required, require_role, get_current_user_id
+from auth_utils import (login_required, require_role, get_current_user_id, get_current_user_role,
+                        forget_identity)
+from cache import invalidate
+from tokens import revoke_user_tokens
+from inventory import release
+from serializers import project_users, serialize_users, user_row_to_dict, json_response, USER_FIELDS
+from utils import parse_fields, InvalidFields
 
 users_bp = Blueprint('users', __name__)
 
@@ -10,8 +16,10 @@ users_bp = Blueprint('users', __name__)
 def get_users():
     """Get all users (admin only)"""
     try:
-        users = User.query.all()
-        return jsonify([user.to_dict() for user in users]), 200
+        fields = parse_fields(USER_FIELDS)
+        return json_response(serialize_users(project_users(User.query.order_by(User.id), fields), fields))
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -21,14 +29,18 @@ def get_user(user_id):
     """Get user by ID"""
     try:
         current_user_id = get_current_user_id()
-        user = User.query.get_or_404(user_id)
+        fields = parse_fields(USER_FIELDS)
+        user = project_users(User.query.filter_by(id=user_id), fields).first()
+        if not user:
+            return jsonify({'error': 'User not found'}), 404
 
         # Users can only view their own profile or admins can view any
-        current_user = User.query.get(current_user_id)
-        if user_id != current_user_id and current_user.role != 'admin':
+        if user_id != current_user_id and get_current_user_role() != 'admin':
             return jsonify({'error': 'Unauthorized'}), 403
 
-        return jsonify(user.to_dict()), 200
+        return json_response(user_row_to_dict(user, fields))
+    except InvalidFields as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
         return jsonify({'error': 'User not found'}), 404
 
@@ -41,22 +53,29 @@ def update_user(user_id):
         user = User.query.get_or_404(user_id)
 
         # Check permissions
-        current_user = User.query.get(current_user_id)
-        if user_id != current_user_id and current_user.role != 'admin':
+        current_role = get_current_user_role()
+        if user_id != current_user_id and current_role != 'admin':
             return jsonify({'error': 'Unauthorized'}), 403
 
         data = request.get_json()
 
         # Update allowed fields
         allowed_fields = ['full_name', 'description', 'location', 'phone', 'profile_picture_url']
-        if current_user.role == 'admin':
+        if current_role == 'admin':
             allowed_fields.extend(['role', 'email'])  # Admins can update more fields
 
+        previous_role = user.role
         for field in allowed_fields:
             if field in data:
                 setattr(user, field, data[field])
 
+        # Tokens carry the role, so a role change invalidates them
+        if user.role != previous_role:
+            revoke_user_tokens(user_id)
+
         db.session.commit()
+        forget_identity(user_id)
+        invalidate(f'user:{user_id}', 'products')
 
         return jsonify({
             'success': True,
@@ -80,8 +99,12 @@ def delete_user(user_id):
         if user_id == current_user_id:
             return jsonify({'error': 'Cannot delete your own account'}), 400
 
+        release(user_id)
         db.session.delete(user)
+        revoke_user_tokens(user_id)
         db.session.commit()
+        forget_identity(user_id)
+        invalidate(f'user:{user_id}', f'cart:{user_id}', 'products')
 
         return jsonify({
             'success': True,
@@ -5,80 +5,132 @@ Run with: python run_tests.py
 """
 import pytest
 import requests
+import redis
 import json
 from flask import Flask
-from models import db, User, Product, Category
+from models import db, User, Product, Category, Subcategory, Review, Cart, Favorite, Order, OrderItem, \
+    StoredSession, RevokedToken, Reservation, Message, Conversation, Payment, Follow, Notification, reconcile_rating_aggregates, \
+    upgrade_schema, ADDED_COLUMNS
+from routes_categories import invalidate_category_tree
 from app import create_app
+from suggest import suggestion_index, SuggestionIndex, REBUILD_INTERVAL
+from cache import response_cache, MemoryCache, RedisCache, FakeRedis
+import serializers
+import utils
+from sessions import init_sessions, SqlSessionStore
+from passwords import PasswordHasher, password_hasher, hash_cost, login_concurrency
+from tokens import RevocationList, TokenSigner, revoke_token
+from routes_notifications import create_notification
+from conversations import rebuild_conversations
+from inventory import sweep_expired, reserve, release
+from fanout import notification_fanout, notify_followers
+from realtime import Hub, RedisBus
+import threading
+import time
+from sqlalchemy import event, insert
+from datetime import datetime, timedelta
+import gzip
+import base64
+import csv
+import io
 import tempfile
 import os
+from contextlib import contextmanager
 
-class TestSokoDigitalAPI:
-    """Test class for SokoDigital API endpoints"""
 
-    @pytest.fixture(scope='class')
-    def app(self):
-        """Create test app with test database"""
-        app = create_app('testing')
-        with app.app_context():
-            db.create_all()
+def capture_queries(fn):
+    """Run fn and return the SQL statements it issued"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return statements
+
+
+@contextmanager
+def isolated_app(**config):
+    """create_app('testing') with config overrides, inside an app context over a fresh schema"""
+    app = create_app('testing')
+    app.config.update(config)
+    with app.app_context():
+        db.create_all()
+        try:
             yield app
+        finally:
             db.drop_all()
 
-    @pytest.fixture(scope='class')
-    def client(self, app):
-        """Test client"""
-        return app.test_client()
+
+@pytest.fixture(scope='class')
+def app():
+    """Test app with its own database, shared by the tests of a class"""
+    with isolated_app() as app:
+        yield app
+
+
+@pytest.fixture(scope='class')
+def client(app):
+    """Test client"""
+    return app.test_client()
+
+
+class TestSokoDigitalAPI:
+    """Test class for SokoDigital API endpoints"""
 
     @pytest.fixture(scope='class')
     def test_data(self, app):
         """Create test data"""
-        with app.app_context():
-            # Create test category
-            category = Category(name='Test Category', description='Test category')
-            db.session.add(category)
-
-            # Create test artisan
-            artisan = User(
-                full_name='Test Artisan',
-                email='artisan@test.com',
-                role='artisan',
-                location='Test Location'
-            )
-            artisan.set_password('password123')
-            db.session.add(artisan)
+        # Create test category
+        category = Category(name='Test Category', description='Test category')
+        db.session.add(category)
 
-            # Create test buyer
-            buyer = User(
-                full_name='Test Buyer',
-                email='buyer@test.com',
-                role='buyer'
-            )
-            buyer.set_password('password123')
-            db.session.add(buyer)
+        # Create test artisan
+        artisan = User(
+            full_name='Test Artisan',
+            email='artisan@test.com',
+            role='artisan',
+            location='Test Location'
+        )
+        artisan.set_password('password123')
+        db.session.add(artisan)
 
-            # Create test product
-            product = Product(
-                title='Test Product',
-                description='Test product description',
-                price=100.00,
-                category='Test Category',
-                stock=10,
-                artisan_id=1  # Will be set after commit
-            )
-            db.session.add(product)
+        # Create test buyer
+        buyer = User(
+            full_name='Test Buyer',
+            email='buyer@test.com',
+            role='buyer'
+        )
+        buyer.set_password('password123')
+        db.session.add(buyer)
 
-            db.session.commit()
+        # Create test product
+        product = Product(
+            title='Test Product',
+            description='Test product description',
+            price=100.00,
+            category='Test Category',
+            stock=10,
+            artisan_id=1  # Will be set after commit
+        )
+        db.session.add(product)
 
-            # Update product with correct artisan_id
-            product.artisan_id = artisan.id
-            db.session.commit()
+        db.session.commit()
 
-            return {
-                'category': category,
-                'artisan': artisan,
-                'buyer': buyer,
-                'product': product
-            }
+        # Update product with correct artisan_id
+        product.artisan_id = artisan.id
+        db.session.commit()
+
+        return {
+            'category': category,
+            'artisan': artisan,
+            'buyer': buyer,
+            'product': product
+        }
 
     def test_health_check(self, client):
         """Test health check endpoint"""
@@ -235,6 +287,1766 @@ class TestSokoDigitalAPI:
             assert 'review' in data
             assert data['review']['rating'] == 5
 
+class TestProductListing:
+    """Product listing must not issue per-product queries"""
+
+    @pytest.fixture(scope='class')
+    def artisan(self, app):
+        artisan = User(full_name='Listing Artisan', email='listing@test.com',
+                       role='artisan', location='Nairobi')
+        artisan.set_password('password123')
+        reviewer = User(full_name='Listing Reviewer', email='reviewer@test.com', role='buyer')
+        reviewer.set_password('password123')
+        db.session.add_all([artisan, reviewer])
+        db.session.commit()
+        return artisan, reviewer
+
+    def add_products(self, artisan, reviewer, count):
+        for i in range(count):
+            product = Product(title=f'Listing Product {i}', description='desc',
+                              price=50, stock=3, artisan_id=artisan.id)
+            db.session.add(product)
+            db.session.flush()
+            db.session.add(Review(product_id=product.id, user_id=reviewer.id, rating=(i % 5) + 1))
+        db.session.commit()
+
+    def test_query_count_is_constant(self, app, client, artisan):
+        self.add_products(*artisan, count=2)
+        small = len(capture_queries(lambda: client.get('/products/')))
+
+        self.add_products(*artisan, count=20)
+        large = len(capture_queries(lambda: client.get('/products/')))
+
+        assert small == large
+        assert large <= 2
+
+    def test_listing_matches_to_dict(self, app, client, artisan):
+        response = client.get('/products/')
+        assert response.status_code == 200
+        listed = {p['id']: p for p in json.loads(response.data)}
+
+        for product in Product.query.all():
+            assert listed[product.id] == product.to_dict()
+
+class TestReviewAggregates:
+    """Product rating aggregates are maintained by the review routes"""
+
+    @pytest.fixture(scope='class')
+    def product(self, app):
+        artisan = User(full_name='Rating Artisan', email='rating-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        buyer = User(full_name='Rating Buyer', email='rating-buyer@test.com', role='buyer')
+        buyer.set_password('password123')
+        db.session.add_all([artisan, buyer])
+        db.session.flush()
+        product = Product(title='Rated Product', description='desc', price=10, stock=1,
+                          artisan_id=artisan.id)
+        db.session.add(product)
+        db.session.commit()
+        return product
+
+    def stored_aggregates(self, product):
+        db.session.refresh(product)
+        return product.rating_sum, product.rating_count
+
+    def test_review_lifecycle_updates_aggregates(self, client, product):
+        with client:
+            client.post('/auth/login', json={'email': 'rating-buyer@test.com', 'password': 'password123'})
+
+            response = client.post('/reviews/', json={'product_id': product.id, 'rating': 4})
+            assert response.status_code == 201
+            review_id = json.loads(response.data)['review']['id']
+            assert self.stored_aggregates(product) == (4, 1)
+
+            client.put(f'/reviews/{review_id}', json={'rating': 2})
+            assert self.stored_aggregates(product) == (2, 1)
+
+            client.delete(f'/reviews/{review_id}')
+            assert self.stored_aggregates(product) == (0, 0)
+            assert product.rating == 4.5
+
+    def test_serialization_skips_reviews_table(self, app, product):
+        statements = capture_queries(product.to_dict)
+        assert not any('reviews' in statement for statement in statements)
+
+    def test_reconcile_backfills_aggregates(self, app, product):
+        buyer = User.query.filter_by(email='rating-buyer@test.com').first()
+        db.session.add(Review(product_id=product.id, user_id=buyer.id, rating=5))
+        db.session.commit()
+        assert self.stored_aggregates(product) == (0, 0)
+
+        assert reconcile_rating_aggregates() == 1
+        assert self.stored_aggregates(product) == (5, 1)
+        assert reconcile_rating_aggregates() == 0
+
+    def test_upgrade_schema_adds_columns_to_existing_database(self, app, product):
+        # A database created before the aggregates existed
+        db.session.execute(db.text('DROP INDEX ix_products_status_created_id'))
+        for column in ADDED_COLUMNS['products']:
+            db.session.execute(db.text(f'ALTER TABLE products DROP COLUMN {column}'))
+        db.session.commit()
+
+        assert upgrade_schema() == [f'products.{column}' for column in ADDED_COLUMNS['products']]
+        db.session.expire_all()
+        assert self.stored_aggregates(product) == (5, 1)
+        assert 'ix_products_status_created_id' in {
+            index['name'] for index in db.inspect(db.engine).get_indexes('products')}
+        assert upgrade_schema() == []
+
+class TestKeysetPagination:
+    """List endpoints page on (created_at, id) with opaque cursors"""
+
+    @pytest.fixture(scope='class')
+    def product_ids(self, app):
+        artisan = User(full_name='Paging Artisan', email='paging@test.com', role='artisan')
+        artisan.set_password('password123')
+        db.session.add(artisan)
+        db.session.flush()
+        # Several products share a timestamp so the id tie-breaker is exercised
+        stamps = [datetime(2024, 1, day) for day in (1, 2, 2, 2, 3, 4, 4)]
+        products = [
+            Product(title=f'Paged {i}', description='desc', price=1, stock=1,
+                    artisan_id=artisan.id, created_at=stamp)
+            for i, stamp in enumerate(stamps)
+        ]
+        db.session.add_all(products)
+        db.session.commit()
+        return [p.id for p in sorted(products, key=lambda p: (p.created_at, p.id), reverse=True)]
+
+    def test_walks_all_pages_in_order(self, client, product_ids):
+        seen, cursor = [], None
+        while True:
+            url = '/products/?per_page=3' + (f'&cursor={cursor}' if cursor else '')
+            response = client.get(url)
+            assert response.status_code == 200
+            page = json.loads(response.data)
+            assert len(page) <= 3
+            seen.extend(p['id'] for p in page)
+            cursor = response.headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+        assert seen == product_ids
+
+    def test_total_is_optional(self, client, product_ids):
+        assert 'X-Total-Count' not in client.get('/products/').headers
+        response = client.get('/products/?include_total=1')
+        assert response.headers['X-Total-Count'] == str(len(product_ids))
+
+    def test_total_cache_is_bounded(self, client, product_ids):
+        # Every distinct search is its own total; old ones must be evicted
+        limit = utils._total_cache.max_entries
+        utils._total_cache.max_entries = 3
+        try:
+            for index in range(10):
+                client.get(f'/products/?search=word{index}&include_total=1')
+            assert len(utils._total_cache._entries) == 3
+        finally:
+            utils._total_cache.max_entries = limit
+
+    def test_invalid_cursor(self, client, product_ids):
+        response = client.get('/products/?cursor=not-a-cursor')
+        assert response.status_code == 400
+
+class TestProductSearch:
+    """Full-text search replaces ILIKE scans"""
+
+    @pytest.fixture(scope='class')
+    def products(self, app):
+        artisan = User(full_name='Search Artisan', email='search@test.com', role='artisan')
+        artisan.set_password('password123')
+        db.session.add(artisan)
+        db.session.flush()
+        products = {
+            'basket': Product(title='Woven Sisal Basket', description='Hand woven by weavers in Machakos',
+                              price=1, stock=1, artisan_id=artisan.id),
+            'vase': Product(title='Ceramic Vase', description='Glazed pottery, pairs well with a woven basket',
+                            price=1, stock=1, artisan_id=artisan.id),
+            'carving': Product(title='Wood Carving', description='Olive wood elephant',
+                               price=1, stock=1, artisan_id=artisan.id),
+            'kikoi': Product(title='Kikoi Wrap', description='<img src=x onerror=alert(1)> hand-dyed kikoi',
+                             price=1, stock=1, artisan_id=artisan.id),
+        }
+        db.session.add_all(products.values())
+        db.session.commit()
+        return products
+
+    def test_ranks_title_matches_first(self, client, products):
+        response = client.get('/products/search?q=basket')
+        assert response.status_code == 200
+        items = json.loads(response.data)['items']
+        assert [item['id'] for item in items] == [products['basket'].id, products['vase'].id]
+        assert '<mark>basket</mark>' in items[1]['snippet']
+
+    def test_snippet_escapes_description(self, client, products):
+        snippet = json.loads(client.get('/products/search?q=kikoi').data)['items'][0]['snippet']
+        assert '<img' not in snippet
+        assert '&lt;img src=x onerror=alert(1)&gt;' in snippet
+        assert '<mark>kikoi</mark>' in snippet
+
+    def test_prefix_match_and_listing_filter(self, client, products):
+        items = json.loads(client.get('/products/search?q=carv').data)['items']
+        assert [item['id'] for item in items] == [products['carving'].id]
+
+        listed = json.loads(client.get('/products/?search=pottery').data)
+        assert [item['id'] for item in listed] == [products['vase'].id]
+
+    def test_index_follows_updates_and_deletes(self, client, products):
+        products['carving'].title = 'Soapstone Chess Set'
+        db.session.commit()
+        assert json.loads(client.get('/products/search?q=carving').data)['items'] == []
+        assert len(json.loads(client.get('/products/search?q=soapstone').data)['items']) == 1
+
+    def test_pagination(self, client, products):
+        data = json.loads(client.get('/products/search?q=woven&per_page=1').data)
+        assert len(data['items']) == 1
+        assert data['pagination']['has_next'] is True
+        data = json.loads(client.get('/products/search?q=woven&per_page=1&page=2').data)
+        assert data['pagination']['has_next'] is False
+
+class TestSuggestions:
+    """Autocomplete is served from the in-process index"""
+
+    @pytest.fixture(scope='class')
+    def artisan(self, app):
+        artisan = User(full_name='Suggest Artisan', email='suggest@test.com', role='artisan')
+        artisan.set_password('password123')
+        db.session.add(artisan)
+        db.session.add(Category(name='Baskets'))
+        db.session.flush()
+        db.session.add(Product(title='Woven Sisal Basket', description='desc', price=1, stock=1,
+                               category='Baskets', artisan_id=artisan.id))
+        db.session.commit()
+        suggestion_index.rebuild()
+        return artisan
+
+    def test_suggest_without_database(self, client, artisan):
+        statements = capture_queries(lambda: client.get('/products/suggest?q=bas'))
+        assert statements == []
+
+        data = json.loads(client.get('/products/suggest?q=bas').data)
+        assert data[0] == {'text': 'Baskets', 'type': 'category', 'id': None}
+        assert {'text': 'Woven Sisal Basket', 'type': 'product'} in [
+            {'text': d['text'], 'type': d['type']} for d in data]
+
+    def test_multi_word_prefix(self, client, artisan):
+        data = json.loads(client.get('/products/suggest?q=sisal ba').data)
+        assert [d['text'] for d in data] == ['Woven Sisal Basket']
+
+    def test_product_routes_update_index(self, client, artisan):
+        with client:
+            client.post('/auth/login', json={'email': 'suggest@test.com', 'password': 'password123'})
+            response = client.post('/products/', json={
+                'title': 'Maasai Beaded Necklace', 'description': 'desc', 'price': 5,
+                'stock': 2, 'category': 'Jewelry'})
+            product_id = json.loads(response.data)['product']['id']
+            assert [d['text'] for d in json.loads(client.get('/products/suggest?q=bead').data)] == \
+                ['Maasai Beaded Necklace']
+
+            client.put(f'/products/{product_id}', json={'title': 'Beaded Bracelet'})
+            texts = [d['text'] for d in json.loads(client.get('/products/suggest?q=bead').data)]
+            assert texts == ['Beaded Bracelet']
+
+            client.delete(f'/products/{product_id}')
+            assert json.loads(client.get('/products/suggest?q=bead').data) == []
+            assert json.loads(client.get('/products/suggest?q=jewel').data) == []
+
+    def test_stale_index_rebuilds_in_background(self, client, artisan):
+        db.session.add(Product(title='Carved Soapstone Bowl', description='desc', price=1, stock=1,
+                               category='Baskets', artisan_id=artisan.id))
+        db.session.commit()
+        suggestion_index.built_at -= REBUILD_INTERVAL + 1
+        # Holding the lock keeps the rebuild from swapping in, so the old index keeps answering
+        with suggestion_index._lock:
+            thread = suggestion_index.ensure_fresh()
+            assert thread is not None
+            assert suggestion_index.ensure_fresh() is None
+            assert json.loads(client.get('/products/suggest?q=soap').data) == []
+        thread.join(5)
+        assert [d['text'] for d in json.loads(client.get('/products/suggest?q=soap').data)] == \
+            ['Carved Soapstone Bowl']
+
+    def test_memory_budget(self):
+        index = SuggestionIndex(max_entries=2)
+        for product_id, title in enumerate(['Alpha', 'Beta', 'Gamma']):
+            index.add_product(Product(id=product_id, title=title, status='active'))
+        assert index.stats()['entries'] == 2
+        assert index.stats()['dropped'] == 1
+
+class TestCategoryTree:
+    """Category tree is cached per version and revalidated with ETags"""
+
+    @pytest.fixture(scope='class')
+    def taxonomy(self, app):
+        admin = User(full_name='Tree Admin', email='tree-admin@test.com', role='admin')
+        admin.set_password('password123')
+        artisan = User(full_name='Tree Artisan', email='tree-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        category = Category(name='Textiles')
+        db.session.add_all([admin, artisan, category])
+        db.session.flush()
+        db.session.add(Subcategory(name='Kikoi', category_id=category.id))
+        db.session.add_all([
+            Product(title=f'Kikoi {i}', description='desc', price=1, stock=1, artisan_id=artisan.id,
+                    category='Textiles', subcategory='Kikoi')
+            for i in range(2)
+        ])
+        db.session.commit()
+        invalidate_category_tree()
+
+    def test_tree_shape_and_counts(self, client, taxonomy):
+        response = client.get('/categories/tree')
+        assert response.status_code == 200
+        tree = json.loads(response.data)
+        assert tree[0]['name'] == 'Textiles'
+        assert tree[0]['product_count'] == 2
+        assert tree[0]['subcategories'][0]['name'] == 'Kikoi'
+        assert tree[0]['subcategories'][0]['product_count'] == 2
+
+    def test_cached_and_conditional(self, client, taxonomy):
+        etag = client.get('/categories/tree').headers['ETag']
+        statements = capture_queries(lambda: client.get('/categories/tree'))
+        assert statements == []
+
+        response = client.get('/categories/tree', headers={'If-None-Match': etag})
+        assert response.status_code == 304
+        assert response.data == b''
+
+    def test_admin_write_invalidates(self, client, taxonomy):
+        etag = client.get('/categories/tree').headers['ETag']
+        with client:
+            client.post('/auth/login', json={'email': 'tree-admin@test.com', 'password': 'password123'})
+            assert client.post('/categories/', json={'name': 'Beadwork'}).status_code == 201
+
+        response = client.get('/categories/tree', headers={'If-None-Match': etag})
+        assert response.status_code == 200
+        assert [node['name'] for node in json.loads(response.data)] == ['Beadwork', 'Textiles']
+
+class TestResponseCache:
+    """Public GET endpoints are cached and invalidated by tag"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        response_cache.init_app(app, backend=MemoryCache())
+        return app
+
+    @pytest.fixture(scope='class')
+    def product(self, app):
+        artisan = User(full_name='Cache Artisan', email='cache-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        buyer = User(full_name='Cache Buyer', email='cache-buyer@test.com', role='buyer')
+        buyer.set_password('password123')
+        db.session.add_all([artisan, buyer])
+        db.session.flush()
+        product = Product(title='Cached Product', description='desc', price=1, stock=1,
+                          artisan_id=artisan.id)
+        db.session.add(product)
+        db.session.commit()
+        return product
+
+    def test_second_hit_skips_database(self, client, product):
+        assert client.get(f'/products/{product.id}').headers['X-Cache'] == 'MISS'
+        responses = []
+        statements = capture_queries(lambda: responses.append(client.get(f'/products/{product.id}')))
+        assert statements == []
+        assert responses[0].headers['X-Cache'] == 'HIT'
+        assert json.loads(responses[0].data)['id'] == product.id
+
+    def test_query_args_are_part_of_key(self, client, product):
+        client.get('/products/?category=a')
+        assert client.get('/products/?category=b').headers['X-Cache'] == 'MISS'
+        assert client.get('/products/?category=a').headers['X-Cache'] == 'HIT'
+
+    def test_review_write_invalidates(self, app, client, product):
+        client.get(f'/products/{product.id}')
+        client.get(f'/reviews/product/{product.id}')
+        with client:
+            client.post('/auth/login', json={'email': 'cache-buyer@test.com', 'password': 'password123'})
+            client.post('/reviews/', json={'product_id': product.id, 'rating': 3})
+
+        response = client.get(f'/products/{product.id}')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert json.loads(response.data)['review_count'] == 1
+        assert client.get(f'/reviews/product/{product.id}').headers['X-Cache'] == 'MISS'
+
+        with app.test_request_context():
+            stats = response_cache.stats()
+        assert stats['hits'] >= 2 and stats['misses'] >= 4
+
+    def test_memory_backend_ttl_and_lru(self):
+        cache = MemoryCache(max_entries=2)
+        cache.set('a', b'1', ttl=60, tags=['t'])
+        cache.set('b', b'2', ttl=60)
+        cache.get('a')
+        cache.set('c', b'3', ttl=60)
+        assert cache.get('b') is None
+        assert cache.get('a') == b'1'
+
+        cache.invalidate_tags('t')
+        assert cache.get('a') is None
+        assert cache.get('c') == b'3'
+
+        cache.set('expired', b'x', ttl=-1)
+        assert cache.get('expired') is None
+
+    def test_redis_backend_against_fake(self):
+        cache = RedisCache(FakeRedis())
+        cache.set('a', b'1', ttl=60, tags=['products', 'product:1'])
+        cache.set('b', b'2', ttl=60, tags=['product:2'])
+        cache.invalidate_tags('product:1')
+        assert cache.get('a') is None
+        assert cache.get('b') == b'2'
+        cache.clear()
+        assert cache.get('b') is None
+
+class TestProjectionSerializers:
+    """Column-projection list payloads match the models' to_dict output"""
+
+    @pytest.fixture(scope='class')
+    def buyer(self, app):
+        artisan = User(full_name='Projection Artisan', email='projection-artisan@test.com',
+                       role='artisan', location='Kisumu')
+        artisan.set_password('password123')
+        buyer = User(full_name='Projection Buyer', email='projection-buyer@test.com', role='buyer')
+        buyer.set_password('password123')
+        db.session.add_all([artisan, buyer])
+        db.session.flush()
+        products = [Product(title=f'Projected {i}', description='desc', price=12.5, stock=4,
+                            artisan_id=artisan.id, rating_sum=9, rating_count=2) for i in range(3)]
+        db.session.add_all(products)
+        db.session.flush()
+        order = Order(user_id=buyer.id, total_amount=37.5)
+        db.session.add(order)
+        db.session.flush()
+        for product in products:
+            db.session.add(Cart(user_id=buyer.id, product_id=product.id, quantity=2))
+            db.session.add(Favorite(user_id=buyer.id, product_id=product.id))
+            db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1,
+                                     unit_price=12.5, total_price=12.5, artisan_id=artisan.id))
+        db.session.commit()
+        return buyer
+
+    def login(self, client):
+        client.post('/auth/login', json={'email': 'projection-buyer@test.com', 'password': 'password123'})
+
+    def test_cart_favorites_orders_match_to_dict(self, client, buyer):
+        with client:
+            self.login(client)
+            assert json.loads(client.get('/cart/').data) == [
+                item.to_dict() for item in Cart.query.filter_by(user_id=buyer.id).order_by(Cart.id)]
+            assert json.loads(client.get('/favorites/').data) == [
+                fav.to_dict() for fav in Favorite.query.filter_by(user_id=buyer.id).order_by(Favorite.id)]
+            assert json.loads(client.get('/orders/').data) == [
+                order.to_dict() for order in Order.query.filter_by(user_id=buyer.id)]
+            order = Order.query.filter_by(user_id=buyer.id).first()
+            assert json.loads(client.get(f'/orders/{order.id}').data) == order.to_dict()
+
+    def test_order_items_loaded_in_one_query(self, client, buyer):
+        with client:
+            self.login(client)
+            statements = capture_queries(lambda: client.get('/orders/'))
+        assert len([s for s in statements if 'order_items' in s]) == 1
+
+    def test_stdlib_fallback(self, monkeypatch):
+        payload = {'id': 1, 'title': 'Kiondo', 'price': 12.5, 'tags': [None, True]}
+        fast = serializers.dumps(payload)
+        monkeypatch.setattr(serializers, 'orjson', None)
+        assert json.loads(serializers.dumps(payload)) == json.loads(fast)
+
+class TestSparseFieldsets:
+    """?fields= narrows payloads and the SELECT behind them"""
+
+    @pytest.fixture(scope='class')
+    def product(self, app):
+        admin = User(full_name='Fields Admin', email='fields-admin@test.com', role='admin')
+        admin.set_password('password123')
+        artisan = User(full_name='Fields Artisan', email='fields-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        db.session.add_all([admin, artisan])
+        db.session.flush()
+        product = Product(title='Sparse Product', description='long text ' * 50, price=7, stock=2,
+                          image='/img.jpg', artisan_id=artisan.id, rating_sum=8, rating_count=2)
+        db.session.add(product)
+        db.session.flush()
+        db.session.add(Favorite(user_id=admin.id, product_id=product.id))
+        db.session.commit()
+        return product
+
+    def test_grid_fields_only(self, client, product):
+        responses = []
+        statements = capture_queries(lambda: responses.append(
+            client.get('/products/?fields=id,title,price,image,rating')))
+        assert json.loads(responses[0].data) == [
+            {'id': product.id, 'title': 'Sparse Product', 'price': 7.0, 'image': '/img.jpg', 'rating': 4.0}]
+        select = [s for s in statements if 'FROM products' in s][0]
+        assert 'description' not in select
+        assert 'users' not in select
+
+    def test_artisan_fields_join_users(self, client, product):
+        data = json.loads(client.get(f'/artisan/{product.artisan_id}/products?fields=title,artisan_name').data)
+        assert data == [{'title': 'Sparse Product', 'artisan_name': 'Fields Artisan'}]
+
+    def test_unknown_field_rejected(self, client, product):
+        response = client.get('/products/?fields=id,password_hash')
+        assert response.status_code == 400
+        assert 'password_hash' in json.loads(response.data)['error']
+
+    def test_favorites_and_users(self, client, product):
+        with client:
+            client.post('/auth/login', json={'email': 'fields-admin@test.com', 'password': 'password123'})
+            favorites = json.loads(client.get('/favorites/?fields=id,title').data)
+            assert favorites[0]['product'] == {'id': product.id, 'title': 'Sparse Product'}
+
+            users = json.loads(client.get('/users/?fields=id,email').data)
+            assert users == [{'id': u.id, 'email': u.email} for u in User.query.order_by(User.id)]
+
+            user = User.query.filter_by(email='fields-artisan@test.com').first()
+            assert json.loads(client.get(f'/users/{user.id}').data) == user.to_dict()
+            assert client.get('/users/?fields=password_hash').status_code == 400
+
+class TestCurrentUserMemo:
+    """The logged-in user is looked up at most once per request"""
+
+    @pytest.fixture(scope='class')
+    def users(self, app):
+        admin = User(full_name='Memo Admin', email='memo-admin@test.com', role='admin')
+        admin.set_password('password123')
+        artisan = User(full_name='Memo Artisan', email='memo-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        db.session.add_all([admin, artisan])
+        db.session.flush()
+        product = Product(title='Memo Product', description='desc', price=5, stock=3, artisan_id=artisan.id)
+        db.session.add(product)
+        db.session.flush()
+        order = Order(user_id=artisan.id, total_amount=5)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1,
+                                 unit_price=5, total_price=5, artisan_id=artisan.id))
+        db.session.commit()
+        return {'admin': admin.id, 'artisan': artisan.id, 'order': order.id}
+
+    def login(self, app, email):
+        client = app.test_client()
+        client.post('/auth/login', json={'email': email, 'password': 'password123'})
+        return client
+
+    def user_lookups(self, fn, user_id):
+        """Primary-key SELECTs of user_id issued while running fn"""
+        lookups = []
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            if statement.rstrip().endswith('FROM users \nWHERE users.id = ?') and tuple(parameters) == (user_id,):
+                lookups.append(statement)
+
+        # Start from an empty identity map, as a fresh request session would
+        db.session.expunge_all()
+        event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+        try:
+            fn()
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+        return lookups
+
+    def test_one_lookup_per_request(self, app, users):
+        app.config['IDENTITY_CACHE_TTL'] = 0
+        admin = self.login(app, 'memo-admin@test.com')
+        admin_id = users['admin']
+        assert len(self.user_lookups(lambda: admin.get('/auth/profile'), admin_id)) == 1
+        assert len(self.user_lookups(lambda: admin.get(f"/users/{users['artisan']}"), admin_id)) == 1
+        assert len(self.user_lookups(lambda: admin.post(
+            '/categories/', json={'name': 'Memo Category'}), admin_id)) == 1
+
+    def test_identity_cache_skips_lookup(self, app, users):
+        app.config['IDENTITY_CACHE_TTL'] = 60
+        artisan = self.login(app, 'memo-artisan@test.com')
+        responses = []
+        lookups = self.user_lookups(lambda: responses.append(artisan.get('/artisan/orders')),
+                                    users['artisan'])
+        assert responses[0].status_code == 200
+        assert lookups == []
+
+        admin = self.login(app, 'memo-admin@test.com')
+        assert self.user_lookups(lambda: admin.put(
+            f"/orders/{users['order']}/status", json={'status': 'shipped'}), users['admin']) == []
+
+        # Demoting the artisan drops their cached identity immediately
+        assert admin.put(f"/users/{users['artisan']}", json={'role': 'buyer'}).status_code == 200
+        assert artisan.get('/artisan/orders').status_code == 403
+
+class TestSessionStores:
+    """Server-side session backends keep only an id in the cookie"""
+
+    @pytest.fixture(scope='class', params=['sqlalchemy', 'fakeredis'])
+    def app(self, request):
+        with isolated_app(SESSION_TYPE=request.param) as app:
+            init_sessions(app)
+            user = User(full_name='Session User', email='session@test.com', role='buyer')
+            user.set_password('password123')
+            db.session.add(user)
+            db.session.commit()
+            yield app
+
+    def session_writes(self, fn):
+        return [s for s in capture_queries(fn) if s.startswith(('INSERT INTO sessions', 'UPDATE sessions'))]
+
+    def test_login_read_logout(self, app):
+        client = app.test_client()
+        with client:
+            client.post('/auth/login', json={'email': 'session@test.com', 'password': 'password123'})
+            sid = client.get_cookie('soko_session').value
+            assert len(sid) >= 43 and '.' not in sid  # an opaque id, not signed session data
+
+            store = app.session_interface.store
+            assert store.load(sid) is not None
+
+            responses = []
+            writes = self.session_writes(lambda: responses.append(client.get('/auth/session')))
+            assert json.loads(responses[0].data)['authenticated'] is True
+            assert writes == []  # unchanged sessions are not written back
+
+            client.post('/auth/logout')
+            assert store.load(sid) is None
+            assert json.loads(client.get('/auth/session').data)['authenticated'] is False
+
+    def test_unknown_session_id_starts_fresh(self, app):
+        client = app.test_client()
+        client.set_cookie('soko_session', 'forged-id')
+        assert json.loads(client.get('/auth/session').data)['authenticated'] is False
+
+    def test_sql_cleanup_in_batches(self, app):
+        if app.config['SESSION_TYPE'] != 'sqlalchemy':
+            pytest.skip('Redis expires keys itself')
+        past = datetime.utcnow() - timedelta(minutes=1)
+        db.session.add_all([StoredSession(id=f'expired-{i}', data='{}', expires_at=past) for i in range(25)])
+        db.session.add(StoredSession(id='live', data='{}', expires_at=datetime.utcnow() + timedelta(days=1)))
+        db.session.commit()
+
+        assert SqlSessionStore(cleanup_batch_size=10).cleanup() == 25
+        assert [row.id for row in StoredSession.query.filter(StoredSession.id.in_(['live', 'expired-3']))] == ['live']
+
+class TestPasswordHashing:
+    """Pooled bcrypt, login load shedding and rehash-on-login"""
+
+    def test_process_pool_round_trip(self):
+        hasher = PasswordHasher(rounds=4, pool_size=1)
+        try:
+            hashed = hasher.hash('kikapu-2024')
+            assert hash_cost(hashed) == 4
+            assert hasher.verify(hashed, 'kikapu-2024')
+            assert not hasher.verify(hashed, 'wrong')
+        finally:
+            hasher.shutdown()
+
+    def test_broken_pool_is_replaced(self):
+        hasher = PasswordHasher(rounds=4, pool_size=1)
+        try:
+            hashed = hasher.hash('kikapu-2024')
+            pool = hasher._pool
+            for process in list(pool._processes.values()):
+                process.kill()
+                process.join()
+            assert hasher.verify(hashed, 'kikapu-2024')
+            assert hasher._pool is not pool
+        finally:
+            hasher.shutdown()
+
+    def test_rehash_on_login(self, app, client):
+        legacy = PasswordHasher(rounds=5)
+        user = User(full_name='Legacy Hash', email='legacy@test.com', role='buyer',
+                    password_hash=legacy.hash('password123'))
+        db.session.add(user)
+        db.session.commit()
+
+        assert client.post('/auth/login', json={'email': 'legacy@test.com', 'password': 'wrong'}).status_code == 401
+        assert hash_cost(db.session.get(User, user.id).password_hash) == 5
+
+        assert client.post('/auth/login', json={'email': 'legacy@test.com', 'password': 'password123'}).status_code == 200
+        db.session.expire_all()
+        upgraded = db.session.get(User, user.id).password_hash
+        assert hash_cost(upgraded) == app.config['BCRYPT_LOG_ROUNDS']
+        assert client.post('/auth/login', json={'email': 'legacy@test.com', 'password': 'password123'}).status_code == 200
+
+    def test_login_limit_fits_the_worker_threads(self):
+        assert login_concurrency({'WORKER_THREADS': 4, 'BCRYPT_POOL_SIZE': 2}) == 2
+        assert login_concurrency({'WORKER_THREADS': 4, 'BCRYPT_POOL_SIZE': 8}) == 3
+        assert login_concurrency({'WORKER_THREADS': 4, 'BCRYPT_POOL_SIZE': 0}) == 3
+        assert login_concurrency({'WORKER_THREADS': 4, 'LOGIN_MAX_CONCURRENCY': 8}) == 3
+        assert login_concurrency({'WORKER_THREADS': 1, 'BCRYPT_POOL_SIZE': 2}) == 1
+
+    def test_saturated_worker_sheds_logins(self, app, client):
+        # Two threads per worker leave room for one login at a time
+        app.config['WORKER_THREADS'] = 2
+        password_hasher.init_app(app)
+        slots = app.extensions['login_slots']
+        try:
+            slots.acquire()
+            response = client.post('/auth/login', json={'email': 'legacy@test.com', 'password': 'password123'})
+            assert response.status_code == 429
+            assert response.headers['Retry-After'] == '1'
+            slots.release()
+            response = client.post('/auth/login', json={'email': 'legacy@test.com', 'password': 'password123'})
+            assert response.status_code == 200
+        finally:
+            app.config['WORKER_THREADS'] = 4
+            password_hasher.init_app(app)
+
+class TestTokenAuth:
+    """Bearer access tokens, refresh rotation and revocation"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        app.config['AUTH_MODE'] = 'jwt'
+        for email, role in (('jwt-admin@test.com', 'admin'), ('jwt-artisan@test.com', 'artisan')):
+            user = User(full_name=email, email=email, role=role)
+            user.set_password('password123')
+            db.session.add(user)
+        db.session.commit()
+        return app
+
+    def login(self, client, email):
+        data = json.loads(client.post('/auth/login', json={'email': email, 'password': 'password123'}).data)
+        return data
+
+    def bearer(self, token):
+        return {'Authorization': f'Bearer {token}'}
+
+    def test_login_issues_tokens_instead_of_session(self, client):
+        response = client.post('/auth/login', json={'email': 'jwt-admin@test.com', 'password': 'password123'})
+        data = json.loads(response.data)
+        assert data['token_type'] == 'Bearer' and data['access_token'] and data['refresh_token']
+        assert client.get_cookie('soko_session') is None
+        assert client.get('/auth/profile').status_code == 401
+
+    def test_role_checks_use_claims_only(self, client):
+        tokens = self.login(client, 'jwt-admin@test.com')
+        responses = []
+        statements = capture_queries(lambda: responses.append(client.post(
+            '/categories/', json={'name': 'Token Category'}, headers=self.bearer(tokens['access_token']))))
+        assert responses[0].status_code == 201
+        assert not [s for s in statements if 'FROM users' in s]
+
+        artisan = self.login(client, 'jwt-artisan@test.com')
+        response = client.post('/categories/', json={'name': 'Nope'}, headers=self.bearer(artisan['access_token']))
+        assert response.status_code == 403
+
+    def test_invalid_tokens_rejected(self, app, client):
+        tokens = self.login(client, 'jwt-admin@test.com')
+        header, payload, signature = tokens['access_token'].split('.')
+        forged = f"{header}.{payload}.{signature[:-2]}AA"
+        assert client.get('/auth/profile', headers=self.bearer(forged)).status_code == 401
+        assert client.get('/auth/profile', headers=self.bearer(tokens['refresh_token'])).status_code == 401
+
+        other_key = TokenSigner('another-secret').encode(json.loads(
+            base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))))
+        assert client.get('/auth/profile', headers=self.bearer(other_key)).status_code == 401
+
+        # Crafted headers and payloads are rejected as malformed, not a server error
+        list_kid = base64.urlsafe_b64encode(b'{"alg":"HS256","kid":["x"]}').rstrip(b'=').decode('ascii')
+        assert client.get('/auth/profile', headers=self.bearer(f'{list_kid}.{payload}.{signature}')).status_code == 401
+        assert client.get('/auth/profile', headers=self.bearer(f'{header}.{payload}\u00e9.{signature}')
+                          ).status_code == 401
+
+    def test_refresh_rotation_and_reuse_detection(self, client):
+        tokens = self.login(client, 'jwt-artisan@test.com')
+        rotated = json.loads(client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']}).data)
+        assert rotated['refresh_token'] != tokens['refresh_token']
+        assert client.get('/auth/profile', headers=self.bearer(rotated['access_token'])).status_code == 200
+
+        # Replaying the spent refresh token revokes everything the user holds
+        replay = client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+        assert replay.status_code == 401
+        assert client.get('/auth/profile', headers=self.bearer(rotated['access_token'])).status_code == 401
+        assert client.post('/auth/refresh', json={'refresh_token': rotated['refresh_token']}).status_code == 401
+
+        # Logging in again afterwards works
+        fresh = self.login(client, 'jwt-artisan@test.com')
+        assert client.get('/auth/profile', headers=self.bearer(fresh['access_token'])).status_code == 200
+
+    def test_logout_and_role_change_revoke(self, app, client):
+        tokens = self.login(client, 'jwt-artisan@test.com')
+        client.post('/auth/logout', json={'refresh_token': tokens['refresh_token']},
+                    headers=self.bearer(tokens['access_token']))
+        assert client.get('/auth/profile', headers=self.bearer(tokens['access_token'])).status_code == 401
+        assert client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']}).status_code == 401
+
+        artisan = self.login(client, 'jwt-artisan@test.com')
+        admin = self.login(client, 'jwt-admin@test.com')
+        artisan_id = artisan['user']['id']
+        assert client.put(f'/users/{artisan_id}', json={'role': 'buyer'},
+                          headers=self.bearer(admin['access_token'])).status_code == 200
+        assert client.get('/auth/profile', headers=self.bearer(artisan['access_token'])).status_code == 401
+
+    def test_revocations_reach_other_workers(self, app):
+        signer = app.extensions['token_signer']
+        claims = signer.decode(json.loads(app.test_client().post(
+            '/auth/login', json={'email': 'jwt-admin@test.com', 'password': 'password123'}).data)['access_token'],
+            'access')
+        worker_a, worker_b = RevocationList(sync_interval=0), RevocationList(sync_interval=0)
+        assert not worker_b.is_revoked(claims)
+        worker_a.revoke(claims['jti'], claims['exp'])
+        db.session.commit()
+        assert worker_b.is_revoked(claims)
+
+    def test_reuse_caught_by_a_worker_that_has_not_synced(self, app, client):
+        tokens = self.login(client, 'jwt-artisan@test.com')
+        stale = RevocationList(sync_interval=3600)
+        stale.sync()
+        rotated = json.loads(client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']}).data)
+
+        # Replayed on another worker, whose revocation list predates the rotation
+        worker = app.extensions['token_revocations']
+        app.extensions['token_revocations'] = stale
+        try:
+            replay = client.post('/auth/refresh', json={'refresh_token': tokens['refresh_token']})
+            assert replay.status_code == 401
+        finally:
+            app.extensions['token_revocations'] = worker
+        # The family was revoked in the database, so no worker rotates the newer token either
+        assert client.post('/auth/refresh', json={'refresh_token': rotated['refresh_token']}).status_code == 401
+        assert RevokedToken.query.filter_by(jti=None).count() >= 1
+
+    def test_revoking_twice_keeps_one_row(self, client):
+        tokens = self.login(client, 'jwt-admin@test.com')
+        for _ in range(2):
+            revoke_token(tokens['refresh_token'], 'refresh')
+            db.session.commit()
+        jti = client.application.extensions['token_signer'].decode(tokens['refresh_token'], 'refresh')['jti']
+        assert RevokedToken.query.filter_by(jti=jti).count() == 1
+
+class TestCheckout:
+    """Orders are placed atomically from the cart"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        artisan = User(full_name='Checkout Artisan', email='checkout-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        buyer = User(full_name='Checkout Buyer', email='checkout-buyer@test.com', role='buyer')
+        buyer.set_password('password123')
+        db.session.add_all([artisan, buyer])
+        db.session.flush()
+        db.session.add_all([
+            Product(title='Kiondo', description='d', price=10, stock=5, artisan_id=artisan.id),
+            Product(title='Shuka', description='d', price=4, stock=1, artisan_id=artisan.id),
+        ])
+        db.session.commit()
+        return app
+
+    @pytest.fixture(scope='class')
+    def client(self, app):
+        client = app.test_client()
+        client.post('/auth/login', json={'email': 'checkout-buyer@test.com', 'password': 'password123'})
+        return client
+
+    def fill_cart(self, quantities):
+        buyer = User.query.filter_by(email='checkout-buyer@test.com').first()
+        for title, quantity in quantities.items():
+            product = Product.query.filter_by(title=title).first()
+            db.session.add(Cart(user_id=buyer.id, product_id=product.id, quantity=quantity))
+        db.session.commit()
+
+    def test_order_in_bulk_statements(self, client):
+        self.fill_cart({'Kiondo': 2, 'Shuka': 1})
+        responses = []
+        statements = capture_queries(lambda: responses.append(client.post('/orders/', json={})))
+        assert responses[0].status_code == 201
+        order = json.loads(responses[0].data)['order']
+        assert order['total_amount'] == 24.0
+        assert sorted(item['quantity'] for item in order['items']) == [1, 2]
+
+        assert len([s for s in statements if s.startswith('UPDATE products')]) == 1
+        assert len([s for s in statements if s.startswith('INSERT INTO order_items')]) == 1
+        db.session.expire_all()
+        assert {p.title: p.stock for p in Product.query} == {'Kiondo': 3, 'Shuka': 0}
+        assert Cart.query.count() == 0
+
+    def test_short_stock_rolls_back(self, client):
+        self.fill_cart({'Kiondo': 1, 'Shuka': 1})
+        response = client.post('/orders/', json={})
+        assert response.status_code == 400
+        assert json.loads(response.data)['error'] == 'Insufficient stock for Shuka'
+        db.session.expire_all()
+        assert Product.query.filter_by(title='Kiondo').first().stock == 3
+        assert Cart.query.count() == 2
+        Cart.query.delete()
+        db.session.commit()
+
+        assert json.loads(client.post('/orders/', json={}).data)['error'] == 'Cart is empty'
+
+    def test_no_oversell_under_concurrency(self):
+        buyers, stock = 12, 5
+        database = os.path.join(tempfile.mkdtemp(prefix='soko-checkout-'), 'checkout.db')
+        os.environ['DATABASE_URL'] = f'sqlite:///{database}'
+        try:
+            app = create_app('testing')
+        finally:
+            del os.environ['DATABASE_URL']
+
+        with app.app_context():
+            db.create_all()
+            artisan = User(full_name='Flash Artisan', email='flash-artisan@test.com', role='artisan')
+            artisan.set_password('password123')
+            db.session.add(artisan)
+            db.session.flush()
+            product = Product(title='Flash Sale', description='d', price=1, stock=stock, artisan_id=artisan.id)
+            db.session.add(product)
+            db.session.flush()
+            for i in range(buyers):
+                buyer = User(full_name=f'Flash Buyer {i}', email=f'flash-{i}@test.com', role='buyer')
+                buyer.set_password('password123')
+                db.session.add(buyer)
+                db.session.flush()
+                db.session.add(Cart(user_id=buyer.id, product_id=product.id, quantity=1))
+            db.session.commit()
+            product_id = product.id
+
+        clients = []
+        for i in range(buyers):
+            client = app.test_client()
+            client.post('/auth/login', json={'email': f'flash-{i}@test.com', 'password': 'password123'})
+            clients.append(client)
+
+        statuses = []
+        start = threading.Barrier(buyers)
+
+        def checkout(client):
+            start.wait()
+            statuses.append(client.post('/orders/', json={}).status_code)
+
+        threads = [threading.Thread(target=checkout, args=(client,)) for client in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        with app.app_context():
+            sold = db.session.query(db.func.coalesce(db.func.sum(OrderItem.quantity), 0)).filter_by(
+                product_id=product_id).scalar()
+            remaining = db.session.get(Product, product_id).stock
+        assert statuses.count(201) == stock
+        assert statuses.count(400) == buyers - stock
+        assert sold == stock
+        assert remaining == 0
+
+class TestReservations:
+    """Cart lines hold stock; Product.reserved tracks the holds"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        artisan = User(full_name='Hold Artisan', email='hold-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        db.session.add(artisan)
+        for name in ('alice', 'bob'):
+            buyer = User(full_name=name, email=f'hold-{name}@test.com', role='buyer')
+            buyer.set_password('password123')
+            db.session.add(buyer)
+        db.session.flush()
+        db.session.add(Product(title='Limited Print', description='d', price=50, stock=3, artisan_id=artisan.id))
+        db.session.commit()
+        return app
+
+    @pytest.fixture(scope='class')
+    def clients(self, app):
+        clients = {}
+        for name in ('alice', 'bob'):
+            clients[name] = app.test_client()
+            clients[name].post('/auth/login', json={'email': f'hold-{name}@test.com', 'password': 'password123'})
+        return clients
+
+    @pytest.fixture(scope='class')
+    def product_id(self, app):
+        return Product.query.filter_by(title='Limited Print').first().id
+
+    def available(self, client, product_id):
+        return json.loads(client.get(f'/products/{product_id}').data)['available']
+
+    def assert_counter_matches_holds(self, product_id):
+        db.session.expire_all()
+        held = db.session.query(db.func.coalesce(db.func.sum(Reservation.quantity), 0)).filter_by(
+            product_id=product_id).scalar()
+        assert db.session.get(Product, product_id).reserved == held
+
+    def test_cart_lines_hold_stock(self, clients, product_id):
+        alice, bob = clients['alice'], clients['bob']
+        assert alice.post('/cart/', json={'product_id': product_id, 'quantity': 2}).status_code == 201
+        assert self.available(alice, product_id) == 1
+        assert bob.post('/cart/', json={'product_id': product_id, 'quantity': 2}).status_code == 400
+        assert bob.post('/cart/', json={'product_id': product_id, 'quantity': 1}).status_code == 201
+        assert self.available(bob, product_id) == 0
+
+        item_id = json.loads(alice.get('/cart/').data)[0]['id']
+        response = alice.put(f'/cart/{item_id}', json={'quantity': '2'})
+        assert response.status_code == 200
+        assert json.loads(response.data)['item']['quantity'] == 2
+        assert alice.put(f'/cart/{item_id}', json={'quantity': 1}).status_code == 200
+        assert self.available(alice, product_id) == 1
+        assert alice.delete(f'/cart/{item_id}').status_code == 200
+        assert self.available(alice, product_id) == 2
+        self.assert_counter_matches_holds(product_id)
+
+    def test_expired_holds_are_reclaimed(self, clients, product_id):
+        alice, bob = clients['alice'], clients['bob']
+        # Bob holds 1; let it lapse, then Alice can take all 3
+        Reservation.query.update({'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+        db.session.commit()
+        assert alice.post('/cart/', json={'product_id': product_id, 'quantity': 3}).status_code == 201
+        assert self.available(alice, product_id) == 0
+        self.assert_counter_matches_holds(product_id)
+
+        # Bob's checkout start can no longer hold his line
+        response = bob.post('/orders/checkout')
+        assert response.status_code == 409
+        assert json.loads(response.data)['unavailable_product_ids'] == [product_id]
+
+    def test_checkout_consumes_holds(self, clients, product_id):
+        alice = clients['alice']
+        assert alice.post('/orders/checkout').status_code == 200
+        assert alice.post('/orders/', json={}).status_code == 201
+        db.session.expire_all()
+        product = db.session.get(Product, product_id)
+        assert (product.stock, product.reserved) == (0, 0)
+        assert Reservation.query.filter_by(product_id=product_id).count() == 0
+
+    def test_batched_sweep(self, app, product_id):
+        product = db.session.get(Product, product_id)
+        product.stock = 10
+        users = User.query.all()
+        past = datetime.utcnow() - timedelta(seconds=1)
+        for user in users:
+            db.session.add(Reservation(user_id=user.id, product_id=product_id, quantity=2, expires_at=past))
+        product.reserved = 2 * len(users)
+        db.session.commit()
+
+        assert sweep_expired(batch_size=2) == len(users)
+        self.assert_counter_matches_holds(product_id)
+        assert db.session.get(Product, product_id).reserved == 0
+
+    def test_holds_lock_products_first(self, product_id):
+        # Checkout locks product rows before holds; so must every hold change
+        user_id = User.query.filter_by(email='hold-alice@test.com').first().id
+        for change in (lambda: reserve(user_id, product_id, 1), lambda: release(user_id, product_id)):
+            statements = capture_queries(change)
+            first_hold = next(i for i, s in enumerate(statements) if s.startswith('SELECT inventory_reservations'))
+            assert any(s.startswith('SELECT products.id') for s in statements[:first_hold])
+        db.session.rollback()
+
+    def test_checkout_reclaims_expired_holds(self, clients, product_id):
+        alice, bob = clients['alice'], clients['bob']
+        product = db.session.get(Product, product_id)
+        product.stock = 3
+        Cart.query.delete()
+        db.session.commit()
+
+        # Bob's add-to-cart reclaims Alice's lapsed hold, then his lapses too
+        assert alice.post('/cart/', json={'product_id': product_id, 'quantity': 3}).status_code == 201
+        Reservation.query.update({'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+        db.session.commit()
+        assert bob.post('/cart/', json={'product_id': product_id, 'quantity': 3}).status_code == 201
+        Reservation.query.update({'expires_at': datetime.utcnow() - timedelta(minutes=1)})
+        db.session.commit()
+        self.assert_counter_matches_holds(product_id)
+
+        # Alice no longer holds anything, but Bob's expired hold doesn't block her order
+        assert alice.post('/orders/', json={}).status_code == 201
+        self.assert_counter_matches_holds(product_id)
+        product = db.session.get(Product, product_id)
+        assert (product.stock, product.reserved) == (0, 0)
+
+class TestBulkCart:
+    """PUT /cart/bulk and guest-cart merge at login share one bulk path"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        artisan = User(full_name='Bulk Artisan', email='bulk-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        buyer = User(full_name='Bulk Buyer', email='bulk-buyer@test.com', role='buyer')
+        buyer.set_password('password123')
+        db.session.add_all([artisan, buyer])
+        db.session.flush()
+        for index in range(5):
+            db.session.add(Product(title=f'Bulk Item {index}', description='d', price=10 + index,
+                                   stock=4, artisan_id=artisan.id))
+        db.session.commit()
+        return app
+
+    @pytest.fixture(scope='class')
+    def client(self, app):
+        client = app.test_client()
+        client.post('/auth/login', json={'email': 'bulk-buyer@test.com', 'password': 'password123'})
+        return client
+
+    @pytest.fixture(scope='class')
+    def product_ids(self, app):
+        return [product.id for product in Product.query.order_by(Product.id)]
+
+    def assert_holds_match_cart(self):
+        db.session.expire_all()
+        cart = {line.product_id: line.quantity for line in Cart.query.all()}
+        held = {hold.product_id: hold.quantity for hold in Reservation.query.all()}
+        assert cart == held
+        for product in Product.query.all():
+            assert product.reserved == held.get(product.id, 0)
+
+    def test_bulk_sets_lines_in_one_upsert(self, client, product_ids):
+        items = [{'product_id': product_id, 'quantity': 2} for product_id in product_ids]
+        statements = capture_queries(lambda: client.put('/cart/bulk', json=items))
+        assert sum('ON CONFLICT' in statement for statement in statements) == 2  # cart + holds
+        assert sum(statement.startswith('SELECT') and 'FROM products' in statement
+                   for statement in statements) <= 3
+
+        response = client.put('/cart/bulk', json={'items': [
+            {'product_id': product_ids[0], 'quantity': 3},
+            {'product_id': product_ids[1], 'quantity': 0},
+        ]})
+        assert response.status_code == 200
+        cart = {line['product_id']: line['quantity'] for line in json.loads(response.data)}
+        assert cart == {product_ids[0]: 3, **{product_id: 2 for product_id in product_ids[2:]}}
+        self.assert_holds_match_cart()
+
+    def test_bulk_is_all_or_nothing(self, client, product_ids):
+        before = json.loads(client.get('/cart/').data)
+        response = client.put('/cart/bulk', json=[
+            {'product_id': product_ids[2], 'quantity': 1},
+            {'product_id': product_ids[3], 'quantity': 5},
+        ])
+        assert response.status_code == 400
+        assert json.loads(response.data)['product_ids'] == [product_ids[3]]
+
+        response = client.put('/cart/bulk', json=[{'product_id': 999999, 'quantity': 1}])
+        assert response.status_code == 404
+        assert client.put('/cart/bulk', json=[{'product_id': product_ids[2]}, {'product_id': product_ids[2]}]
+                          ).status_code == 400
+        assert client.put('/cart/bulk', json={'items': []}).status_code == 400
+        assert client.put('/cart/bulk', json=[{'product_id': product_ids[2], 'quantity': -1}]).status_code == 400
+
+        assert json.loads(client.get('/cart/').data) == before
+        self.assert_holds_match_cart()
+
+    def test_login_merges_guest_cart(self, app, product_ids):
+        guest = app.test_client()
+        response = guest.post('/auth/login', json={
+            'email': 'bulk-buyer@test.com', 'password': 'password123',
+            'cart': [{'product_id': product_ids[0], 'quantity': 1},
+                     {'product_id': product_ids[1], 'quantity': 2}]})
+        assert response.status_code == 200
+        cart = {line['product_id']: line['quantity'] for line in json.loads(response.data)['cart']}
+        assert cart[product_ids[0]] == 4 and cart[product_ids[1]] == 2
+        self.assert_holds_match_cart()
+
+        # A merge that can't be held doesn't block signing in
+        response = guest.post('/auth/login', json={
+            'email': 'bulk-buyer@test.com', 'password': 'password123',
+            'cart': [{'product_id': product_ids[0], 'quantity': 1}]})
+        assert response.status_code == 200
+        assert 'Insufficient stock' in json.loads(response.data)['cart_merge_error']
+        self.assert_holds_match_cart()
+
+
+class TestCartSummary:
+    """GET /cart/summary is one aggregate query, cached until the cart changes"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        response_cache.init_app(app, backend=MemoryCache())
+        artisan = User(full_name='Summary Artisan', email='summary-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        buyer = User(full_name='Summary Buyer', email='summary-buyer@test.com', role='buyer')
+        buyer.set_password('password123')
+        db.session.add_all([artisan, buyer])
+        db.session.flush()
+        db.session.add_all([
+            Product(title='Summary Mug', description='d', price=150, stock=10, artisan_id=artisan.id),
+            Product(title='Summary Bowl', description='d', price=300, stock=10, artisan_id=artisan.id),
+        ])
+        db.session.commit()
+        return app
+
+    @pytest.fixture(scope='class')
+    def client(self, app):
+        client = app.test_client()
+        client.post('/auth/login', json={'email': 'summary-buyer@test.com', 'password': 'password123'})
+        return client
+
+    @pytest.fixture(scope='class')
+    def product_ids(self, app):
+        return [product.id for product in Product.query.order_by(Product.id)]
+
+    def summary(self, client):
+        response = client.get('/cart/summary')
+        assert response.status_code == 200
+        return json.loads(response.data)
+
+    def test_summary_is_cached_until_cart_changes(self, client, product_ids):
+        assert self.summary(client) == {'item_count': 0, 'line_count': 0, 'subtotal': 0, 'currency': None}
+
+        client.put('/cart/bulk', json=[{'product_id': product_ids[0], 'quantity': 2},
+                                       {'product_id': product_ids[1], 'quantity': 1}])
+        statements = capture_queries(lambda: self.summary(client))
+        assert sum('FROM cart' in statement for statement in statements) == 1
+        assert self.summary(client) == {'item_count': 3, 'line_count': 2, 'subtotal': 600.0, 'currency': 'KSH'}
+
+        statements = capture_queries(lambda: self.summary(client))
+        assert not any('FROM cart' in statement for statement in statements)
+
+        client.post('/cart/', json={'product_id': product_ids[1], 'quantity': 1})
+        assert self.summary(client)['subtotal'] == 900.0
+
+    def test_per_worker_cache_keeps_summaries_briefly(self, app, client, product_ids):
+        # Another worker's invalidation can't reach this cache, so it must expire soon
+        self.summary(client)
+        user_id = User.query.filter_by(email='summary-buyer@test.com').first().id
+        expires_at = response_cache.backend._entries[f'cart-summary:{user_id}'][0]
+        assert expires_at - time.monotonic() <= app.config['CART_SUMMARY_LOCAL_TTL']
+
+    def test_price_change_and_order_invalidate(self, app, client, product_ids):
+        artisan = app.test_client()
+        artisan.post('/auth/login', json={'email': 'summary-artisan@test.com', 'password': 'password123'})
+        assert artisan.put(f'/products/{product_ids[0]}', json={'price': 100}).status_code == 200
+        assert self.summary(client)['subtotal'] == 800.0
+
+        assert client.post('/orders/').status_code == 201
+        assert self.summary(client)['item_count'] == 0
+
+    def test_holds_invalidate_cached_products(self, client, product_ids):
+        available = lambda: json.loads(client.get(f'/products/{product_ids[1]}').data)['available']
+        before = available()
+        client.post('/cart/', json={'product_id': product_ids[1], 'quantity': 1})
+        assert available() == before - 1
+
+
+class TestOrderExport:
+    """Artisan order history pages by cursor; /orders/export streams item rows"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        app.config['ORDER_EXPORT_BATCH_SIZE'] = 10
+        artisan = User(full_name='Export Artisan', email='export-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        other = User(full_name='Other Artisan', email='export-other@test.com', role='artisan')
+        other.set_password('password123')
+        buyer = User(full_name='Export Buyer', email='export-buyer@test.com', role='buyer')
+        buyer.set_password('password123')
+        db.session.add_all([artisan, other, buyer])
+        db.session.flush()
+        mine = Product(title='Export Basket', description='d', price=20, stock=100, artisan_id=artisan.id)
+        theirs = Product(title='Other Basket', description='d', price=5, stock=100, artisan_id=other.id)
+        db.session.add_all([mine, theirs])
+        db.session.flush()
+        start = datetime(2024, 1, 1)
+        for index in range(25):
+            order = Order(user_id=buyer.id, total_amount=25, created_at=start + timedelta(hours=index))
+            db.session.add(order)
+            db.session.flush()
+            db.session.add_all([
+                OrderItem(order_id=order.id, product_id=mine.id, quantity=1, unit_price=20,
+                          total_price=20, artisan_id=artisan.id),
+                OrderItem(order_id=order.id, product_id=theirs.id, quantity=1, unit_price=5,
+                          total_price=5, artisan_id=other.id),
+            ])
+        db.session.commit()
+        return app
+
+    def login(self, app, name):
+        client = app.test_client()
+        client.post('/auth/login', json={'email': f'export-{name}@test.com', 'password': 'password123'})
+        return client
+
+    def test_artisan_orders_page_by_cursor(self, app):
+        artisan = self.login(app, 'artisan')
+        seen = []
+        cursor = None
+        while True:
+            url = '/artisan/orders?per_page=10' + (f'&cursor={cursor}' if cursor else '')
+            statements = capture_queries(lambda: seen.append(artisan.get(url)))
+            assert len([s for s in statements if 'order_items' in s]) == 2  # page + its items
+            cursor = seen[-1].headers.get('X-Next-Cursor')
+            if not cursor:
+                break
+        orders = [order for response in seen for order in json.loads(response.data)]
+        assert len(seen) == 3 and len(orders) == 25
+        assert len({order['id'] for order in orders}) == 25
+        assert all(len(order['items']) == 2 for order in orders)
+
+    def test_csv_export_streams_artisan_sales(self, app):
+        artisan = self.login(app, 'artisan')
+        response = artisan.get('/orders/export')
+        assert response.status_code == 200
+        assert response.mimetype == 'text/csv'
+        assert response.is_streamed
+        chunks = list(response.response)
+        assert len(chunks) == 3  # 25 rows in batches of 10
+
+        rows = list(csv.DictReader(io.StringIO(b''.join(chunks).decode('utf-8'))))
+        assert len(rows) == 25
+        assert {row['product_title'] for row in rows} == {'Export Basket'}
+        assert rows[0]['order_created_at'] > rows[-1]['order_created_at']
+
+    def test_ndjson_export_of_purchases(self, app):
+        buyer = self.login(app, 'buyer')
+        response = buyer.get('/orders/export?format=ndjson')
+        assert response.mimetype == 'application/x-ndjson'
+        lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+        assert len(lines) == 50
+        assert lines[0]['buyer_email'] == 'export-buyer@test.com'
+        assert sum(line['total_price'] for line in lines) == 25 * 25
+
+        assert buyer.get('/orders/export?as=artisan').status_code == 403
+        assert buyer.get('/orders/export?format=xml').status_code == 400
+
+    def test_csv_export_defuses_formulas(self, app):
+        product = Product.query.filter_by(title='Other Basket').first()
+        buyer = User.query.filter_by(email='export-buyer@test.com').first()
+        product.title, buyer.full_name = '=HYPERLINK("http://evil.test")', '@SUM(1+1)'
+        db.session.commit()
+        try:
+            client = self.login(app, 'buyer')
+            rows = list(csv.DictReader(io.StringIO(client.get('/orders/export').get_data(as_text=True))))
+            assert {row['product_title'] for row in rows} == {'Export Basket', '\'=HYPERLINK("http://evil.test")'}
+            assert {row['buyer_name'] for row in rows} == {"'@SUM(1+1)"}
+
+            lines = client.get('/orders/export?format=ndjson').get_data(as_text=True).splitlines()
+            assert json.loads(lines[0])['buyer_name'] == '@SUM(1+1)'
+        finally:
+            product.title, buyer.full_name = 'Other Basket', 'Export Buyer'
+            db.session.commit()
+
+
+class TestConversations:
+    """The inbox reads one conversations row per partner, kept current by the message routes"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        users = {}
+        for name in ('me', 'ann', 'ben', 'cat'):
+            users[name] = User(full_name=name.title(), email=f'inbox-{name}@test.com', role='buyer')
+            users[name].set_password('password123')
+        db.session.add_all(users.values())
+        db.session.flush()
+        me, ann, ben = users['me'].id, users['ann'].id, users['ben'].id
+        start = datetime(2024, 1, 1)
+        for minute, (sender, receiver, text, status) in enumerate([
+            (ann, me, 'hi from ann', 'read'),
+            (me, ann, 'hi ann', 'sent'),
+            (ann, me, 'are you there?', 'delivered'),
+            (ben, me, 'ben 1', 'sent'),
+            (ben, me, 'ben 2', 'sent'),
+            (me, ben, 'reply to ben', 'sent'),
+            (users['cat'].id, ann, 'not mine', 'sent'),
+        ]):
+            db.session.add(Message(sender_id=sender, receiver_id=receiver, message=text, status=status,
+                                   created_at=start + timedelta(minutes=minute)))
+        db.session.commit()
+        # Written behind the routes' back, as a backfill would find them
+        assert rebuild_conversations() == 3
+        return app
+
+    def test_summary_from_one_query(self, app):
+        client = app.test_client()
+        client.post('/auth/login', json={'email': 'inbox-me@test.com', 'password': 'password123'})
+        responses = []
+        statements = capture_queries(lambda: responses.append(client.get('/messages/conversations')))
+        assert len([s for s in statements if 'messages' in s]) == 1
+
+        conversations = json.loads(responses[0].data)
+        assert [(c['artisan']['name'], c['lastMessage'], c['unread']) for c in conversations] == [
+            ('Ben', 'reply to ben', 2),
+            ('Ann', 'are you there?', 1),
+        ]
+
+    def snapshot(self):
+        db.session.expire_all()
+        return sorted((c.user_low_id, c.user_high_id, c.last_message_id, c.low_unread, c.high_unread)
+                      for c in Conversation.query.all())
+
+    def test_routes_maintain_the_table(self, app):
+        me, ann = app.test_client(), app.test_client()
+        me.post('/auth/login', json={'email': 'inbox-me@test.com', 'password': 'password123'})
+        ann.post('/auth/login', json={'email': 'inbox-ann@test.com', 'password': 'password123'})
+        me_id, ann_id, cat_id = [User.query.filter_by(email=f'inbox-{name}@test.com').first().id
+                                 for name in ('me', 'ann', 'cat')]
+
+        assert me.post('/messages/', json={'receiver_id': ann_id, 'message': 'sorry, busy'}).status_code == 201
+        # Clients sometimes send ids as strings
+        sent = ann.post('/messages/', json={'receiver_id': str(me_id), 'message': 'no worries'})
+        assert sent.status_code == 201
+        assert me.post('/messages/', json={'receiver_id': cat_id, 'message': 'hello cat'}).status_code == 201
+
+        inbox = json.loads(me.get('/messages/conversations').data)
+        assert [(c['artisan']['name'], c['lastMessage'], c['unread']) for c in inbox] == [
+            ('Cat', 'hello cat', 0), ('Ann', 'no worries', 2), ('Ben', 'reply to ben', 2)]
+
+        message_id = json.loads(sent.data)['message_data']['id']
+        assert me.put(f'/messages/{message_id}/status', json={'status': 'read'}).status_code == 200
+        assert me.put(f'/messages/{message_id}/status', json={'status': 'read'}).status_code == 200
+        inbox = json.loads(me.get('/messages/conversations').data)
+        assert inbox[1]['unread'] == 1
+
+        maintained = self.snapshot()
+        rebuild_conversations()
+        assert self.snapshot() == maintained
+
+
+class TestRealtimePush:
+    """Committed writes push events to the users' subscribers through the hub"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        artisan = User(full_name='Push Artisan', email='push-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        buyer = User(full_name='Push Buyer', email='push-buyer@test.com', role='buyer')
+        buyer.set_password('password123')
+        db.session.add_all([artisan, buyer])
+        db.session.flush()
+        product = Product(title='Push Pot', description='d', price=10, stock=5, artisan_id=artisan.id)
+        db.session.add(product)
+        db.session.flush()
+        order = Order(user_id=buyer.id, total_amount=10)
+        db.session.add(order)
+        db.session.flush()
+        db.session.add(OrderItem(order_id=order.id, product_id=product.id, quantity=1, unit_price=10,
+                                 total_price=10, artisan_id=artisan.id))
+        db.session.add(Payment(order_id=order.id, user_id=buyer.id, amount=10, transaction_id='ws_CO_1'))
+        db.session.commit()
+        yield app
+        app.extensions['realtime'].close()
+
+    @pytest.fixture(scope='class')
+    def users(self, app):
+        return {name: User.query.filter_by(email=f'push-{name}@test.com').first().id
+                for name in ('artisan', 'buyer')}
+
+    @pytest.fixture
+    def inbox(self, app, users):
+        """Events received by each user's subscriber during the test"""
+        hub = app.extensions['realtime']
+        events = {name: [] for name in users}
+        unsubscribes = [hub.subscribe(user_id, lambda event, data, name=name: events[name].append((event, data)))
+                        for name, user_id in users.items()]
+        yield events
+        for unsubscribe in unsubscribes:
+            unsubscribe()
+        assert hub.subscriber_count() == 0
+
+    def login(self, app, name):
+        client = app.test_client()
+        client.post('/auth/login', json={'email': f'push-{name}@test.com', 'password': 'password123'})
+        return client
+
+    def test_message_and_notification_events(self, app, users, inbox):
+        buyer = self.login(app, 'buyer')
+        assert buyer.post('/messages/', json={'receiver_id': users['artisan'], 'message': 'is it glazed?'}
+                          ).status_code == 201
+        assert [(event, data['message']) for event, data in inbox['artisan']] == [('new_message', 'is it glazed?')]
+        assert inbox['buyer'][0][0] == 'new_message'
+
+        create_notification(users['buyer'], 'Your pot shipped', 'order')
+        assert inbox['buyer'][-1][0] == 'notification'
+        assert inbox['buyer'][-1][1]['message'] == 'Your pot shipped'
+        assert [event for event, _ in inbox['artisan']] == ['new_message']
+
+    def test_order_and_payment_events(self, app, users, inbox):
+        order_id = Order.query.filter_by(user_id=users['buyer']).first().id
+        artisan = self.login(app, 'artisan')
+        assert artisan.put(f'/orders/{order_id}/status', json={'status': 'shipped'}).status_code == 200
+        assert inbox['buyer'] == [('order_status', {'order_id': order_id, 'status': 'shipped'})]
+
+        callback = {'Body': {'stkCallback': {
+            'MerchantRequestID': 'm-1', 'CheckoutRequestID': 'ws_CO_1', 'ResultCode': 0, 'ResultDesc': 'ok',
+            'CallbackMetadata': {'Item': [{'Name': 'MpesaReceiptNumber', 'Value': 'RCP123'}]}}}}
+        assert app.test_client().post('/payments/mpesa/callback', json=callback).status_code == 200
+        assert [event for event, _ in inbox['buyer']] == ['order_status', 'order_status', 'payment_status']
+        assert inbox['buyer'][-1][1]['status'] == 'completed'
+        assert inbox['artisan'] == []
+
+    def test_failing_subscriber_is_isolated(self, app, users, inbox):
+        hub = app.extensions['realtime']
+
+        def broken(event, data):
+            raise RuntimeError('socket gone')
+
+        unsubscribe = hub.subscribe(users['buyer'], broken)
+        try:
+            create_notification(users['buyer'], 'still delivered', 'system')
+        finally:
+            unsubscribe()
+        assert inbox['buyer'][-1][1]['message'] == 'still delivered'
+
+    def test_socket_authenticates_from_session(self, app, users):
+        from push_server import authenticate
+        buyer = self.login(app, 'buyer')
+        cookie = buyer.get_cookie(app.config['SESSION_COOKIE_NAME'])
+        assert authenticate(app, f'{cookie.key}={cookie.value}') == users['buyer']
+        assert authenticate(app, f'{cookie.key}=forged') is None
+        assert authenticate(app) is None
+
+    def test_push_server_builds(self, app):
+        pytest.importorskip('socketio')
+        from push_server import create_push_server
+        assert callable(create_push_server(app))
+
+
+class TestMessageSync:
+    """Id-windowed thread fetches and the /messages/poll long-poll"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        for name in ('ada', 'bo'):
+            user = User(full_name=name.title(), email=f'sync-{name}@test.com', role='buyer')
+            user.set_password('password123')
+            db.session.add(user)
+        db.session.flush()
+        ada, bo = [User.query.filter_by(email=f'sync-{name}@test.com').first().id for name in ('ada', 'bo')]
+        for index in range(30):
+            sender, receiver = (ada, bo) if index % 2 else (bo, ada)
+            db.session.add(Message(sender_id=sender, receiver_id=receiver, message=f'm{index}'))
+        db.session.commit()
+        yield app
+        app.extensions['realtime'].close()
+
+    @pytest.fixture(scope='class')
+    def ids(self, app):
+        return {name: User.query.filter_by(email=f'sync-{name}@test.com').first().id for name in ('ada', 'bo')}
+
+    def login(self, app, name):
+        client = app.test_client()
+        client.post('/auth/login', json={'email': f'sync-{name}@test.com', 'password': 'password123'})
+        return client
+
+    def texts(self, response):
+        return [message['message'] for message in json.loads(response.data)]
+
+    def test_windows_by_id(self, app, ids):
+        ada = self.login(app, 'ada')
+        message_ids = [m.id for m in Message.query.order_by(Message.id)]
+
+        response = ada.get(f"/messages/?user_id={ids['bo']}&after_id={message_ids[24]}")
+        assert self.texts(response) == [f'm{index}' for index in range(25, 30)]
+        assert response.headers['X-Has-More'] == 'false'
+
+        response = ada.get(f"/messages/?user_id={ids['bo']}&before_id={message_ids[20]}&per_page=5")
+        assert self.texts(response) == [f'm{index}' for index in range(15, 20)]
+        assert response.headers['X-Has-More'] == 'true'
+
+    def test_poll_answers_at_once_when_behind(self, app):
+        ada = self.login(app, 'ada')
+        first = Message.query.order_by(Message.id).first().id
+        response = ada.get(f'/messages/poll?after_id={first}&timeout=5')
+        texts = self.texts(response)
+        assert texts[0] == 'm2' and all(int(text[1:]) % 2 == 0 for text in texts)
+
+        start = time.monotonic()
+        assert self.texts(ada.get('/messages/poll?timeout=0.2')) == []
+        assert time.monotonic() - start < 2
+
+    def test_poll_wakes_on_new_message(self, app, ids):
+        ada, bo = self.login(app, 'ada'), self.login(app, 'bo')
+        last = db.session.query(db.func.max(Message.id)).scalar()
+
+        def send_later():
+            time.sleep(0.3)
+            bo.post('/messages/', json={'receiver_id': ids['ada'], 'message': 'wake up'})
+
+        sender = threading.Thread(target=send_later)
+        start = time.monotonic()
+        sender.start()
+        response = ada.get(f'/messages/poll?after_id={last}&timeout=10')
+        sender.join()
+        assert self.texts(response) == ['wake up']
+        assert time.monotonic() - start < 5
+        assert app.extensions['realtime'].subscriber_count() == 0
+
+    def test_poll_finds_messages_sent_through_other_workers(self, app, ids):
+        # With the local bus, a send handled by another worker is never pushed here
+        ada = self.login(app, 'ada')
+        last = db.session.query(db.func.max(Message.id)).scalar()
+        app.config['MESSAGE_POLL_RECHECK_INTERVAL'] = 0.2
+
+        def send_elsewhere():
+            time.sleep(0.3)
+            with app.app_context():
+                db.session.add(Message(sender_id=ids['bo'], receiver_id=ids['ada'], message='from worker 2'))
+                db.session.commit()
+
+        sender = threading.Thread(target=send_elsewhere)
+        start = time.monotonic()
+        sender.start()
+        try:
+            response = ada.get(f'/messages/poll?after_id={last}&timeout=10')
+        finally:
+            sender.join()
+            app.config['MESSAGE_POLL_RECHECK_INTERVAL'] = 1.5
+        assert self.texts(response) == ['from worker 2']
+        assert time.monotonic() - start < 3
+
+    def test_poll_without_a_reachable_bus_answers_at_once(self, app):
+        ada = self.login(app, 'ada')
+        hub = app.extensions['realtime']
+        app.extensions['realtime'] = Hub(RedisBus(redis.Redis.from_url('redis://127.0.0.1:1/0')))
+        try:
+            response = ada.get('/messages/poll?timeout=10')
+        finally:
+            app.extensions['realtime'] = hub
+        assert response.status_code == 200
+        assert response.headers['Retry-After'] == '1'
+
+
+class TestReadReceipts:
+    """PUT /messages/read marks a thread read in one statement"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        users = []
+        for name in ('cy', 'di', 'ed'):
+            user = User(full_name=name.title(), email=f'read-{name}@test.com', role='buyer')
+            user.set_password('password123')
+            users.append(user)
+        db.session.add_all(users)
+        db.session.flush()
+        cy, di, ed = [user.id for user in users]
+        for index in range(6):
+            db.session.add(Message(sender_id=di, receiver_id=cy, message=f'd{index}'))
+        db.session.add(Message(sender_id=ed, receiver_id=cy, message='e0'))
+        db.session.add(Message(sender_id=cy, receiver_id=di, message='c0'))
+        db.session.commit()
+        rebuild_conversations()
+        return app
+
+    def test_marks_up_to_id_and_returns_counters(self, app):
+        ids = {name: User.query.filter_by(email=f'read-{name}@test.com').first().id for name in ('cy', 'di', 'ed')}
+        client = app.test_client()
+        client.post('/auth/login', json={'email': 'read-cy@test.com', 'password': 'password123'})
+        from_di = [m.id for m in Message.query.filter_by(sender_id=ids['di']).order_by(Message.id)]
+
+        statements = capture_queries(lambda: client.put(
+            '/messages/read', json={'partner_id': ids['di'], 'up_to_id': from_di[3]}))
+        assert len([sql for sql in statements if sql.lstrip().upper().startswith('UPDATE MESSAGES')]) == 1
+
+        db.session.expire_all()
+        assert [m.status for m in Message.query.filter_by(sender_id=ids['di']).order_by(Message.id)] == \
+            ['read'] * 4 + ['sent'] * 2
+
+        response = client.put('/messages/read', json={'partner_id': ids['di']})
+        body = json.loads(response.data)
+        assert response.status_code == 200
+        assert (body['updated'], body['unread'], body['total_unread']) == (2, 0, 1)
+        # Messages cy sent are left alone
+        assert Message.query.filter_by(sender_id=ids['cy']).one().status == 'sent'
+
+        body = json.loads(client.put('/messages/read', json={'partner_id': ids['di']}).data)
+        assert (body['updated'], body['unread'], body['total_unread']) == (0, 0, 1)
+        assert client.put('/messages/read', json={}).status_code == 400
+
+
+class TestFollowerFanout:
+    """New products notify the artisan's followers in bulk, chunk by chunk"""
+
+    @pytest.fixture(scope='class')
+    def app(self, app):
+        app.config['NOTIFY_FANOUT_CHUNK_SIZE'] = 10
+        artisan = User(full_name='Fan Artisan', email='fan-artisan@test.com', role='artisan')
+        artisan.set_password('password123')
+        db.session.add(artisan)
+        db.session.flush()
+        db.session.execute(insert(User), [
+            {'full_name': f'Fan {index}', 'email': f'fan-{index}@test.com', 'password_hash': 'x', 'role': 'buyer'}
+            for index in range(26)])
+        fans = [user.id for user in User.query.filter_by(role='buyer').order_by(User.id)]
+        # The last one doesn't follow
+        db.session.execute(insert(Follow), [{'follower_id': fan, 'artisan_id': artisan.id} for fan in fans[:-1]])
+        db.session.commit()
+        yield app
+        notification_fanout.configure(0)
+
+    def login(self, app):
+        client = app.test_client()
+        client.post('/auth/login', json={'email': 'fan-artisan@test.com', 'password': 'password123'})
+        return client
+
+    def test_create_product_notifies_followers(self, app):
+        client = self.login(app)
+        before = notification_fanout.stats()
+        statements = capture_queries(lambda: client.post('/products/', json={
+            'title': 'Kiondo', 'description': 'Woven basket', 'price': 1500, 'stock': 5}))
+
+        inserts = [sql for sql in statements if sql.lstrip().upper().startswith('INSERT INTO NOTIFICATIONS')]
+        assert len(inserts) == 3  # 25 followers in chunks of 10
+        notifications = Notification.query.filter_by(type='new_product').all()
+        assert len(notifications) == 25
+        assert notifications[0].message == 'Fan Artisan listed a new product: Kiondo'
+        outsider = User.query.filter_by(email='fan-25@test.com').first()
+        assert Notification.query.filter_by(user_id=outsider.id).count() == 0
+
+        stats = notification_fanout.stats()
+        assert stats['completed'] - before['completed'] == 1
+        assert stats['notifications'] - before['notifications'] == 25
+
+        response = client.post('/products/', json={
+            'title': 'Draft', 'description': 'd', 'price': 10, 'stock': 1, 'status': 'draft'})
+        assert response.status_code == 201
+        assert Notification.query.count() == 25
+
+    def test_pool_runs_jobs_off_the_calling_thread(self, app):
+        threads = []
+
+        def job(artisan_id):
+            threads.append(threading.current_thread().name)
+            return notify_followers(artisan_id, 'Pool run', 'new_product')
+
+        notification_fanout.configure(2)
+        try:
+            artisan = User.query.filter_by(email='fan-artisan@test.com').first()
+            notification_fanout.submit(job, artisan.id)
+            assert notification_fanout.drain(timeout=10)
+        finally:
+            notification_fanout.configure(0)
+        assert threads[0].startswith('fanout')
+        assert Notification.query.filter_by(message='Pool run').count() == 25
+        assert notification_fanout.stats()['pending'] == 0
+
+
+class TestHttpMiddleware:
+    """Compression, weak ETags and Cache-Control policies"""
+
+    @pytest.fixture(scope='class')
+    def products(self, app):
+        artisan = User(full_name='Middleware Artisan', email='middleware@test.com', role='artisan')
+        artisan.set_password('password123')
+        db.session.add(artisan)
+        db.session.flush()
+        db.session.add_all([Product(title=f'Compressible {i}', description='Hand woven ' * 20, price=1,
+                                    stock=1, artisan_id=artisan.id) for i in range(20)])
+        db.session.commit()
+
+    def test_gzip_negotiated_above_threshold(self, client, products):
+        plain = client.get('/products/')
+        response = client.get('/products/', headers={'Accept-Encoding': 'gzip, deflate'})
+        assert response.headers['Content-Encoding'] == 'gzip'
+        assert 'Accept-Encoding' in response.headers['Vary']
+        assert gzip.decompress(response.data) == plain.data
+        assert len(response.data) < len(plain.data) / 3
+
+        refused = client.get('/products/', headers={'Accept-Encoding': 'gzip;q=0'})
+        assert 'Content-Encoding' not in refused.headers
+
+        small = client.get('/health', headers={'Accept-Encoding': 'gzip'})
+        assert 'Content-Encoding' not in small.headers
+
+    def test_weak_etag_short_circuits(self, client, products):
+        response = client.get('/products/')
+        etag = response.headers['ETag']
+        assert etag.startswith('W/')
+
+        response = client.get('/products/', headers={'If-None-Match': etag, 'Accept-Encoding': 'gzip'})
+        assert response.status_code == 304
+        assert response.data == b''
+        assert 'Content-Encoding' not in response.headers
+
+    def test_cache_control_policies(self, client, products):
+        assert client.get('/products/').headers['Cache-Control'] == 'public, max-age=60'
+        assert client.get('/health').headers['Cache-Control'] == 'private, no-cache'
+        tree = client.get('/categories/tree')
+        assert tree.headers['Cache-Control'] == 'public, max-age=0, must-revalidate'
+        assert not tree.headers['ETag'].startswith('W/')
+
 if __name__ == '__main__':
     # Run tests
     pytest.main([__file__, '-v'])
@@ -0,0 +1,165 @@
+import re
+from markupsafe import escape
+from sqlalchemy import DDL, event, text
+from models import db, Product
+
+# Full-text search over product titles and descriptions.
+#
+# PostgreSQL: products.search_vector is a generated tsvector column (title
+# weighted above description) with a GIN index, so the database keeps it
+# current on every write.
+# SQLite (dev/test): products_fts is an FTS5 external-content table kept in
+# sync with products by triggers.
+# Any other backend falls back to ILIKE.
+#
+# Snippets are HTML: the database marks matches with control-character
+# sentinels, the artisan-written text is escaped, then the sentinels become
+# <mark> tags.
+
+SNIPPET_START = '<mark>'
+SNIPPET_END = '</mark>'
+# Can't come out of the escaping, and descriptions have no reason to contain them
+START_SENTINEL = '\x02'
+END_SENTINEL = '\x03'
+
+POSTGRES_DDL = [
+    """
+    ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector
+    GENERATED ALWAYS AS (
+        setweight(to_tsvector('simple', coalesce(title, '')), 'A') ||
+        setweight(to_tsvector('simple', coalesce(description, '')), 'B')
+    ) STORED
+    """,
+    "CREATE INDEX IF NOT EXISTS ix_products_search_vector ON products USING GIN (search_vector)",
+]
+
+SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        title, description, content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF title, description ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, title, description)
+        VALUES ('delete', old.id, old.title, old.description);
+        INSERT INTO products_fts(rowid, title, description) VALUES (new.id, new.title, new.description);
+    END
+    """,
+]
+
+for statement in POSTGRES_DDL:
+    event.listen(Product.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+for statement in SQLITE_DDL:
+    event.listen(Product.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+event.listen(Product.__table__, 'before_drop',
+             DDL('DROP TABLE IF EXISTS products_fts').execute_if(dialect='sqlite'))
+
+
+def dialect_name():
+    return db.session.get_bind().dialect.name
+
+
+def search_terms(search):
+    """Split user input into lowercase word tokens safe for any query syntax"""
+    return re.findall(r'\w+', search.lower())
+
+
+def match_expression(terms):
+    """Prefix-match every term, so partially typed words still hit"""
+    if dialect_name() == 'postgresql':
+        return ' & '.join(f'{term}:*' for term in terms)
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def search_filter(search):
+    """SQL criterion restricting a Product query to rows matching search"""
+    terms = search_terms(search)
+    if not terms:
+        return db.true()
+
+    dialect = dialect_name()
+    if dialect == 'postgresql':
+        return text("products.search_vector @@ to_tsquery('simple', :search_query)").bindparams(
+            search_query=match_expression(terms))
+    if dialect == 'sqlite':
+        return Product.id.in_(
+            text('SELECT rowid FROM products_fts WHERE products_fts MATCH :search_query').bindparams(
+                search_query=match_expression(terms)).columns(db.column('rowid')))
+
+    pattern = f'%{search}%'
+    return Product.title.ilike(pattern) | Product.description.ilike(pattern)
+
+
+def highlight(snippet):
+    """HTML-escape a snippet and turn its sentinels into the highlight tags"""
+    return str(escape(snippet or '')).replace(START_SENTINEL, SNIPPET_START).replace(END_SENTINEL, SNIPPET_END)
+
+
+def search_products(search, limit, offset=0):
+    """Return (product_id, score, HTML snippet) rows for active products, best match first"""
+    terms = search_terms(search)
+    if not terms:
+        return []
+
+    params = {
+        'search_query': match_expression(terms),
+        'limit': limit,
+        'offset': offset,
+        'start': START_SENTINEL,
+        'end': END_SENTINEL,
+    }
+    dialect = dialect_name()
+
+    if dialect == 'postgresql':
+        sql = text("""
+            SELECT p.id, ts_rank(p.search_vector, q) AS score,
+                   ts_headline('simple', p.description, q,
+                               'MaxWords=25, MinWords=8, StartSel=' || :start || ', StopSel=' || :end) AS snippet
+            FROM products p, to_tsquery('simple', :search_query) q
+            WHERE p.status = 'active' AND p.search_vector @@ q
+            ORDER BY score DESC, p.id DESC
+            LIMIT :limit OFFSET :offset
+        """)
+    elif dialect == 'sqlite':
+        sql = text("""
+            SELECT p.id, -bm25(products_fts, 10.0, 1.0) AS score,
+                   snippet(products_fts, 1, :start, :end, '…', 16) AS snippet
+            FROM products_fts JOIN products p ON p.id = products_fts.rowid
+            WHERE products_fts MATCH :search_query AND p.status = 'active'
+            ORDER BY bm25(products_fts, 10.0, 1.0), p.id DESC
+            LIMIT :limit OFFSET :offset
+        """)
+    else:
+        rows = Product.query.with_entities(Product.id, Product.description).filter(
+            Product.status == 'active', search_filter(search)
+        ).order_by(Product.id.desc()).limit(limit).offset(offset).all()
+        return [(product_id, 0.0, highlight((description or '')[:160])) for product_id, description in rows]
+
+    return [(product_id, score, highlight(snippet)) for product_id, score, snippet in db.session.execute(sql, params)]
+
+
+def rebuild_search_index():
+    """Create the search structures on an existing database and reindex every product"""
+    dialect = dialect_name()
+    if dialect == 'postgresql':
+        for statement in POSTGRES_DDL:
+            db.session.execute(text(statement))
+    elif dialect == 'sqlite':
+        for statement in SQLITE_DDL:
+            db.session.execute(text(statement))
+        db.session.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+    db.session.commit()
+    return dialect
@@ -0,0 +1,351 @@
+import csv
+import io
+import json
+from flask import Response
+from models import db, User, Product, Cart, Order, OrderItem, Favorite
+
+# Column-projection serializers for list endpoints.
+#
+# Instead of loading full ORM objects and walking relationships through
+# to_dict(), list endpoints select just the columns a payload needs as
+# plain tuples (joining the artisan in the same SELECT) and build the
+# response dicts in one pass. The dicts match the models' to_dict() output.
+#
+# Product and user serializers also accept a sparse fieldset (?fields=):
+# only the columns behind the requested fields are selected, and the
+# artisan join is skipped unless an artisan field was asked for.
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - exercised when orjson isn't installed
+    orjson = None
+
+
+def dumps(payload):
+    """Encode payload as JSON bytes, using orjson when it is installed"""
+    if orjson is not None:
+        return orjson.dumps(payload)
+    return json.dumps(payload, separators=(',', ':')).encode('utf-8')
+
+
+def json_response(payload, status=200):
+    return Response(dumps(payload), status=status, mimetype='application/json')
+
+
+def _iso(value):
+    return value.isoformat() if value else None
+
+
+# ================================
+# PRODUCTS
+# ================================
+ARTISAN_NAME = User.full_name.label('artisan_name')
+ARTISAN_LOCATION = User.location.label('artisan_location')
+
+PRODUCT_COLUMNS = (
+    Product.id, Product.title, Product.description, Product.price, Product.currency,
+    Product.stock, Product.category, Product.subcategory, Product.image, Product.artisan_id,
+    Product.status, Product.rating_sum, Product.rating_count, Product.reserved, Product.created_at,
+    Product.updated_at, ARTISAN_NAME, ARTISAN_LOCATION,
+)
+
+# Columns each product field is computed from, in to_dict() order
+PRODUCT_FIELD_COLUMNS = {
+    'id': (Product.id,),
+    'title': (Product.title,),
+    'description': (Product.description,),
+    'price': (Product.price,),
+    'currency': (Product.currency,),
+    'stock': (Product.stock,),
+    'category': (Product.category,),
+    'subcategory': (Product.subcategory,),
+    'image': (Product.image,),
+    'artisan_id': (Product.artisan_id,),
+    'artisan_name': (ARTISAN_NAME,),
+    'location': (ARTISAN_NAME, ARTISAN_LOCATION),
+    'rating': (Product.rating_sum, Product.rating_count),
+    'review_count': (Product.rating_count,),
+    'in_stock': (Product.stock,),
+    'available': (Product.stock, Product.reserved),
+    'status': (Product.status,),
+    'created_at': (Product.created_at,),
+    'updated_at': (Product.updated_at,),
+}
+PRODUCT_FIELDS = tuple(PRODUCT_FIELD_COLUMNS)
+
+PRODUCT_FIELD_VALUES = {
+    'price': lambda row: float(row.price),
+    'artisan_name': lambda row: row.artisan_name if row.artisan_name is not None else 'Unknown',
+    'location': lambda row: row.artisan_location if row.artisan_name is not None else 'Kenya',
+    'rating': lambda row: row.rating_sum / row.rating_count if row.rating_count else 4.5,
+    'review_count': lambda row: row.rating_count or 0,
+    'in_stock': lambda row: (row.stock or 0) > 0,
+    'available': lambda row: (row.stock or 0) - (row.reserved or 0),
+    'created_at': lambda row: _iso(row.created_at),
+    'updated_at': lambda row: _iso(row.updated_at),
+}
+
+
+def _columns_for(field_columns, fields, always=()):
+    """Deduplicated columns behind fields, plus any always-needed columns"""
+    columns = {}
+    for column in always:
+        columns[column.key] = column
+    for field in fields:
+        for column in field_columns[field]:
+            columns.setdefault(column.key, column)
+    return list(columns.values())
+
+
+def product_columns(fields=None):
+    if fields is None:
+        return list(PRODUCT_COLUMNS)
+    # id and created_at are always selected: keyset pagination and the
+    # nested-product null check depend on them
+    return _columns_for(PRODUCT_FIELD_COLUMNS, fields, always=(Product.id, Product.created_at))
+
+
+def _needs_artisan(columns):
+    return any(column.key in ('artisan_name', 'artisan_location') for column in columns)
+
+
+def project_products(query, fields=None):
+    """Turn a Product query into a tuple query carrying the listing columns"""
+    columns = product_columns(fields)
+    query = query.with_entities(*columns)
+    if _needs_artisan(columns):
+        query = query.outerjoin(User, User.id == Product.artisan_id)
+    return query
+
+
+def product_row_to_dict(row, fields=None):
+    if fields is not None:
+        return {
+            field: PRODUCT_FIELD_VALUES[field](row) if field in PRODUCT_FIELD_VALUES else getattr(row, field)
+            for field in fields
+        }
+
+    has_artisan = row.artisan_name is not None
+    return {
+        'id': row.id,
+        'title': row.title,
+        'description': row.description,
+        'price': float(row.price),
+        'currency': row.currency,
+        'stock': row.stock,
+        'category': row.category,
+        'subcategory': row.subcategory,
+        'image': row.image,
+        'artisan_id': row.artisan_id,
+        'artisan_name': row.artisan_name if has_artisan else 'Unknown',
+        'location': row.artisan_location if has_artisan else 'Kenya',
+        'rating': row.rating_sum / row.rating_count if row.rating_count else 4.5,
+        'review_count': row.rating_count or 0,
+        'in_stock': (row.stock or 0) > 0,
+        'available': (row.stock or 0) - (row.reserved or 0),
+        'status': row.status,
+        'created_at': _iso(row.created_at),
+        'updated_at': _iso(row.updated_at)
+    }
+
+
+def serialize_products(rows, fields=None):
+    return [product_row_to_dict(row, fields) for row in rows]
+
+
+# ================================
+# CART
+# ================================
+def cart_query(user_id):
+    return db.session.query(
+        Cart.id.label('cart_id'), Cart.user_id.label('cart_user_id'),
+        Cart.product_id.label('cart_product_id'), Cart.quantity.label('cart_quantity'),
+        Cart.created_at.label('cart_created_at'), *PRODUCT_COLUMNS
+    ).select_from(Cart).outerjoin(Product, Product.id == Cart.product_id).outerjoin(
+        User, User.id == Product.artisan_id
+    ).filter(Cart.user_id == user_id).order_by(Cart.id)
+
+
+def serialize_cart(rows):
+    return [{
+        'id': row.cart_id,
+        'user_id': row.cart_user_id,
+        'product_id': row.cart_product_id,
+        'quantity': row.cart_quantity,
+        'product': product_row_to_dict(row) if row.id is not None else None,
+        'created_at': _iso(row.cart_created_at)
+    } for row in rows]
+
+
+# ================================
+# FAVORITES
+# ================================
+def favorites_query(user_id, fields=None):
+    """Favorites with their product; fields narrows the nested product"""
+    columns = product_columns(fields)
+    query = db.session.query(
+        Favorite.id.label('favorite_id'), Favorite.user_id.label('favorite_user_id'),
+        Favorite.product_id.label('favorite_product_id'),
+        Favorite.created_at.label('favorite_created_at'), *columns
+    ).select_from(Favorite).outerjoin(Product, Product.id == Favorite.product_id)
+    if _needs_artisan(columns):
+        query = query.outerjoin(User, User.id == Product.artisan_id)
+    return query.filter(Favorite.user_id == user_id).order_by(Favorite.id)
+
+
+def serialize_favorites(rows, fields=None):
+    return [{
+        'id': row.favorite_id,
+        'user_id': row.favorite_user_id,
+        'product_id': row.favorite_product_id,
+        'product': product_row_to_dict(row, fields) if row.id is not None else None,
+        'created_at': _iso(row.favorite_created_at)
+    } for row in rows]
+
+
+# ================================
+# USERS
+# ================================
+USER_FIELD_COLUMNS = {
+    'id': (User.id,),
+    'full_name': (User.full_name,),
+    'email': (User.email,),
+    'role': (User.role,),
+    'description': (User.description,),
+    'location': (User.location,),
+    'phone': (User.phone,),
+    'profile_picture_url': (User.profile_picture_url,),
+    'created_at': (User.created_at,),
+    'updated_at': (User.updated_at,),
+}
+USER_FIELDS = tuple(USER_FIELD_COLUMNS)
+
+
+def project_users(query, fields=None):
+    return query.with_entities(*_columns_for(USER_FIELD_COLUMNS, fields or USER_FIELDS, always=(User.id,)))
+
+
+def user_row_to_dict(row, fields=None):
+    result = {}
+    for field in fields or USER_FIELDS:
+        value = getattr(row, field)
+        result[field] = _iso(value) if field in ('created_at', 'updated_at') else value
+    return result
+
+
+def serialize_users(rows, fields=None):
+    return [user_row_to_dict(row, fields) for row in rows]
+
+
+# ================================
+# ORDERS
+# ================================
+ORDER_COLUMNS = (
+    Order.id, Order.user_id, Order.total_amount, Order.status, Order.created_at, Order.updated_at,
+    User.full_name.label('user_name'), User.email.label('user_email'),
+)
+
+
+def project_orders(query):
+    return query.with_entities(*ORDER_COLUMNS).outerjoin(User, User.id == Order.user_id)
+
+
+def serialize_orders(rows):
+    """Build order dicts, loading the items of every order in one extra query"""
+    order_ids = [row.id for row in rows]
+    items_by_order = {order_id: [] for order_id in order_ids}
+    if order_ids:
+        items = db.session.query(
+            OrderItem.id, OrderItem.order_id, OrderItem.product_id, OrderItem.quantity,
+            OrderItem.unit_price, OrderItem.total_price, OrderItem.artisan_id,
+            Product.title, Product.image
+        ).outerjoin(Product, Product.id == OrderItem.product_id).filter(
+            OrderItem.order_id.in_(order_ids)
+        ).order_by(OrderItem.id)
+
+        for item in items:
+            items_by_order[item.order_id].append({
+                'id': item.id,
+                'order_id': item.order_id,
+                'product_id': item.product_id,
+                'product_title': item.title,
+                'image': item.image,
+                'quantity': item.quantity,
+                'unit_price': float(item.unit_price),
+                'total_price': float(item.total_price),
+                'artisan_id': item.artisan_id
+            })
+
+    return [{
+        'id': row.id,
+        'user_id': row.user_id,
+        'user_name': row.user_name,
+        'user_email': row.user_email,
+        'total_amount': float(row.total_amount),
+        'status': row.status,
+        'items': items_by_order[row.id],
+        'created_at': _iso(row.created_at),
+        'updated_at': _iso(row.updated_at)
+    } for row in rows]
+
+
+# Order export: one row per order item, streamed while the rows are read
+ORDER_EXPORT_COLUMNS = (
+    Order.id.label('order_id'), Order.created_at.label('order_created_at'), Order.status.label('order_status'),
+    User.full_name.label('buyer_name'), User.email.label('buyer_email'), OrderItem.id.label('item_id'),
+    OrderItem.product_id, Product.title.label('product_title'), OrderItem.quantity, OrderItem.unit_price,
+    OrderItem.total_price, OrderItem.artisan_id,
+)
+ORDER_EXPORT_FIELDS = tuple(column.key for column in ORDER_EXPORT_COLUMNS)
+EXPORT_MIMETYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+
+
+def order_export_query(*criteria):
+    """Order items matching criteria with their order, buyer and product, newest order first"""
+    return db.session.query(*ORDER_EXPORT_COLUMNS).select_from(OrderItem).join(
+        Order, Order.id == OrderItem.order_id
+    ).outerjoin(User, User.id == Order.user_id).outerjoin(Product, Product.id == OrderItem.product_id).filter(
+        *criteria
+    ).order_by(Order.created_at.desc(), Order.id.desc(), OrderItem.id)
+
+
+def _export_values(row):
+    return [
+        row.order_id, _iso(row.order_created_at), row.order_status, row.buyer_name, row.buyer_email,
+        row.item_id, row.product_id, row.product_title, row.quantity, float(row.unit_price),
+        float(row.total_price), row.artisan_id
+    ]
+
+
+# Spreadsheets run a cell starting with one of these as a formula
+FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+
+def _csv_cell(value):
+    """Text that a spreadsheet would evaluate, quoted with a leading apostrophe"""
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+def stream_order_export(query, export_format, batch_size=1000):
+    """Yield the export as CSV or NDJSON chunks, fetching batch_size rows at a time"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == 'csv' else None
+    if writer:
+        writer.writerow(ORDER_EXPORT_FIELDS)
+
+    for count, row in enumerate(query.yield_per(batch_size), 1):
+        values = _export_values(row)
+        if writer:
+            writer.writerow([_csv_cell(value) for value in values])
+        else:
+            buffer.write(json.dumps(dict(zip(ORDER_EXPORT_FIELDS, values)), separators=(',', ':')))
+            buffer.write('\n')
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
@@ -0,0 +1,173 @@
+import secrets
+from datetime import datetime
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin, SecureCookieSessionInterface
+from sqlalchemy import select
+from werkzeug.datastructures import CallbackDict
+from models import db, StoredSession
+from cache import FakeRedis
+
+# Session storage, selected by SESSION_TYPE:
+#
+#   'sqlalchemy'  sessions table (indexed expires_at), swept in batches by
+#                 `flask cleanup-sessions`
+#   'redis'       shared Redis at SESSION_REDIS_URL; keys expire on their own
+#   'fakeredis'   in-process Redis stand-in, for tests and local development
+#   'cookie'      Flask's signed cookie: no server state at all
+#   'filesystem'  the previous Flask-Session file store
+#
+# Server-side stores keep only a random session id in the cookie. A session
+# is written back when it changes, or when less than half its lifetime is
+# left, so ordinary authenticated reads cost one lookup and no write.
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False, expires_at=None):
+        def on_update(self):
+            self.modified = True
+
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.expires_at = expires_at
+        self.modified = False
+
+
+class SqlSessionStore:
+    def __init__(self, cleanup_batch_size=1000):
+        self.cleanup_batch_size = cleanup_batch_size
+
+    def load(self, sid):
+        # Reads share the request's connection; writes below use their own
+        # transaction so they never commit a view's pending changes
+        row = db.session.execute(
+            select(StoredSession.data, StoredSession.expires_at).where(
+                StoredSession.id == sid, StoredSession.expires_at > datetime.utcnow())
+        ).first()
+        return (row.data, row.expires_at) if row else None
+
+    def save(self, sid, data, expires_at):
+        table = StoredSession.__table__
+        with db.engine.begin() as conn:
+            updated = conn.execute(
+                table.update().where(table.c.id == sid).values(data=data, expires_at=expires_at)
+            ).rowcount
+            if not updated:
+                conn.execute(table.insert().values(id=sid, data=data, expires_at=expires_at))
+
+    def delete(self, sid):
+        table = StoredSession.__table__
+        with db.engine.begin() as conn:
+            conn.execute(table.delete().where(table.c.id == sid))
+
+    def cleanup(self, now=None):
+        """Delete expired sessions in batches, returning how many were removed"""
+        table = StoredSession.__table__
+        now = now or datetime.utcnow()
+        removed = 0
+        while True:
+            expired = select(table.c.id).where(table.c.expires_at <= now).limit(self.cleanup_batch_size)
+            with db.engine.begin() as conn:
+                count = conn.execute(table.delete().where(table.c.id.in_(expired))).rowcount
+            removed += count
+            if count < self.cleanup_batch_size:
+                return removed
+
+
+class RedisSessionStore:
+    """Sessions in Redis (or anything speaking its API), prefixed with their expiry"""
+
+    def __init__(self, client, prefix='soko:session:'):
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, sid):
+        value = self.client.get(self.prefix + sid)
+        if value is None:
+            return None
+        expires, _, data = value.decode('utf-8').partition(':')
+        return data, datetime.utcfromtimestamp(int(expires))
+
+    def save(self, sid, data, expires_at):
+        ttl = max(int((expires_at - datetime.utcnow()).total_seconds()), 1)
+        expires = int((expires_at - datetime(1970, 1, 1)).total_seconds())
+        self.client.set(self.prefix + sid, f'{expires}:{data}', ex=ttl)
+
+    def delete(self, sid):
+        self.client.delete(self.prefix + sid)
+
+    def cleanup(self, now=None):
+        # Redis expires keys itself
+        return 0
+
+
+class ServerSideSessionInterface(SessionInterface):
+    serializer = TaggedJSONSerializer()
+
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            stored = self.store.load(sid)
+            if stored:
+                data, expires_at = stored
+                try:
+                    return ServerSideSession(self.serializer.loads(data), sid=sid, expires_at=expires_at)
+                except ValueError:
+                    pass
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        secure = self.get_cookie_secure(app)
+        samesite = self.get_cookie_samesite(app)
+        httponly = self.get_cookie_httponly(app)
+        partitioned = self.get_cookie_partitioned(app)
+
+        response.vary.add('Cookie')
+
+        if not session:
+            if session.modified and not session.new:
+                self.store.delete(session.sid)
+                response.delete_cookie(name, domain=domain, path=path, secure=secure,
+                                       samesite=samesite, httponly=httponly, partitioned=partitioned)
+            return
+
+        lifetime = app.permanent_session_lifetime
+        now = datetime.utcnow()
+        stale = session.expires_at is None or session.expires_at - now < lifetime / 2
+        if session.modified or stale:
+            self.store.save(session.sid, self.serializer.dumps(dict(session)), now + lifetime)
+
+        if session.modified or stale or self.should_set_cookie(app, session):
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=httponly, domain=domain, path=path, secure=secure,
+                                samesite=samesite, partitioned=partitioned)
+
+
+def create_store(config):
+    session_type = config.get('SESSION_TYPE', 'sqlalchemy')
+    if session_type == 'sqlalchemy':
+        return SqlSessionStore(cleanup_batch_size=config.get('SESSION_CLEANUP_BATCH_SIZE', 1000))
+    prefix = config.get('SESSION_KEY_PREFIX', 'soko:session:')
+    if session_type == 'redis':
+        import redis
+        return RedisSessionStore(redis.Redis.from_url(config['SESSION_REDIS_URL']), prefix)
+    if session_type == 'fakeredis':
+        return RedisSessionStore(FakeRedis(), prefix)
+    raise ValueError(f'Unknown SESSION_TYPE: {session_type}')
+
+
+def init_sessions(app):
+    session_type = app.config.get('SESSION_TYPE', 'sqlalchemy')
+    if session_type == 'cookie':
+        app.session_interface = SecureCookieSessionInterface()
+    elif session_type == 'filesystem':
+        from flask_session import Session
+        Session(app)
+    else:
+        app.session_interface = ServerSideSessionInterface(create_store(app.config))
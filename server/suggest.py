@@ -0,0 +1,238 @@
+import heapq
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+from flask import current_app
+from models import db, Product, Category, Subcategory
+
+# In-process autocomplete over product titles and category/subcategory names.
+#
+# Every word of an indexed phrase is registered under each of its prefixes
+# (up to MAX_PREFIX_LENGTH characters), so "bas" finds "Woven Sisal Basket".
+# Lookups intersect the posting sets of the query words and never touch the
+# database. The index is built once per worker and then updated by the
+# product routes after each commit; REBUILD_INTERVAL bounds how long another
+# worker's writes can go unseen. A stale index is rebuilt on a background
+# thread and keeps answering until the new one is swapped in; product
+# changes made meanwhile are replayed onto the new index.
+
+logger = logging.getLogger(__name__)
+
+MAX_ENTRIES = 50000
+MAX_PREFIX_LENGTH = 12
+REBUILD_INTERVAL = 600  # seconds
+
+ProductTerms = namedtuple('ProductTerms', 'id title category subcategory status')
+
+
+def tokenize(text):
+    return re.findall(r'\w+', (text or '').lower())
+
+
+class SuggestionIndex:
+    def __init__(self, max_entries=MAX_ENTRIES, max_prefix_length=MAX_PREFIX_LENGTH):
+        self.max_entries = max_entries
+        self.max_prefix_length = max_prefix_length
+        self._lock = threading.RLock()
+        self._changes = None  # product changes seen while a rebuild is loading
+        self._rebuilding = False
+        self._reset()
+
+    def _reset(self):
+        # key -> {'text', 'type', 'id', 'weight', 'refs'}
+        self._entries = {}
+        # prefix -> set of keys
+        self._postings = {}
+        self._product_terms = {}  # product id -> (title, category, subcategory)
+        self.built_at = None
+        self.dropped = 0
+
+    # -- low level -------------------------------------------------------
+
+    def _prefixes(self, text):
+        prefixes = set()
+        for word in tokenize(text):
+            for length in range(1, min(len(word), self.max_prefix_length) + 1):
+                prefixes.add(word[:length])
+        return prefixes
+
+    def _add_entry(self, key, text, entry_type, entry_id=None, weight=1):
+        entry = self._entries.get(key)
+        if entry:
+            entry['refs'] += 1
+            entry['weight'] += weight
+            return
+        if len(self._entries) >= self.max_entries:
+            self.dropped += 1
+            return
+        self._entries[key] = {'text': text, 'type': entry_type, 'id': entry_id,
+                              'weight': weight, 'refs': 1}
+        for prefix in self._prefixes(text):
+            self._postings.setdefault(prefix, set()).add(key)
+
+    def _remove_entry(self, key, weight=1):
+        entry = self._entries.get(key)
+        if not entry:
+            return
+        entry['refs'] -= 1
+        entry['weight'] -= weight
+        if entry['refs'] > 0:
+            return
+        del self._entries[key]
+        for prefix in self._prefixes(entry['text']):
+            keys = self._postings.get(prefix)
+            if keys:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[prefix]
+
+    def _add_name(self, entry_type, name):
+        if name:
+            self._add_entry((entry_type, name.lower()), name, entry_type)
+
+    def _remove_name(self, entry_type, name):
+        if name:
+            self._remove_entry((entry_type, name.lower()))
+
+    # -- product hooks ---------------------------------------------------
+
+    def add_product(self, product):
+        """Index (or re-index) a product after its insert/update commits"""
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(ProductTerms(product.id, product.title, product.category,
+                                                  product.subcategory, product.status))
+            self._remove_product_terms(product.id)
+            if product.status != 'active':
+                return
+            terms = (product.title, product.category, product.subcategory)
+            self._product_terms[product.id] = terms
+            self._add_entry(('product', product.id), product.title, 'product', product.id)
+            self._add_name('category', product.category)
+            self._add_name('subcategory', product.subcategory)
+
+    def remove_product(self, product_id):
+        """Drop a product after its delete commits"""
+        with self._lock:
+            if self._changes is not None:
+                self._changes.append(product_id)
+            self._remove_product_terms(product_id)
+
+    def _remove_product_terms(self, product_id):
+        terms = self._product_terms.pop(product_id, None)
+        if not terms:
+            return
+        _, category, subcategory = terms
+        self._remove_entry(('product', product_id))
+        self._remove_name('category', category)
+        self._remove_name('subcategory', subcategory)
+
+    # -- build & query ---------------------------------------------------
+
+    def rebuild(self):
+        """Load every active product and category name from the database, then swap them in"""
+        with self._lock:
+            self._changes = []
+        try:
+            products = db.session.query(
+                Product.id, Product.title, Product.category, Product.subcategory, Product.status
+            ).filter_by(status='active').all()
+            category_names = [name for (name,) in db.session.query(Category.name)]
+            subcategory_names = [name for (name,) in db.session.query(Subcategory.name)]
+
+            fresh = SuggestionIndex(self.max_entries, self.max_prefix_length)
+            # Taxonomy rows are pinned with one extra reference so they stay
+            # suggestible even when no active product uses them
+            for name in category_names:
+                fresh._add_name('category', name)
+            for name in subcategory_names:
+                fresh._add_name('subcategory', name)
+            for product in products:
+                fresh.add_product(product)
+
+            with self._lock:
+                for change in self._changes:
+                    if isinstance(change, ProductTerms):
+                        fresh.add_product(change)
+                    else:
+                        fresh.remove_product(change)
+                self._entries = fresh._entries
+                self._postings = fresh._postings
+                self._product_terms = fresh._product_terms
+                self.dropped = fresh.dropped
+                self.built_at = time.monotonic()
+        finally:
+            with self._lock:
+                self._changes = None
+
+    def ensure_fresh(self):
+        """Build the index on first use; past REBUILD_INTERVAL, start a background rebuild and return its thread"""
+        if self.built_at is None:
+            self.rebuild()
+            return None
+        if time.monotonic() - self.built_at <= REBUILD_INTERVAL:
+            return None
+        with self._lock:
+            if self._rebuilding:
+                return None
+            self._rebuilding = True
+        thread = threading.Thread(target=self._rebuild_in_background, args=(current_app._get_current_object(),),
+                                  name='suggest-rebuild', daemon=True)
+        thread.start()
+        return thread
+
+    def _rebuild_in_background(self, app):
+        try:
+            with app.app_context():
+                self.rebuild()
+        except Exception:
+            logger.exception('Rebuilding the suggestion index failed')
+        finally:
+            with self._lock:
+                self._rebuilding = False
+
+    def suggest(self, query, limit=10):
+        """Top suggestions whose words start with every word of query"""
+        words = tokenize(query)
+        if not words:
+            return []
+
+        with self._lock:
+            postings = []
+            for word in words:
+                keys = self._postings.get(word[:self.max_prefix_length])
+                if not keys:
+                    return []
+                postings.append(keys)
+
+            postings.sort(key=len)
+            candidates = postings[0].intersection(*postings[1:])
+            # Prefixes are truncated at max_prefix_length, so confirm longer words
+            long_words = [word for word in words if len(word) > self.max_prefix_length]
+            entries = [self._entries[key] for key in candidates]
+            if long_words:
+                entries = [
+                    entry for entry in entries
+                    if all(any(token.startswith(word) for token in tokenize(entry['text']))
+                           for word in long_words)
+                ]
+
+            best = heapq.nsmallest(
+                limit, entries,
+                key=lambda entry: (entry['type'] == 'product', -entry['weight'], entry['text'].lower())
+            )
+            return [{'text': entry['text'], 'type': entry['type'], 'id': entry['id']} for entry in best]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'prefixes': len(self._postings),
+                'dropped': self.dropped,
+                'max_entries': self.max_entries
+            }
+
+
+suggestion_index = SuggestionIndex()
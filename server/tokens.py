@@ -0,0 +1,271 @@
+import base64
+import hashlib
+import hmac
+import json
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from functools import lru_cache
+from flask import current_app
+from models import db, User, RevokedToken, dialect_insert
+
+# Signed bearer tokens for AUTH_MODE = 'jwt' or 'both'.
+#
+# Access tokens are HS256 JWTs carrying the user id (sub) and role, so
+# login_required/require_role can authorize a request without touching the
+# database or the session store. Refresh tokens are single use: POST
+# /auth/refresh revokes the presented one and issues a new pair, and a
+# refresh token presented twice revokes every token of its user.
+#
+# Signing keys are addressed by kid so JWT_SECRET_KEY can be rotated while
+# JWT_RETIRED_KEYS still verify. Revocations are stored in revoked_tokens
+# and mirrored in each worker's memory, which pulls new rows every
+# JWT_REVOCATION_SYNC_INTERVAL seconds. That mirror only serves the
+# access-token check; refresh rotation consults revoked_tokens itself and
+# spends the token by inserting its jti, which is unique, so a token
+# replayed on a worker that hasn't synced yet is still caught.
+
+EPOCH = datetime(1970, 1, 1)
+# Revocations committed by a transaction that started before the last sync
+# get this long to become visible before they could be missed
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class TokenError(Exception):
+    pass
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode('ascii')
+
+
+def _b64decode(segment):
+    try:
+        return base64.urlsafe_b64decode(segment + '=' * (-len(segment) % 4))
+    except (ValueError, TypeError):
+        raise TokenError('Malformed token')
+
+
+def _epoch(value):
+    return (value - EPOCH).total_seconds()
+
+
+@lru_cache(maxsize=16)
+def _parse_header(segment):
+    """Header segments repeat for every token of a key, so parse each once"""
+    try:
+        header = json.loads(_b64decode(segment))
+    except ValueError:
+        raise TokenError('Malformed token')
+    if not isinstance(header, dict) or header.get('alg') != 'HS256':
+        raise TokenError('Unsupported token algorithm')
+    kid = header.get('kid')
+    if kid is not None and not isinstance(kid, str):
+        raise TokenError('Malformed token')
+    return kid
+
+
+class TokenSigner:
+    def __init__(self, secret, key_id='primary', retired_keys=None):
+        keys = dict(retired_keys or {})
+        keys[key_id] = secret
+        # Keyed HMAC states are prepared once and copied per token
+        self._macs = {kid: hmac.new(key.encode('utf-8'), digestmod=hashlib.sha256) for kid, key in keys.items()}
+        self.key_id = key_id
+        self._header = _b64encode(json.dumps(
+            {'alg': 'HS256', 'typ': 'JWT', 'kid': key_id}, separators=(',', ':')).encode('utf-8'))
+
+    def _signature(self, kid, signing_input):
+        mac = self._macs[kid].copy()
+        mac.update(signing_input)
+        return mac.digest()
+
+    def encode(self, claims):
+        payload = _b64encode(json.dumps(claims, separators=(',', ':')).encode('utf-8'))
+        signing_input = f'{self._header}.{payload}'
+        return f'{signing_input}.{_b64encode(self._signature(self.key_id, signing_input.encode("ascii")))}'
+
+    def decode(self, token, token_type):
+        """Verified claims of token, which must be unexpired and of token_type"""
+        try:
+            header, payload, signature = token.split('.')
+        except (AttributeError, ValueError):
+            raise TokenError('Malformed token')
+
+        kid = _parse_header(header) or self.key_id
+        if kid not in self._macs:
+            raise TokenError('Unknown signing key')
+        try:
+            signing_input = f'{header}.{payload}'.encode('ascii')
+        except UnicodeEncodeError:
+            raise TokenError('Malformed token')
+        if not hmac.compare_digest(self._signature(kid, signing_input), _b64decode(signature)):
+            raise TokenError('Invalid token signature')
+
+        try:
+            claims = json.loads(_b64decode(payload))
+        except ValueError:
+            raise TokenError('Malformed token')
+        if not isinstance(claims, dict) or claims.get('type') != token_type:
+            raise TokenError(f'Expected a {token_type} token')
+        if claims.get('exp', 0) <= time.time():
+            raise TokenError('Token expired')
+        return claims
+
+
+class RevocationList:
+    def __init__(self, sync_interval=30):
+        self.sync_interval = sync_interval
+        self._jtis = {}  # jti -> exp (epoch seconds)
+        self._users = {}  # user id -> (revoked before, exp)
+        self._synced_until = None  # wall clock the last sync read up to
+        self._synced_at = None  # monotonic, for the sync interval
+        self._lock = threading.Lock()
+
+    def _remember(self, row):
+        expires = _epoch(row.expires_at)
+        if row.jti:
+            self._jtis[row.jti] = expires
+        elif row.user_id is not None:
+            before, _ = self._users.get(row.user_id, (0, 0))
+            self._users[row.user_id] = (max(before, _epoch(row.revoked_at)), expires)
+
+    def sync(self):
+        """Pull revocations written since the last sync and forget expired ones"""
+        started = datetime.utcnow()
+        query = RevokedToken.query.filter(RevokedToken.expires_at > started)
+        if self._synced_until is not None:
+            query = query.filter(RevokedToken.revoked_at > self._synced_until - SYNC_OVERLAP)
+        rows = query.all()
+        now = time.time()
+        with self._lock:
+            for row in rows:
+                self._remember(row)
+            self._synced_until = started
+            self._jtis = {jti: exp for jti, exp in self._jtis.items() if exp > now}
+            self._users = {uid: entry for uid, entry in self._users.items() if entry[1] > now}
+            self._synced_at = time.monotonic()
+
+    def maybe_sync(self):
+        if self._synced_at is None or time.monotonic() - self._synced_at > self.sync_interval:
+            self.sync()
+
+    def revoke(self, jti, expires):
+        """Revoke one token; False if it already was. The caller commits"""
+        # Waits on a concurrent transaction inserting the same jti, then does nothing
+        inserted = db.session.execute(dialect_insert(RevokedToken).values(
+            jti=jti, revoked_at=datetime.utcnow(), expires_at=datetime.utcfromtimestamp(expires)
+        ).on_conflict_do_nothing(index_elements=['jti'])).rowcount == 1
+        with self._lock:
+            self._jtis[jti] = expires
+        return inserted
+
+    def revoke_user(self, user_id, lifetime):
+        """Revoke every token of user_id issued until now; the caller commits"""
+        now = datetime.utcnow()
+        row = RevokedToken(user_id=user_id, revoked_at=now, expires_at=now + lifetime)
+        db.session.add(row)
+        with self._lock:
+            self._remember(row)
+
+    def jti_revoked(self, claims):
+        return claims.get('jti') in self._jtis
+
+    def is_revoked(self, claims):
+        self.maybe_sync()
+        if self.jti_revoked(claims):
+            return True
+        entry = self._users.get(int(claims['sub']))
+        return entry is not None and claims.get('iat', 0) < entry[0]
+
+
+def init_tokens(app):
+    app.extensions['token_signer'] = TokenSigner(
+        app.config.get('JWT_SECRET_KEY') or app.config['SECRET_KEY'],
+        app.config.get('JWT_KEY_ID', 'primary'),
+        app.config.get('JWT_RETIRED_KEYS'))
+    app.extensions['token_revocations'] = RevocationList(app.config.get('JWT_REVOCATION_SYNC_INTERVAL', 30))
+
+
+def _signer():
+    return current_app.extensions['token_signer']
+
+
+def _revocations():
+    return current_app.extensions['token_revocations']
+
+
+def _refresh_lifetime():
+    return timedelta(seconds=current_app.config.get('JWT_REFRESH_TTL', 30 * 24 * 3600))
+
+
+def issue_tokens(user):
+    """New access/refresh pair for user"""
+    now = time.time()
+    access_ttl = current_app.config.get('JWT_ACCESS_TTL', 900)
+    signer = _signer()
+    access = signer.encode({'sub': str(user.id), 'role': user.role, 'type': 'access',
+                            'iat': now, 'exp': int(now + access_ttl), 'jti': uuid.uuid4().hex})
+    refresh = signer.encode({'sub': str(user.id), 'type': 'refresh', 'iat': now,
+                             'exp': int(now + _refresh_lifetime().total_seconds()), 'jti': uuid.uuid4().hex})
+    return {'access_token': access, 'refresh_token': refresh, 'token_type': 'Bearer', 'expires_in': access_ttl}
+
+
+def verify_access_token(token):
+    claims = _signer().decode(token, 'access')
+    if _revocations().is_revoked(claims):
+        raise TokenError('Token revoked')
+    return claims
+
+
+def _user_revoked_since(user_id, issued_at):
+    """Whether every token of user_id issued at issued_at has been revoked, read from the database"""
+    return db.session.query(RevokedToken.query.filter(
+        RevokedToken.user_id == user_id, RevokedToken.jti.is_(None),
+        RevokedToken.revoked_at > datetime.utcfromtimestamp(issued_at),
+        RevokedToken.expires_at > datetime.utcnow()
+    ).exists()).scalar()
+
+
+def rotate_refresh_token(token):
+    """Spend a refresh token and return a new token pair; commits"""
+    claims = _signer().decode(token, 'refresh')
+    user_id = int(claims['sub'])
+    if _user_revoked_since(user_id, claims.get('iat', 0)):
+        raise TokenError('Token revoked')
+
+    user = db.session.get(User, user_id)
+    if not user:
+        raise TokenError('User not found')
+    revocations = _revocations()
+    if not revocations.revoke(claims['jti'], claims['exp']):
+        # A spent refresh token came back: assume it leaked and cut off the user
+        revocations.revoke_user(user_id, _refresh_lifetime())
+        db.session.commit()
+        raise TokenError('Refresh token reuse detected')
+    tokens = issue_tokens(user)
+    db.session.commit()
+    return tokens
+
+
+def revoke_token(token, token_type):
+    """Revoke a token presented at logout, ignoring ones that are already invalid; the caller commits"""
+    try:
+        claims = _signer().decode(token, token_type)
+    except TokenError:
+        return
+    _revocations().revoke(claims['jti'], claims['exp'])
+
+
+def revoke_user_tokens(user_id):
+    """Invalidate every token issued to user_id so far; the caller commits"""
+    _revocations().revoke_user(user_id, _refresh_lifetime())
+
+
+def prune_revocations():
+    """Delete revocations whose tokens have expired anyway"""
+    removed = RevokedToken.query.filter(RevokedToken.expires_at <= datetime.utcnow()).delete(
+        synchronize_session=False)
+    db.session.commit()
+    return removed
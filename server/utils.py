@@ -1,7 +1,12 @@
+import base64
+import json
 import logging
 import os
+from datetime import datetime
 from flask import request
 from functools import wraps
+from sqlalchemy import and_, or_
+from cache import MemoryCache
 
 # Logging setup
 def setup_logging():
@@ -43,6 +48,113 @@ def paginate_query(query, page=1, per_page=20):
         }
     }
 
+# Keyset (cursor) pagination
+class InvalidCursor(ValueError):
+    """Raised when a pagination cursor can't be decoded"""
+
+
+TOTAL_CACHE_TTL = 60  # seconds
+# Keys include free-text search, so the cache is bounded (least recently used go first)
+_total_cache = MemoryCache(max_entries=1024)
+
+
+def encode_cursor(created_at, item_id):
+    payload = json.dumps([created_at.isoformat(), item_id]).encode('utf-8')
+    return base64.urlsafe_b64encode(payload).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, item_id = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def cached_total(query, total_key):
+    """Count query rows, reusing the result for TOTAL_CACHE_TTL seconds per key"""
+    total = _total_cache.get(total_key)
+    if total is None:
+        total = query.order_by(None).count()
+        _total_cache.set(total_key, total, TOTAL_CACHE_TTL)
+    return total
+
+
+def parse_per_page(default=50):
+    """?per_page= clamped to 1..100"""
+    try:
+        return max(1, min(int(request.args.get('per_page', default)), 100))
+    except (ValueError, TypeError):
+        return default
+
+
+def keyset_paginate(query, model, per_page=50, total_key=None):
+    """Paginate query newest-first on (created_at, id) without OFFSET.
+
+    Reads ?cursor=, ?per_page= (max 100) and ?include_total= from the request.
+    The total is only counted when asked for and a total_key is given.
+    """
+    per_page = parse_per_page(per_page)
+
+    total = None
+    if total_key and request.args.get('include_total') in ('1', 'true'):
+        total = cached_total(query, total_key)
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        created_at, item_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            model.created_at < created_at,
+            and_(model.created_at == created_at, model.id < item_id)
+        ))
+
+    items = query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(items) > per_page:
+        items = items[:per_page]
+        next_cursor = encode_cursor(items[-1].created_at, items[-1].id)
+
+    return {
+        'items': items,
+        'pagination': {
+            'per_page': per_page,
+            'next_cursor': next_cursor,
+            'total': total
+        }
+    }
+
+
+def set_pagination_headers(response, pagination):
+    """Expose keyset pagination state without changing the list body"""
+    if pagination['next_cursor']:
+        response.headers['X-Next-Cursor'] = pagination['next_cursor']
+    if pagination['total'] is not None:
+        response.headers['X-Total-Count'] = str(pagination['total'])
+    return response
+
+# Sparse fieldsets
+class InvalidFields(ValueError):
+    """Raised when ?fields= names a field the payload doesn't have"""
+
+
+def parse_fields(allowed):
+    """Return the fields requested via ?fields=a,b in request order, or None for all"""
+    raw = request.args.get('fields')
+    if not raw:
+        return None
+
+    fields = []
+    for field in raw.split(','):
+        field = field.strip()
+        if field and field not in fields:
+            fields.append(field)
+
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise InvalidFields(f"Unknown field(s): {', '.join(unknown)}")
+    return fields or None
+
 # Error handler decorator
 def handle_errors(f):
     @wraps(f)